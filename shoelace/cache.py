@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+class ParseCache:
+    """
+    Content-addressed on-disk cache of parsed data sets
+
+    Entries are keyed by a hash of the source file contents together with the
+    options it was loaded with, so an unchanged file loaded with the same
+    options is served from the cache regardless of its path or modification
+    time. Entries are stored in binary format and evicted in least recently
+    used order when the cache grows beyond `max_size` bytes.
+
+    :param directory: The directory to keep cache entries in
+    :param max_size: The maximum total size of all entries in bytes, or None
+                     for an unbounded cache
+    """
+
+    suffix = '.bin'
+    version = 3
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, **options):
+        """
+        Computes the cache key of a source file
+
+        :param path: The path of the source file
+        :param options: The options the file is loaded with
+        :return: A hexadecimal key
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(json.dumps([ParseCache.version, options],
+                                 sort_keys=True).encode('utf-8'))
+        with open(path, 'rb') as file_handle:
+            for chunk in iter(lambda: file_handle.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ParseCache.suffix)
+
+    def lookup(self, key):
+        """
+        Looks up an entry, marking it as recently used
+
+        :param key: The cache key
+        :return: The path of the entry, or None if it is not cached
+        """
+        path = self.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def store(self, key, save):
+        """
+        Stores an entry atomically and evicts old entries if necessary
+
+        :param key: The cache key
+        :param save: A function that writes the entry to a binary file handle
+        :return: The path of the entry
+        """
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory,
+                                                 suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file_handle:
+                save(file_handle)
+            os.replace(temporary, self.path(key))
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.evict()
+        return self.path(key)
+
+    def entries(self):
+        """
+        Returns the paths of all entries, least recently used first
+        """
+        paths = [os.path.join(self.directory, name)
+                 for name in os.listdir(self.directory)
+                 if name.endswith(ParseCache.suffix)]
+        return sorted(paths, key=os.path.getmtime)
+
+    def evict(self):
+        """
+        Removes least recently used entries until the cache fits in `max_size`
+        bytes. The most recently used entry is always kept.
+        """
+        if self.max_size is None:
+            return
+        entries = self.entries()
+        total = sum(os.path.getsize(path) for path in entries)
+        for path in entries[:-1]:
+            if total <= self.max_size:
+                break
+            total -= os.path.getsize(path)
+            os.remove(path)
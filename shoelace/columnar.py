@@ -0,0 +1,139 @@
+import io
+import json
+import struct
+
+import numpy as np
+
+
+MAGIC = b'SHOELACE'
+VERSION = 1
+ALIGNMENT = 64
+
+_PREAMBLE = struct.Struct('<8sIQ')
+
+
+def _aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def save_arrays(file_handle, arrays, attributes=None):
+    """
+    Writes a collection of arrays in a versioned columnar binary format.
+
+    The file starts with a small preamble (magic bytes, format version and
+    header length) followed by a JSON header that describes the dtype, shape
+    and offset of every array. The raw array contents follow, each one aligned
+    to `ALIGNMENT` bytes so they can be memory-mapped directly.
+
+    :param file_handle: A binary file handle to write to
+    :param arrays: A dictionary of names to `np.ndarray` objects
+    :param attributes: A dictionary of JSON-serializable scalar attributes
+    """
+    arrays = {name: np.ascontiguousarray(array)
+              for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise ValueError("Array '{}' has object dtype".format(name))
+
+    # Offsets depend on the header length and vice versa, so grow the reserved
+    # header space until everything fits
+    header_size = ALIGNMENT
+    while True:
+        offset = _aligned(_PREAMBLE.size + header_size)
+        descriptions = {}
+        for name, array in arrays.items():
+            descriptions[name] = {'dtype': array.dtype.str,
+                                  'shape': list(array.shape),
+                                  'offset': offset}
+            offset = _aligned(offset + array.nbytes)
+        header = json.dumps({'attributes': attributes or {},
+                             'arrays': descriptions,
+                             'size': offset}).encode('utf-8')
+        if len(header) <= header_size:
+            break
+        header_size = _aligned(len(header))
+
+    start = file_handle.tell()
+    file_handle.write(_PREAMBLE.pack(MAGIC, VERSION, header_size))
+    file_handle.write(header.ljust(header_size))
+    for name, array in arrays.items():
+        position = file_handle.tell() - start
+        file_handle.write(b'\0' * (descriptions[name]['offset'] - position))
+        file_handle.write(array.data.cast('B') if array.nbytes > 0 else b'')
+    file_handle.write(b'\0' * (offset - (file_handle.tell() - start)))
+
+
+def is_columnar(file_handle):
+    """
+    Checks whether a file handle is positioned at the start of a columnar file
+    without moving it
+
+    :param file_handle: A binary file handle
+    :return: True if the next bytes are the columnar magic bytes
+    """
+    start = file_handle.tell()
+    magic = file_handle.read(len(MAGIC))
+    file_handle.seek(start)
+    return magic == MAGIC
+
+
+def read_header(file_handle):
+    """
+    Reads only the header of a columnar file, leaving the file handle right
+    after it
+
+    :param file_handle: A binary file handle
+    :return: The header as a dictionary
+    """
+    magic, version, header_size = _PREAMBLE.unpack(
+        file_handle.read(_PREAMBLE.size))
+    if magic != MAGIC:
+        raise ValueError("Not a shoelace columnar file")
+    if version > VERSION:
+        raise ValueError("Unsupported columnar format version {}".format(
+            version))
+    return json.loads(file_handle.read(header_size).decode('utf-8'))
+
+
+def _has_fileno(file_handle):
+    try:
+        file_handle.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return False
+    return True
+
+
+def load_arrays(file_handle, mmap_mode='r'):
+    """
+    Loads a collection of arrays written by `save_arrays`.
+
+    When the file handle refers to a file on disk and `mmap_mode` is set, the
+    arrays are memory-mapped instead of read. Loading is then nearly instant
+    and processes that map the same file share its pages in the page cache.
+
+    :param file_handle: A binary file handle to read from
+    :param mmap_mode: A `np.memmap` mode ('r', 'r+' or 'c'), or None to read
+                      the arrays into memory
+    :return: A tuple of a dictionary of arrays and a dictionary of attributes
+    """
+    start = file_handle.tell()
+    header = read_header(file_handle)
+    mmap = mmap_mode is not None and _has_fileno(file_handle)
+
+    arrays = {}
+    for name, description in header['arrays'].items():
+        dtype = np.dtype(description['dtype'])
+        shape = tuple(description['shape'])
+        offset = start + description['offset']
+        if mmap and 0 not in shape:
+            array = np.memmap(file_handle, dtype=dtype, mode=mmap_mode,
+                              offset=offset, shape=shape)
+        else:
+            array = np.empty(shape, dtype=dtype)
+            file_handle.seek(offset)
+            if array.nbytes > 0:
+                file_handle.readinto(array.data.cast('B'))
+        arrays[name] = array
+
+    file_handle.seek(start + header['size'])
+    return arrays, header['attributes']
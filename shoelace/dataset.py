@@ -1,11 +1,46 @@
-import re
+import os
 import numpy as np
 import pickle
-from collections import defaultdict
 from chainer.dataset.dataset_mixin import DatasetMixin
 
+from shoelace import columnar, dtypes, normalization, sparse, svmrank
+from shoelace.cache import ParseCache
+from shoelace.metadata import QueryMetadata
 
-class LtrDataset(DatasetMixin):
+
+class QuerySubsetMixin:
+    """
+    Query selection for data sets with a query pointer. Subsets share the
+    arrays of the data set they are taken from.
+    """
+
+    def subset(self, query_indices):
+        """
+        Selects a subset of queries without copying any documents
+
+        :param query_indices: The indices of the queries to select
+        :return: A `LtrSubset` object
+        """
+        return LtrSubset(self, query_indices)
+
+    def folds(self, k, shuffle=True, seed=None):
+        """
+        Splits the queries into k folds for cross-validation
+
+        :param k: The number of folds
+        :param shuffle: Whether to assign queries to folds randomly
+        :param seed: The seed of the random assignment
+        :return: A list of k (training subset, test subset) tuples
+        """
+        order = np.arange(len(self))
+        if shuffle:
+            order = np.random.RandomState(seed).permutation(len(self))
+        parts = np.array_split(order, k)
+        return [(self.subset(np.concatenate(parts[:i] + parts[i + 1:])),
+                 self.subset(part)) for i, part in enumerate(parts)]
+
+
+class LtrDataset(DatasetMixin, QuerySubsetMixin):
 
     """
     Implementation of Learning to Rank data set
@@ -23,6 +58,7 @@ class LtrDataset(DatasetMixin):
         self.query_pointer = query_pointer
         self.query_ids = query_ids
         self.nr_queries = nr_of_queries
+        self._metadata = None
 
     def __len__(self):
         """
@@ -47,132 +83,335 @@ class LtrDataset(DatasetMixin):
         if i < 0 or i >= self.nr_queries:
             raise IndexError
 
-        start = self.query_pointer[i]
-        end = self.query_pointer[i+1]
+        return LtrQuery(self, i)
+
+    @property
+    def metadata(self):
+        """
+        The per-query metadata table of the relevance labels, built on first
+        use
 
-        return LtrDataset(self.feature_vectors[start:end, :],
-                          self.relevance_scores[start:end], np.zeros(1),
-                          [self.query_ids[i]], 1)
+        :return: A `shoelace.metadata.QueryMetadata` object
+        """
+        if getattr(self, '_metadata', None) is None:
+            self._metadata = QueryMetadata(self.relevance_scores,
+                                           self.query_pointer)
+        return self._metadata
 
-    def normalize(self):
-        for i in range(self.nr_queries):
-            start = self.query_pointer[i]
-            end = self.query_pointer[i+1]
+    def normalize(self, method='minmax'):
+        """
+        Normalizes the feature vectors in place
 
-            self.feature_vectors[start:end, :] -= np.min(self.feature_vectors[start:end, :], axis=0)
-            maximum = np.max(self.feature_vectors[start:end, :], axis=0)
-            maximum[maximum == 0.0] = 1.0
-            self.feature_vectors[start:end, :] /= maximum
+        :param method: One of 'minmax' (per-query min-max scaling), 'zscore'
+                       (per-query standardization) or 'standardize' (global
+                       standardization). Sparse feature vectors only support
+                       'minmax'.
+        """
+        if method not in normalization.normalizers:
+            raise ValueError("Unknown normalization method '{}'".format(method))
+        if self.feature_vectors.dtype == dtypes.BFLOAT16:
+            raise ValueError("Cannot normalize bfloat16 feature vectors in "
+                             "place")
+        normalization.normalizers[method](self.feature_vectors,
+                                          self.query_pointer)
 
     @classmethod
-    def load_txt(cls, file_handle, normalize=False):
+    def load_txt(cls, file_handle, normalize=False, n_jobs=1, sparse=False,
+                 cache=None, dtype=np.float32):
         """
         Loads a learning to rank dataset from a text file source
-        
-        :param filepaths: A single file path as a string or a list of file paths 
+
+        :param file_handle: A text or binary file handle in SVMRank format, or
+                            a path (decompressed on the fly if it ends in .gz,
+                            .xz or .bz2)
+        :param normalize: Whether to normalize, either a boolean for
+                          query-level min-max normalization or the name of a
+                          normalization method (see `normalize`)
+        :param n_jobs: Number of processes to parse with, only used for
+                       uncompressed files on disk
+        :param sparse: Whether to store the feature vectors in CSR layout
+        :param cache: A `shoelace.cache.ParseCache` or a cache directory. If
+                      given, a repeated load of an unchanged file on disk with
+                      the same options is served from the binary cache.
+        :param dtype: The dtype to store the feature vectors in, e.g.
+                      `np.float16` or 'bfloat16' to halve their footprint.
+                      Iterators upcast reduced precision features per batch.
         :return: A `class:dataset.dataset.LtrDataset` object
-        """
 
-        # Iterate over lines in the file
-        data_set = defaultdict(list)
-        for line in file_handle:
-
-            # Extract the data point information
-            data_point = LtrDataPoint(line)
-            data_set[data_point.qid].append(data_point)
-
-        # Convert feature vectors, relevance scores and query pointer to correct
-        # form
-        query_ids = list(data_set.keys())
-        query_pointer = np.array([len(data_set[query]) for query in data_set])
-        query_pointer = np.cumsum(query_pointer)
-        query_pointer = np.hstack([np.array([0]), query_pointer])
-        nr_of_queries = len(data_set)
-        feature_vectors = np.vstack([data_point.feature_vector
-                                     for query in data_set
-                                     for data_point in data_set[query]])
-        relevance_scores = np.vstack([data_point.relevance
-                                      for query in data_set
-                                      for data_point in data_set[query]])
+        Comments (everything after a `#` on a line) are skipped while parsing
+        and are not kept in the data set, docids that should survive a
+        round-trip through `save_txt` have to be stored separately.
+        """
+        path = file_handle if isinstance(file_handle, str) else \
+            getattr(file_handle, 'name', None)
+        if not isinstance(path, str) or not os.path.isfile(path):
+            path = None
+
+        if cache is not None and path is not None:
+            if isinstance(cache, str):
+                cache = ParseCache(cache)
+            key = cache.key(path, normalize=normalize, sparse=sparse,
+                            dtype=str(dtypes.feature_dtype(dtype)))
+            cached = cache.lookup(key)
+            if cached is not None:
+                with open(cached, 'rb') as handle:
+                    return cls.load(handle, mmap_mode='c')
+            result = cls.load_txt(file_handle, normalize, n_jobs, sparse,
+                                  dtype=dtype)
+            cache.store(key, result.save)
+            return result
+
+        if isinstance(file_handle, str):
+            with svmrank.open_file(file_handle, 'rb') as handle:
+                return cls.load_txt(handle, normalize, n_jobs, sparse,
+                                    dtype=dtype)
+
+        # Tokenize the file in large blocks straight into numpy arrays
+        if n_jobs > 1 and path is not None and not svmrank.is_compressed(path):
+            parsed = svmrank.parse_parallel(path, n_jobs)
+        else:
+            parsed = svmrank.parse(file_handle)
+        nr_of_queries = len(parsed.query_ids)
+
+        # Group lines by query, only reordering rows when a query is scattered
+        # across the file
+        order, query_pointer = svmrank.query_order(parsed.qids, nr_of_queries)
+        to_features = svmrank.sparse_features if sparse else \
+            svmrank.dense_features
+        feature_vectors = to_features(parsed.indptr, parsed.indices,
+                                      parsed.values, dtype=np.float32)
+
+        # Store labels, pointers and query identifiers compactly
+        relevance_scores = parsed.labels[:, None].astype(
+            dtypes.label_dtype(parsed.labels))
+        query_pointer = query_pointer.astype(
+            dtypes.index_dtype(query_pointer[-1]))
+        query_ids = np.asarray(parsed.query_ids, dtype=np.str_)
+        if order is not None:
+            feature_vectors = feature_vectors[order]
+            relevance_scores = relevance_scores[order]
 
         # Free memory
-        del data_set
+        del parsed
 
         # Generate object to return
         result = LtrDataset(feature_vectors, relevance_scores, query_pointer,
                             query_ids, nr_of_queries)
 
-        # If normalization is necessary, do so
+        # If normalization is necessary, do so in place on the float32 features
+        # before reducing their precision
         if normalize:
-            result.normalize()
-
-        # Cast to float32 (after normalization) which is typical format in
-        # chainer
-        result.feature_vectors = result.feature_vectors.astype(dtype=np.float32)
+            result.normalize('minmax' if normalize is True else normalize)
+        result.feature_vectors = dtypes.astype(result.feature_vectors, dtype)
 
         # Return result
         return result
 
-    def save_txt(self, file_handle):
+    def save_txt(self, file_handle, comments=None, skip_zeros=False,
+                 fmt=None):
         """
         Saves the data set in txt format to given file
-        
-        :param file_handle: The file to save to 
-        """
-        for i in range(self.nr_queries):
-            start = self.query_pointer[i]
-            end = self.query_pointer[i + 1]
-            for j in range(start, end):
-                features = " ".join('{i}:{v}'.format(i=i,
-                                                     v=self.feature_vectors[j, i])
-                                    for i in range(len(self.feature_vectors[j])))
-                out = '{r} qid:{qid} {features}\n'.format(r=self.relevance_scores[j,0],
-                                                      qid=self.query_ids[i],
-                                                      features=features)
-                file_handle.write(out)
+
+        :param file_handle: The file to save to, either a text or binary file
+                            handle or a path (compressed if it ends in .gz, .xz
+                            or .bz2)
+        :param comments: Optional sequence of per-document comments, such as
+                         docids, written after a `#` at the end of every line.
+                         `load_txt` does not read these comments back.
+        :param skip_zeros: Whether to leave out zero-valued features. Sparse
+                           data sets only write their stored values. Either
+                           way the highest feature index is written at least
+                           once, so the number of features is preserved.
+        :param fmt: The printf-style format of feature values, by default one
+                    that represents every value exactly
+        """
+        if isinstance(file_handle, str):
+            with svmrank.open_file(file_handle, 'wb') as handle:
+                self.save_txt(handle, comments, skip_zeros, fmt)
+            return
+
+        svmrank.write(file_handle, self.feature_vectors, self.relevance_scores,
+                      self.query_pointer, self.query_ids, comments=comments,
+                      skip_zeros=skip_zeros, fmt=fmt)
 
     def save(self, file_handle):
         """
         Saves the data set in binary format to given file
-        
-        :param file_handle: The file to save to
+
+        The arrays are stored in the versioned columnar format of
+        `shoelace.columnar`, which can be memory-mapped when loading.
+
+        :param file_handle: The binary file to save to
         """
-        pickle.dump(self, file_handle)
+        query_ids = np.char.encode(np.asarray(self.query_ids, dtype=np.str_),
+                                   'utf-8')
+        arrays = {
+            'relevance_scores': self.relevance_scores,
+            'query_pointer': self.query_pointer,
+            'query_ids': query_ids
+        }
+        attributes = {'nr_queries': int(self.nr_queries)}
+        if isinstance(self.feature_vectors, sparse.CsrFeatures):
+            arrays['feature_data'] = self.feature_vectors.data
+            arrays['feature_indices'] = self.feature_vectors.indices
+            arrays['feature_indptr'] = self.feature_vectors.indptr
+            attributes['nr_features'] = self.feature_vectors.shape[1]
+        else:
+            arrays['feature_vectors'] = self.feature_vectors
+        columnar.save_arrays(file_handle, arrays, attributes)
 
     @classmethod
-    def load(cls, file_handle):
+    def load(cls, file_handle, mmap_mode='r'):
         """
         Loads the data set in binary format from given file
-        
-        :param file_handle: The file to load from 
+
+        If the file handle refers to a file on disk, the arrays are
+        memory-mapped so loading does not copy them into private memory. Use
+        `mmap_mode='c'` for arrays that can be modified in memory (e.g. to
+        normalize them) or `mmap_mode=None` to read everything into memory.
+        Files written by older versions with pickle can still be loaded.
+
+        :param file_handle: The binary file to load from
+        :param mmap_mode: The `np.memmap` mode, or None to disable mapping
         :return: A `class:dataset.dataset.LtrDataset` object
         """
-        return pickle.load(file_handle)
+        if not columnar.is_columnar(file_handle):
+            return pickle.load(file_handle)
+
+        arrays, attributes = columnar.load_arrays(file_handle, mmap_mode)
+        query_ids = np.char.decode(arrays['query_ids'], 'utf-8')
+        if 'feature_data' in arrays:
+            indptr = arrays['feature_indptr']
+            feature_vectors = sparse.CsrFeatures(
+                arrays['feature_data'], arrays['feature_indices'], indptr,
+                (indptr.shape[0] - 1, attributes['nr_features']))
+        else:
+            feature_vectors = arrays['feature_vectors']
+        return LtrDataset(feature_vectors, arrays['relevance_scores'],
+                          arrays['query_pointer'], query_ids,
+                          attributes['nr_queries'])
+
+
+class LtrQuery:
+    """
+    A lightweight view on the documents of a single query of a data set
+
+    The feature vectors and relevance scores are slices of the arrays of the
+    data set (sparse feature vectors are densified and reduced precision
+    feature vectors upcast to float32 on access). The view has
+    the same attributes as a data set with a single query.
+    """
+
+    __slots__ = ('dataset', 'index', 'start', 'end')
+
+    nr_queries = 1
+
+    def __init__(self, dataset, index):
+        self.dataset = dataset
+        self.index = index
+        self.start = dataset.query_pointer[index]
+        self.end = dataset.query_pointer[index + 1]
+
+    def __len__(self):
+        return 1
+
+    @property
+    def feature_vectors(self):
+        return sparse.toarray(dtypes.upcast(
+            self.dataset.feature_vectors[self.start:self.end]))
+
+    @property
+    def relevance_scores(self):
+        return self.dataset.relevance_scores[self.start:self.end]
+
+    @property
+    def query_pointer(self):
+        return np.array([0, self.end - self.start])
+
+    @property
+    def query_ids(self):
+        return self.dataset.query_ids[self.index:self.index + 1]
+
+    @property
+    def label_order(self):
+        """
+        The documents of the query sorted by descending relevance label
+        """
+        return self.dataset.metadata.query_order(self.index)
+
+    def ideal_dcg(self, k=0):
+        """
+        Returns the ideal DCG@k of the query from the data set metadata
+        """
+        return self.dataset.metadata.ideal_dcg(k)[self.index]
 
 
-class LtrDataPoint:
+class LtrSubset(DatasetMixin, QuerySubsetMixin):
     """
-    A single learning to rank data point, contains a query identifier, a
-    relevance label and a feature vector
+    A subset of the queries of a data set
+
+    The subset shares the feature vectors, relevance scores and query pointer
+    of the data set it is taken from and only keeps an index of the selected
+    queries, so selecting folds of even very large data sets does not copy any
+    documents. Iterators visit the selected queries through `query_index`.
+
+    :param dataset: The data set to select queries from
+    :param query_indices: The indices of the selected queries
     """
 
-    qid_regex = re.compile(".*qid:([0-9]+).*")
-    relevance_regex = re.compile("^[0-9]+")
-    feature_regex = re.compile("([0-9]+):([^ ]+)")
-
-    def __init__(self, line):
-
-        # Remove comment
-        comment_start = line.find("#")
-        if comment_start >= 0:
-            line = line[:comment_start]
-
-        # Extract qid
-        self.qid = re.search(LtrDataPoint.qid_regex, line).group(1)
-        self.relevance = re.search(LtrDataPoint.relevance_regex, line).group(0)
-        features = re.findall(LtrDataPoint.feature_regex, line)
-        minimum = min(int(index) for index, _ in features)
-        maximum = max(int(index) for index, _ in features)
-        self.feature_vector = np.zeros(1 + maximum - minimum)
-        for index, value in features:
-            self.feature_vector[int(index) - minimum] = float(value)
+    def __init__(self, dataset, query_indices):
+        query_indices = np.asarray(query_indices, dtype=np.int64)
+        if isinstance(dataset, LtrSubset):
+            query_indices = dataset.query_index[query_indices]
+            dataset = dataset.dataset
+        if np.any((query_indices < 0) | (query_indices >= len(dataset))):
+            raise IndexError
+        self.dataset = dataset
+        self.query_index = query_indices
+        self.nr_queries = query_indices.shape[0]
+
+    def __len__(self):
+        """
+        Returns the number of queries.
+        """
+        return self.nr_queries
+
+    @property
+    def feature_vectors(self):
+        return self.dataset.feature_vectors
+
+    @property
+    def relevance_scores(self):
+        return self.dataset.relevance_scores
+
+    @property
+    def query_pointer(self):
+        return self.dataset.query_pointer
+
+    @property
+    def query_ids(self):
+        return np.asarray(self.dataset.query_ids)[self.query_index]
+
+    @property
+    def metadata(self):
+        """
+        The metadata table of the parent data set, indexed by the queries of
+        the parent data set (see `query_index`)
+        """
+        return self.dataset.metadata
+
+    def get_example(self, i):
+        """
+        Returns the i-th example.
+
+        Args:
+            i (int): The index of the example.
+
+        Returns:
+            The i-th example.
+
+        """
+        if i < 0 or i >= self.nr_queries:
+            raise IndexError
+
+        return self.dataset.get_example(int(self.query_index[i]))
@@ -0,0 +1,130 @@
+import numpy as np
+
+from shoelace import sparse
+
+
+# bfloat16 values (the upper half of a float32) are stored in uint16 arrays,
+# as numpy has no bfloat16 type. Feature vectors never have an integer dtype
+# otherwise, so a uint16 feature array is always interpreted as bfloat16.
+BFLOAT16 = np.dtype(np.uint16)
+
+feature_dtypes = {
+    'float64': np.dtype(np.float64),
+    'float32': np.dtype(np.float32),
+    'float16': np.dtype(np.float16),
+    'bfloat16': BFLOAT16
+}
+
+
+def feature_dtype(dtype):
+    """
+    Resolves a feature dtype, either a numpy dtype or one of the names in
+    `feature_dtypes` (including 'bfloat16')
+
+    :param dtype: The dtype or its name
+    :return: A `np.dtype`
+    """
+    if isinstance(dtype, str):
+        if dtype not in feature_dtypes:
+            raise ValueError("Unknown feature dtype '{}'".format(dtype))
+        return feature_dtypes[dtype]
+    dtype = np.dtype(dtype)
+    if dtype != BFLOAT16 and dtype.kind != 'f':
+        raise ValueError("Unsupported feature dtype '{}'".format(dtype))
+    return dtype
+
+
+def to_bfloat16(values):
+    """
+    Rounds float values to bfloat16 (round half to even)
+
+    :param values: A float `np.ndarray`
+    :return: A uint16 `np.ndarray` holding bfloat16 values
+    """
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    rounded = bits + (np.uint32(0x7FFF) + ((bits >> 16) & 1))
+    result = (rounded >> 16).astype(np.uint16)
+    nan = np.isnan(values)
+    if np.any(nan):
+        result[nan] = ((bits[nan] >> 16) | 0x40).astype(np.uint16)
+    return result
+
+
+def from_bfloat16(values, dtype=np.float32):
+    """
+    Converts bfloat16 values to float
+
+    :param values: A uint16 `np.ndarray` holding bfloat16 values
+    :param dtype: The float dtype of the result
+    :return: A float `np.ndarray`
+    """
+    result = (values.astype(np.uint32) << 16).view(np.float32)
+    return result if dtype == np.float32 else result.astype(dtype)
+
+
+def astype(features, dtype):
+    """
+    Converts feature vectors to given feature dtype
+
+    :param features: A float `np.ndarray` or `shoelace.sparse.CsrFeatures`
+    :param dtype: The feature dtype (see `feature_dtype`)
+    :return: The converted feature vectors
+    """
+    dtype = feature_dtype(dtype)
+    if isinstance(features, sparse.CsrFeatures):
+        return sparse.CsrFeatures(astype(features.data, dtype),
+                                  features.indices, features.indptr,
+                                  features.shape)
+    if features.dtype == dtype:
+        return features
+    if features.dtype == BFLOAT16:
+        features = from_bfloat16(features)
+    if dtype == BFLOAT16:
+        return to_bfloat16(features)
+    return features.astype(dtype)
+
+
+def upcast(features, dtype=np.float32):
+    """
+    Converts a batch of reduced precision (float16 or bfloat16) feature
+    vectors to float32, leaving other feature vectors untouched
+
+    :param features: A `np.ndarray` or `shoelace.sparse.CsrFeatures` object
+    :param dtype: The float dtype to convert to
+    :return: The feature vectors with at least float32 precision
+    """
+    if features.dtype.itemsize >= 4:
+        return features
+    return astype(features, dtype)
+
+
+def label_dtype(labels):
+    """
+    Returns the smallest dtype that holds given relevance labels exactly:
+    uint8, int8 or int16 for integer labels, float32 or float64 otherwise
+
+    Consumers that do arithmetic on labels (gains, negation, differences)
+    cast them to a float dtype first.
+
+    :param labels: The relevance labels
+    :return: A `np.dtype`
+    """
+    labels = np.asarray(labels, dtype=np.float64)
+    if labels.size > 0 and np.all(np.mod(labels, 1) == 0):
+        for dtype in (np.uint8, np.int8, np.int16):
+            info = np.iinfo(dtype)
+            if labels.min() >= info.min and labels.max() <= info.max:
+                return np.dtype(dtype)
+    if np.array_equal(labels.astype(np.float32), labels, equal_nan=True):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def index_dtype(size):
+    """
+    Returns int32 if given size fits in it and int64 otherwise
+
+    :param size: The largest value the index array holds
+    :return: A `np.dtype`
+    """
+    return np.dtype(np.int32 if size <= np.iinfo(np.int32).max else np.int64)
@@ -1,9 +1,11 @@
+import numpy as np
 from chainer import cuda, function
 
 
 class NDCG(function.Function):
-    def __init__(self, k=0):
+    def __init__(self, k=0, idcg=None):
         self.k = k
+        self.idcg = idcg
 
     def forward(self, inputs):
         xp = cuda.get_array_module(*inputs)
@@ -17,30 +19,43 @@ class NDCG(function.Function):
         if t.shape[0] == 0:
             return xp.asarray(0.0),
 
-        # Compute predicted indices by arg sorting
-        predicted_indices = xp.argsort(y)
-        best_indices = xp.argsort(t)
-
-        # Predicted and theoretically best relevance labels
-        predicted_relevance = xp.flip(t[predicted_indices], axis=0)
-        best_relevance = xp.flip(t[best_indices], axis=0)
+        # Labels may be stored in a compact integer dtype, in which gains
+        # overflow
+        if t.dtype.kind != 'f':
+            t = t.astype(xp.float64)
 
         # Compute needed statistics
-        length = predicted_relevance.shape[0]
-        arange = xp.arange(length)
+        length = t.shape[0]
         last = min(self.k, length)
         if last < 1:
             last = length
+        arange = xp.arange(last)
+
+        # Predicted relevance labels of the top documents, ordered by
+        # descending prediction with ties in reverse document order. Only the
+        # top documents are sorted when there is a cut-off.
+        if last < length:
+            predicted_relevance = t[_top_k(xp, y, last)]
+        else:
+            predicted_relevance = xp.flip(t[xp.argsort(y, kind='stable')],
+                                          axis=0)
 
         # Compute regular DCG
         dcg_numerator = 2 ** predicted_relevance[:last] - 1
-        dcg_denominator = xp.log2(arange[:last] + 2)
+        dcg_denominator = xp.log2(arange + 2)
         dcg = xp.sum(dcg_numerator / dcg_denominator)
 
-        # Compute iDCG for normalization
-        idcg_numerator = (2 ** best_relevance[:last] - 1)
-        idcg_denominator = (xp.log2(arange[:last] + 2))
-        idcg = xp.sum(idcg_numerator / idcg_denominator)
+        # Compute iDCG for normalization, unless it was precomputed
+        idcg = self.idcg
+        if idcg is None:
+            if last < length:
+                best_relevance = xp.flip(xp.sort(xp.partition(
+                    t, length - last)[length - last:]), axis=0)
+            else:
+                best_relevance = xp.flip(xp.sort(t), axis=0)
+            idcg_numerator = (2 ** best_relevance - 1)
+            idcg_denominator = (xp.log2(arange + 2))
+            idcg = xp.sum(idcg_numerator / idcg_denominator)
 
         if idcg == 0.0:
             return xp.asarray(1.0),
@@ -48,7 +63,26 @@ class NDCG(function.Function):
         return xp.asarray(dcg / idcg),
 
 
-def ndcg(y, t, k=0):
+def _top_k(xp, values, k):
+    """
+    Selects the k largest values with a partition and sorts only those, in
+    descending order. Equal values are ordered (and cut off) by descending
+    index, the order of a stable sort that is flipped.
+
+    :param xp: The array module
+    :param values: A 1-dimensional array
+    :param k: The number of values to select, smaller than the array
+    :return: The indices of the k largest values
+    """
+    kth = values.shape[0] - k
+    threshold = values[xp.argpartition(values, kth)[kth]]
+    above = xp.flatnonzero(values > threshold)
+    tied = xp.flatnonzero(values == threshold)
+    top = xp.concatenate([above, tied[tied.shape[0] - (k - above.shape[0]):]])
+    return top[xp.lexsort(xp.stack([top, values[top]]))[::-1]]
+
+
+def ndcg(y, t, k=0, idcg=None):
     """
     Computes the nDCG@k for given list of true relevance labels (y_true) and
     given list of predicted relevance labels (y_score)
@@ -57,6 +91,227 @@ def ndcg(y, t, k=0):
     :param y_score: The predicted relevance scores
     :param k: The cut-off point (if set to smaller or equal to 0, it does not
               cut-off)
+    :param idcg: The ideal DCG@k of the query, if it is known in advance (see
+                 `shoelace.metadata.QueryMetadata.ideal_dcg`)
     :return: The nDCG@k value
     """
-    return NDCG(k=k)(y, t)
+    return NDCG(k=k, idcg=idcg)(y, t)
+
+
+def evaluate_ndcg(dataset, scores, cutoffs=(1, 3, 5, 10, 0)):
+    """
+    Computes the nDCG@k of every query of a data set at once
+
+    All queries are ranked with a single sort of the documents by query and
+    descending score (ties in reverse document order, like `ndcg`), and the
+    ideal DCG is taken from the metadata of the data set.
+
+    :param dataset: A data set with metadata, e.g. a
+                    `shoelace.dataset.LtrDataset` or a subset of one
+    :param scores: The predicted score of every document, aligned with the
+                   feature vectors of the data set. For a subset, either
+                   the scores of the documents of its queries in subset
+                   order (as an unshuffled `LtrIterator` visits them) or of
+                   all documents of the parent data set.
+    :param cutoffs: The cut-off points (0 means no cut-off)
+    :return: A tuple of a dict with the nDCG@k of every query per cut-off and
+             a dict with the mean nDCG@k per cut-off
+    """
+    metadata, labels, ranks = _rank(dataset, scores)
+    gains = (2 ** labels - 1) / np.log2(ranks + 2)
+    per_query = {}
+    for k in cutoffs:
+        k = max(int(k), 0)
+        per_query[k] = _ndcg(metadata, gains, ranks, k)
+    return per_query, _means(per_query)
+
+
+def evaluate(dataset, scores, cutoffs=(1, 3, 5, 10, 0),
+             metrics=('ndcg', 'map', 'mrr', 'err', 'precision')):
+    """
+    Computes the standard LETOR metrics of every query of a data set from a
+    single ranking of all queries (see `evaluate_ndcg`)
+
+    * 'ndcg': nDCG@k with gains 2^label - 1
+    * 'map': average precision, 0 for queries without relevant documents
+    * 'mrr': reciprocal rank of the first relevant document
+    * 'err': expected reciprocal rank@k (Chapelle et al, 2009), with the
+      maximum label of the data set as the maximum grade
+    * 'precision': the fraction of relevant documents in the top k
+
+    Documents with a label above 0 are relevant. Metrics with a cut-off are
+    reported as '<metric>@<k>' (or as '<metric>' for the cut-off 0).
+
+    :param dataset: A data set with metadata, e.g. a
+                    `shoelace.dataset.LtrDataset` or a subset of one
+    :param scores: The predicted score of every document, aligned with the
+                   feature vectors of the data set. For a subset, either
+                   the scores of the documents of its queries in subset
+                   order (as an unshuffled `LtrIterator` visits them) or of
+                   all documents of the parent data set.
+    :param cutoffs: The cut-off points (0 means no cut-off)
+    :param metrics: The metrics to compute
+    :return: A tuple of a dict with the metric of every query per metric name
+             and a dict with the mean per metric name
+    """
+    for metric in metrics:
+        if metric not in ('ndcg', 'map', 'mrr', 'err', 'precision'):
+            raise ValueError("Unknown metric '{}'".format(metric))
+    metadata, labels, ranks = _rank(dataset, scores)
+    nr_of_queries = len(metadata)
+    lengths = metadata.lengths
+    relevant = (labels > 0).astype(np.float64)
+    found = _cumsum_per_query(metadata, relevant)
+
+    per_query = {}
+    if 'map' in metrics:
+        total = np.bincount(metadata.queries, weights=relevant,
+                            minlength=nr_of_queries)
+        precisions = np.bincount(metadata.queries,
+                                 weights=relevant * found / (ranks + 1),
+                                 minlength=nr_of_queries)
+        per_query['map'] = np.divide(precisions, total,
+                                     out=np.zeros(nr_of_queries),
+                                     where=total > 0)
+    if 'mrr' in metrics:
+        first = relevant * (found == 1)
+        per_query['mrr'] = np.bincount(metadata.queries,
+                                       weights=first / (ranks + 1),
+                                       minlength=nr_of_queries)
+    if 'err' in metrics:
+        # The probability to stop at every document and to get there
+        top = metadata.levels[-1] if metadata.levels.shape[0] > 0 else 0.0
+        stop = (2 ** labels - 1) / 2 ** max(top, 0.0)
+        survive = _cumsum_per_query(metadata, np.log1p(-stop))
+        reach = np.exp(survive - np.log1p(-stop))
+        err = reach * stop / (ranks + 1)
+    if 'ndcg' in metrics:
+        gains = (2 ** labels - 1) / np.log2(ranks + 2)
+
+    for k in cutoffs:
+        k = max(int(k), 0)
+        suffix = '@{}'.format(k) if k > 0 else ''
+        top_k = ranks < k if k > 0 else np.ones(ranks.shape[0], dtype=bool)
+        if 'ndcg' in metrics:
+            per_query['ndcg' + suffix] = _ndcg(metadata, gains, ranks, k)
+        if 'err' in metrics:
+            per_query['err' + suffix] = np.bincount(
+                metadata.queries, weights=np.where(top_k, err, 0.0),
+                minlength=nr_of_queries)
+        if 'precision' in metrics:
+            hits = np.bincount(metadata.queries,
+                               weights=np.where(top_k, relevant, 0.0),
+                               minlength=nr_of_queries)
+            denominator = np.full(nr_of_queries, k) if k > 0 else lengths
+            per_query['p' + suffix] = np.divide(
+                hits, denominator, out=np.zeros(nr_of_queries),
+                where=denominator > 0)
+
+    return per_query, _means(per_query)
+
+
+def _ndcg(metadata, gains, ranks, k):
+    """
+    Computes the nDCG@k of every query from the gains in ranked order
+    """
+    weights = gains if k == 0 else np.where(ranks < k, gains, 0.0)
+    dcg = np.bincount(metadata.queries, weights=weights,
+                      minlength=len(metadata))
+    return _normalize(dcg, metadata.ideal_dcg(k), metadata.lengths)
+
+
+def _cumsum_per_query(metadata, values):
+    """
+    Computes the cumulative sum of values in ranked order within every query
+    """
+    result = np.cumsum(values)
+    starts = metadata.query_pointer[:-1]
+    offsets = np.zeros(len(metadata))
+    non_empty = metadata.lengths > 0
+    offsets[non_empty] = (result - values)[starts[non_empty]]
+    return result - offsets[metadata.queries]
+
+
+def _rank(dataset, scores):
+    """
+    Ranks the documents of every query of a data set by descending score
+
+    Subsets (data sets with a `query_index`) only gather the documents of
+    their own queries, numbered consecutively in the order of the subset.
+    Scores are expected for those documents, scores of all documents of the
+    parent data set are accepted too and gathered the same way.
+
+    :param dataset: A data set with metadata
+    :param scores: The predicted score of every document
+    :return: A tuple of the metadata of the queries of the data set, the
+             relevance labels in ranked order and the rank of every position
+             within its query
+    """
+    metadata = dataset.metadata
+    scores = np.asarray(scores, dtype=np.float64).ravel()
+    labels = np.asarray(dataset.relevance_scores).ravel()
+    query_index = getattr(dataset, 'query_index', None)
+    if query_index is not None:
+        metadata = _SubsetMetadata(metadata, np.asarray(query_index))
+        if scores.shape[0] != metadata.positions.shape[0] and \
+                scores.shape == labels.shape:
+            scores = scores[metadata.positions]
+        labels = labels[metadata.positions]
+    labels = labels.astype(np.float64)
+    if scores.shape != labels.shape:
+        raise ValueError("Expected a score for each of the {} documents, got "
+                         "{}".format(labels.shape[0], scores.shape[0]))
+    order = np.lexsort((-np.arange(scores.shape[0]), -scores,
+                        metadata.queries))
+    ranks = np.arange(scores.shape[0]) - \
+        metadata.query_pointer[metadata.queries]
+    return metadata, labels[order], ranks
+
+
+class _SubsetMetadata:
+    """
+    The metadata of the queries of a subset, with the documents of the
+    selected queries numbered consecutively in the order of the subset
+
+    :ivar positions: The document of the parent data set at every position
+    """
+
+    def __init__(self, metadata, query_index):
+        self._metadata = metadata
+        self._query_index = query_index
+        self.lengths = metadata.lengths[query_index]
+        self.query_pointer = np.zeros(query_index.shape[0] + 1,
+                                      dtype=np.int64)
+        np.cumsum(self.lengths, out=self.query_pointer[1:])
+        self.queries = np.repeat(np.arange(query_index.shape[0]),
+                                 self.lengths)
+        self.positions = metadata.query_pointer[query_index][self.queries] + \
+            np.arange(self.queries.shape[0]) - \
+            self.query_pointer[self.queries]
+
+    def __len__(self):
+        return self.lengths.shape[0]
+
+    @property
+    def levels(self):
+        return self._metadata.levels
+
+    def ideal_dcg(self, k=0):
+        return self._metadata.ideal_dcg(k)[self._query_index]
+
+
+def _normalize(dcg, idcg, lengths):
+    """
+    Divides DCG by ideal DCG, where queries without relevant documents have
+    an nDCG of 1 and empty queries an nDCG of 0
+    """
+    result = np.ones(dcg.shape[0], dtype=np.float64)
+    relevant = idcg > 0.0
+    result[relevant] = dcg[relevant] / idcg[relevant]
+    result[lengths == 0] = 0.0
+    return result
+
+
+def _means(per_query):
+    return {key: float(np.mean(values)) if values.shape[0] > 0 else 0.0
+            for key, values in per_query.items()}
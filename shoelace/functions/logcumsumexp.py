@@ -1,3 +1,4 @@
+import numpy
 from chainer import cuda
 from chainer import function
 from chainer.utils import type_check
@@ -5,21 +6,27 @@ from chainer.utils import type_check
 
 class LogCumsumExp(function.Function):
 
+    def __init__(self, axis=0, mask=None):
+        self.axis = axis
+        self.mask = mask
+
     def check_type_forward(self, in_types):
         type_check.expect(
             in_types.size() == 1,
             in_types[0].dtype.kind == 'f',
+            self.axis < in_types[0].ndim,
         )
 
     def forward(self, inputs):
         xp = cuda.get_array_module(*inputs)
 
         x, = inputs
-        m = x.max(axis=0, keepdims=True)
-        y = x - m
-        xp.exp(y, out=y)
-        y_sum = xp.flip(xp.cumsum(xp.flip(y, axis=0)), axis=0)
-        self.y = xp.transpose(xp.asarray(xp.log(y_sum) + m))
+        if self.mask is not None:
+            x = xp.where(self.mask, x, -xp.inf)
+        y = _cumulative_logsumexp(xp, x, self.axis, reverse=True)
+        if self.mask is not None:
+            y[~self.mask] = 0.0
+        self.y = y
         return self.y,
 
     def backward(self, inputs, grads):
@@ -27,25 +34,122 @@ class LogCumsumExp(function.Function):
         x, = inputs
         gy, = grads
 
+        # Every output sums over the inputs after it, so the gradient of an
+        # input accumulates the outputs before it:
+        #
+        #   gx_k = sum_{i <= k} gy_i exp(x_k - y_i)
+        #
+        # Every term is at most |gy_i|, because y_i includes x_k. The sum is
+        # accumulated in log space, separately for the positive and negative
+        # gradients, so neither exp(x) nor exp(-y) is ever formed. The two
+        # passes share their buffers.
         y = self.y
-        gx = gy * xp.exp(x) * xp.cumsum(xp.exp(-y), axis=0)
+        if self.mask is not None:
+            gy = xp.where(self.mask, gy, 0.0)
+        gx = xp.zeros_like(x)
+        part = xp.empty_like(x)
+        total = xp.empty_like(x)
+        for sign in (1.0, -1.0):
+            xp.multiply(gy, sign, out=part)
+            xp.maximum(part, 0.0, out=part)
+            if not part.max() > 0.0:
+                continue
+            with numpy.errstate(divide='ignore'):
+                xp.log(part, out=part)
+            part -= y
+            _cumulative_logsumexp(xp, part, self.axis, False, out=total)
+            total += x
+            if self.mask is not None:
+                total[~self.mask] = -xp.inf
+            xp.exp(total, out=total)
+            if sign > 0:
+                gx += total
+            else:
+                gx -= total
         return gx,
 
 
-def logcumsumexp(x):
-    """Log-sum-exp of array elements over a given axis.
+def _cumulative_logsumexp(xp, a, axis, reverse, out=None):
+    """
+    Computes the cumulative log-sum-exp of an array along an axis, where -inf
+    entries do not contribute
+
+    The exponents are shifted by the maximum along the axis and summed in
+    place. The rows (along the axis) of sums whose terms all underflow
+    relative to that maximum are recomputed with a stable scan of `logaddexp`
+    on the same device.
+
+    :param xp: The array module
+    :param a: The array
+    :param axis: The axis to accumulate over
+    :param reverse: Whether to accumulate from the end of the axis
+    :param out: The array to write the result to, a new array by default
+    :return: The cumulative log-sum-exp
+    """
+    if out is None:
+        out = xp.empty_like(a)
+    view = xp.flip(a, axis=axis) if reverse else a
+    result = xp.flip(out, axis=axis) if reverse else out
+    m = view.max(axis=axis, keepdims=True)
+    m[~xp.isfinite(m)] = 0.0
+    xp.subtract(view, m, out=result)
+    xp.exp(result, out=result)
+    xp.cumsum(result, axis=axis, out=result)
+
+    # Sums below the smallest normal float lost (most of) their precision,
+    # unless there was nothing to sum yet
+    small = result < xp.finfo(result.dtype).tiny
+    rows = None
+    if small.any():
+        small &= xp.cumsum(xp.isfinite(view), axis=axis, dtype=bool)
+        rows = small.any(axis=axis)
+    with numpy.errstate(divide='ignore'):
+        xp.log(result, out=result)
+    result += m
+    if rows is not None and rows.any():
+        exact = _logaddexp_scan(xp, xp.moveaxis(view, axis, -1)[rows])
+        xp.moveaxis(result, axis, -1)[rows] = exact
+    return out
+
+
+def _logaddexp_scan(xp, rows):
+    """
+    Computes the cumulative log-sum-exp along the last axis with `logaddexp`,
+    which never underflows: sequentially with numpy and with a parallel
+    (doubling) scan on other devices
+    """
+    if xp is numpy:
+        return numpy.logaddexp.accumulate(rows, axis=-1, out=rows)
+    scan = xp.empty_like(rows)
+    shift = 1
+    while shift < rows.shape[-1]:
+        xp.logaddexp(rows[..., shift:], rows[..., :-shift],
+                     out=scan[..., shift:])
+        scan[..., :shift] = rows[..., :shift]
+        rows, scan = scan, rows
+        shift *= 2
+    return rows
+
+
+def logcumsumexp(x, axis=0, mask=None):
+    """Reverse cumulative log-sum-exp of array elements over a given axis.
 
-    This function calculates logarithm of sum of exponential of array elements.
+    This function calculates logarithm of sum of exponential of array elements
+    from every element to the end of the axis.
 
     .. math::
 
-       y_i = \\log\\left(\\sum_j \\exp(x_{ij})\\right)
+       y_i = \\log\\left(\\sum_{j \\geq i} \\exp(x_j)\\right)
 
     Args:
         x (~chainer.Variable): Elements to log-sum-exp.
+        axis (int): The axis to accumulate over.
+        mask (~numpy.ndarray): A boolean array of the shape of `x` marking the
+            valid elements, e.g. of padded queries. Other elements do not
+            contribute to the sums, have an output of 0 and no gradient.
 
     Returns:
         ~chainer.Variable: Output variable.
 
     """
-    return LogCumsumExp()(x)
+    return LogCumsumExp(axis, mask)(x)
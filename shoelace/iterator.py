@@ -1,6 +1,8 @@
 import numpy as np
-from chainer.dataset import iterator
-from chainer.serializer import Serializer
+from chainer.dataset import convert, iterator
+from chainer.serializer import Deserializer
+
+from shoelace import dtypes, sparse, subsample
 
 
 class LtrIterator(iterator.Iterator):
@@ -14,64 +16,374 @@ class LtrIterator(iterator.Iterator):
     This means that each minibatch contains all the documents for a particular
     query, which can be of varying sizes.
 
+    Alternatively, several queries can be packed into one minibatch. Their
+    documents are then padded to the longest query of the minibatch and
+    returned as a tuple of a `[B, L, F]` feature array, a `[B, L]` label array
+    and a `[B, L]` mask of valid documents (see :func:`pad_queries`). Use
+    :func:`convert_padded` as the converter of an updater for such
+    minibatches. The last minibatch of an epoch may contain fewer queries.
+
     Args:
         dataset: Dataset ot iterate.
         repeat: Whether to repeat iterations over the data set (default: False)
+        shuffle: Whether to shuffle the queries after every epoch
+            (default: True)
+        queries_per_batch: The number of queries to pack into a padded
+            minibatch, or None for minibatches of a single query as a list of
+            per-document examples (default: None)
+        sampler: A sampler that plans padded minibatches of queries per epoch,
+            such as :class:`shoelace.sampler.BucketSampler`. The sampler
+            decides the order of the queries, it replaces `shuffle` and
+            `queries_per_batch` (default: None)
+        seed: The seed of the shuffles. With a seed, the order of every epoch
+            (including the first one) is a deterministic function of the seed
+            and the epoch, so a serialized iterator resumes exactly. Without a
+            seed, the first epoch is not shuffled and later epochs are shuffled
+            with the global numpy random state (default: None)
+        rank: The index of this process in data-parallel training, which only
+            visits its own shard of the queries (default: 0)
+        world_size: The number of processes in data-parallel training. Every
+            epoch, the queries are dealt into `world_size` disjoint shards with
+            nearly equal numbers of documents and equal numbers of queries (by
+            repeating a query in smaller shards). Shuffled iterators need a
+            seed to agree on the shards (default: 1)
+        max_documents: The maximum number of documents per query in a
+            minibatch, longer lists are subsampled every time they are visited
+            (default: None)
+        subsample: How to select the documents of longer lists, one of
+            'random', 'stratified' or 'score' (see
+            :func:`shoelace.subsample.subsample`) (default: 'random')
+        scores: A stored score for every document of the data set, such as
+            the score of a first stage ranker, used by the 'score' and
+            'stratified' methods (default: None)
 
     """
 
-    def __init__(self, dataset, repeat = False, shuffle= True):
+    def __init__(self, dataset, repeat = False, shuffle= True,
+                 queries_per_batch=None, sampler=None, seed=None, rank=0,
+                 world_size=1, max_documents=None, subsample='random',
+                 scores=None):
         self.feature_vectors = dataset.feature_vectors
         self.query_pointer = dataset.query_pointer
-        self.relevance_scores = dataset.relevance_scores.astype(np.float32)
+        query_index = getattr(dataset, 'query_index', None)
+        if query_index is None:
+            query_index = np.arange(len(dataset))
+        self._query_starts = self.query_pointer[query_index]
+        self._query_ends = self.query_pointer[query_index + 1]
+        self.relevance_scores = dataset.relevance_scores
         self._shuffle = shuffle
-        self._nr_of_queries = len(dataset)
-        self._query_index = np.arange(0, self._nr_of_queries)
         self._repeat = repeat
+        self._queries_per_batch = queries_per_batch
+        self._sampler = sampler
+        self._seed = seed
+        if not 0 <= rank < world_size:
+            raise ValueError("Rank {} out of range for world size {}".format(
+                rank, world_size))
+        if world_size > 1 and seed is None and (shuffle or sampler):
+            raise ValueError("Sharding a shuffled iterator requires a seed")
+        self._rank = rank
+        self._world_size = world_size
+        self._max_documents = max_documents
+        self._subsample = subsample
+        self._scores = scores
         self.reset()
 
     def __next__(self):
+        starts, lengths, positions = self._advance()
+        return assemble(self.feature_vectors, self.relevance_scores, starts,
+                        lengths, self.padded, positions)
+
+    @property
+    def padded(self):
+        """
+        Whether minibatches are padded arrays of several queries
+        """
+        return self._queries_per_batch is not None or self._sampler is not None
+
+    def _advance(self):
+        """
+        Moves to the next minibatch, updating the epoch state
+
+        :return: A tuple of the first document and the number of documents of
+                 every query in the minibatch, and the selected documents of
+                 all queries when they are subsampled (None otherwise)
+        """
         if not self._repeat and self.epoch > 0:
             raise StopIteration
         self._previous_epoch_detail = self.epoch_detail
 
-        start = self.query_pointer[self._query_index[self._current_index]]
-        end = self.query_pointer[self._query_index[self._current_index] + 1]
-
-        self.batch_size = end - start
-        self._current_index += 1
+        if self._sampler is not None:
+            end = self._bounds[np.searchsorted(self._bounds,
+                                               self._current_index,
+                                               side='right')]
+        else:
+            count = 1 if self._queries_per_batch is None else \
+                self._queries_per_batch
+            end = min(self._current_index + count, self._nr_of_queries)
+        queries = self._query_index[self._current_index:end]
+        random = self._random(self.epoch, self._current_index)
+        self._current_index = end
 
-        if self._current_index >= self._nr_of_queries:
+        self.is_new_epoch = self._current_index >= self._nr_of_queries
+        if self.is_new_epoch:
             self._current_index = 0
             self.epoch += 1
-            if self._shuffle:
-                self._shuffle_indices()
+            self._start_epoch()
 
-        return [(self.feature_vectors[i, :], self.relevance_scores[i]) for
-                i in range(start, end)]
+        starts = self._query_starts[queries]
+        lengths = self._query_ends[queries] - starts
+        positions = None
+        if self._max_documents is not None:
+            positions, lengths = subsample.subsample(
+                starts, lengths, self.relevance_scores, self._max_documents,
+                self._subsample, random, self._scores)
+        self.batch_size = int(np.sum(lengths))
+        return starts, lengths, positions
+
+    def _random(self, *state):
+        """
+        Returns the random state for a step or epoch, derived from the seed
+        (or the global random state without a seed)
+        """
+        if self._seed is None:
+            return np.random
+        return np.random.RandomState([self._seed] + list(state))
 
-    def _shuffle_indices(self):
+    def _start_epoch(self):
+        """
+        Determines the order (and for samplers the minibatches) of the queries
+        of the current epoch
+        """
+        if self._seed is None:
+            # Without a seed the first epoch is in data set order and later
+            # ones are shuffled with the global random state
+            if self._sampler is not None:
+                self._plan(self._shard(np.arange(len(self._query_starts))))
+            elif self._shuffle and self.epoch > 0:
+                self._query_index = self._shard(
+                    np.random.permutation(len(self._query_starts)))
+            else:
+                self._query_index = self._shard(
+                    np.arange(len(self._query_starts)))
+            return
+
+        random = self._random(self.epoch)
+        order = random.permutation(len(self._query_starts)) \
+            if self._shuffle else np.arange(len(self._query_starts))
+        order = self._shard(order)
+        if self._sampler is not None:
+            self._plan(order, random)
+        else:
+            self._query_index = order
+
+    def _shard(self, order):
+        """
+        Selects the shard of this rank from an order of all queries, keeping
+        the relative order of its queries
+
+        Queries are dealt to the ranks from long to short in alternating
+        directions, which balances the number of documents per shard. Shards
+        with fewer queries repeat their first query so every rank takes the
+        same number of steps per epoch.
+        """
+        if self._world_size == 1:
+            return order
+        lengths = self._query_ends[order] - self._query_starts[order]
+        by_length = np.argsort(-lengths, kind='mergesort')
+        positions = np.arange(order.shape[0]) % (2 * self._world_size)
+        ranks = np.minimum(positions, 2 * self._world_size - 1 - positions)
+        selected = np.sort(by_length[ranks == self._rank])
+        size = -(-order.shape[0] // self._world_size)
+        if selected.shape[0] < size and order.shape[0] > 0:
+            selected = np.concatenate([selected, selected[:1]]) \
+                if selected.shape[0] > 0 else by_length[:1]
+        return order[selected]
+
+    def _plan(self, order, random=None):
+        """
+        Lets the sampler plan the minibatches of an epoch over given queries
+        """
+        plan, self._bounds = self._sampler.plan(
+            self._query_ends[order] - self._query_starts[order], random)
+        self._query_index = order[plan]
+
+        # Without a seed, later plans follow from the random state of the
+        # sampler, which is part of the state of the iterator
+        if random is None:
+            self._sampler_state = self._sampler.random.get_state()
+
+    @property
+    def padding_efficiency(self):
         """
-        Shuffles the indices so the next iteration iterates the data in a
-        different order 
+        The padding efficiency of the minibatches of the current epoch, when
+        they are planned by a sampler
         """
-        self._query_index = np.random.permutation(self._nr_of_queries)
+        if self._sampler is None:
+            return None
+        return self._sampler.efficiency
 
     @property
     def epoch_detail(self):
         return self.epoch + self._current_index / self._nr_of_queries
 
+    @property
+    def previous_epoch_detail(self):
+        if self._previous_epoch_detail < 0:
+            return None
+        return self._previous_epoch_detail
+
     def serialize(self, serializer):
         self.batch_size = serializer('batch_size', self.batch_size)
         self.epoch = serializer('epoch', self.epoch)
-        self.previous_epoch_detail = serializer('previous_epoch_detail',
-                                                self.previous_epoch_detail)
+        self._previous_epoch_detail = serializer('previous_epoch_detail',
+                                                 self._previous_epoch_detail)
         self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
         self._current_index = serializer('_current_index', self._current_index)
 
+        # Seeded orders follow from the epoch, otherwise the order itself is
+        # part of the state (and for samplers the minibatches and the random
+        # state to plan later epochs with)
+        if self._seed is None:
+            self._query_index = serializer('_query_index', self._query_index)
+            if self._sampler is not None:
+                self._serialize_plan(serializer)
+        elif isinstance(serializer, Deserializer):
+            self._start_epoch()
+
+    def _serialize_plan(self, serializer):
+        deserializing = isinstance(serializer, Deserializer)
+        self._bounds = serializer('_bounds',
+                                  None if deserializing else self._bounds)
+        name, keys, position, has_gauss, gauss = self._sampler_state
+        keys = serializer('_sampler_keys', None if deserializing else keys)
+        position = serializer('_sampler_position', position)
+        has_gauss = serializer('_sampler_has_gauss', has_gauss)
+        gauss = serializer('_sampler_gauss', gauss)
+        if deserializing:
+            self._sampler_state = (name, np.asarray(keys, dtype=np.uint32),
+                                   int(position), int(has_gauss),
+                                   float(gauss))
+            self._sampler.random.set_state(self._sampler_state)
+
     def reset(self):
         self.batch_size = 0
         self.epoch = 0
-        self.previous_epoch_detail = None
+        self._previous_epoch_detail = -1.0
         self.is_new_epoch = False
         self._current_index = 0
+        self._start_epoch()
+
+    @property
+    def _nr_of_queries(self):
+        return self._query_index.shape[0]
+
+
+def assemble(feature_vectors, relevance_scores, starts, lengths, padded,
+             positions=None):
+    """
+    Assembles a minibatch from the documents of given queries
+
+    :param feature_vectors: The feature vectors of a data set
+    :param relevance_scores: The relevance scores of a data set
+    :param starts: The first document of every query
+    :param lengths: The number of documents of every query
+    :param padded: Whether to return padded arrays (see `pad_queries`) or a
+                   list of per-document examples of a single query
+    :param positions: The documents of all queries (concatenated) when only
+                      some of their documents are selected
+    :return: The minibatch
+    """
+    if padded:
+        return pad_queries(feature_vectors, relevance_scores, starts, lengths,
+                           positions)
+
+    # Sparse feature vectors are densified, reduced precision feature vectors
+    # upcast and labels are cast per batch
+    start = starts[0]
+    end = start + lengths[0]
+    if positions is None:
+        features = feature_vectors[start:end]
+        labels = relevance_scores[start:end]
+    else:
+        features, labels = _gather(feature_vectors, relevance_scores,
+                                   positions, [positions])
+    features = sparse.toarray(dtypes.upcast(features))
+    labels = np.asarray(labels, dtype=np.float32)
+    return [(features[i], labels[i]) for i in range(lengths[0])]
+
+
+def pad_queries(feature_vectors, relevance_scores, starts, lengths,
+                positions=None):
+    """
+    Packs the documents of several queries into padded arrays with a single
+    gather from the feature vectors and relevance scores
+
+    :param feature_vectors: The feature vectors of a data set
+    :param relevance_scores: The relevance scores of a data set
+    :param starts: The first document of every query
+    :param lengths: The number of documents of every query
+    :param positions: The documents of all queries (concatenated), by default
+                      all documents of every query
+    :return: A tuple of float32 features of shape `[B, L, F]`, float32 labels
+             of shape `[B, L]` and a boolean mask of shape `[B, L]` that marks
+             the valid (non-padding) documents, where `L` is the length of the
+             longest query
+    """
+    starts = np.asarray(starts)
+    lengths = np.asarray(lengths)
+    length = int(lengths.max()) if lengths.shape[0] > 0 else 0
+    offsets = np.arange(length)
+    mask = offsets[None, :] < lengths[:, None]
+
+    # Padding positions gather the first document of their query and are
+    # zeroed afterwards
+    index = np.repeat(starts[:, None], length, axis=1)
+    if positions is None:
+        index += np.where(mask, offsets[None, :], 0)
+    else:
+        index[mask] = positions
+    index = np.minimum(index, max(len(feature_vectors) - 1, 0))
+    features, labels = _gather(feature_vectors, relevance_scores,
+                               index.ravel(), np.split(index.ravel(),
+                                                       lengths.shape[0]))
+    features = sparse.toarray(dtypes.upcast(features))
+    features = features.astype(np.float32, copy=False).reshape(
+        lengths.shape[0], length, -1)
+    labels = np.asarray(labels).astype(np.float32).reshape(lengths.shape[0],
+                                                           length)
+    features[~mask] = 0.0
+    labels[~mask] = 0.0
+    return features, labels, mask
+
+
+def _gather(feature_vectors, relevance_scores, positions, groups):
+    """
+    Gathers the rows at given positions. Row accessors that only support
+    slices (e.g. of sharded data sets) are sliced per group of positions,
+    every group lying within one query.
+    """
+    if isinstance(feature_vectors, (np.ndarray, sparse.CsrFeatures)):
+        return feature_vectors[positions], \
+            np.asarray(relevance_scores)[positions]
+    features = []
+    labels = []
+    for group in groups:
+        first = int(group.min())
+        last = int(group.max()) + 1
+        rows = sparse.toarray(dtypes.upcast(feature_vectors[first:last]))
+        features.append(rows[group - first])
+        labels.append(np.asarray(relevance_scores[first:last])[group - first])
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def convert_padded(batch, device=None):
+    """
+    Converter for padded minibatches of :class:`LtrIterator`, sends the
+    features, labels and mask to a device
+
+    :param batch: A tuple of features, labels and mask
+    :param device: The device to send the arrays to (see
+                   :func:`chainer.dataset.to_device`)
+    :return: The tuple of arrays on the device
+    """
+    return tuple(convert.to_device(device, array) for array in batch)
@@ -1,23 +1,53 @@
 import numpy as np
 import chainer.functions as F
 from chainer import cuda
+from shoelace.evaluation import _top_k
 from shoelace.functions.logcumsumexp import logcumsumexp
 
 
-def listmle(x, t):
+def listmle(x, t, order=None, k=0):
     """
     The ListMLE loss as in Xia et al (2008), Listwise Approach to Learning to
     Rank - Theory and Algorithm.
 
+    With a cut-off point `k`, only the likelihood of the top-k documents (by
+    relevance label) is maximized, as in Xia et al (2009), Statistical
+    Consistency of Top-k Ranking. The remaining documents are selected with a
+    partition instead of a sort and enter the loss as a single log-sum-exp
+    term, so the cost of the sorting scales with `k`.
+
     :param x: The activation of the previous layer
     :param t: The target labels
+    :param order: The documents sorted by descending relevance label, if it is
+                  known in advance (see `shoelace.dataset.LtrQuery.label_order`)
+    :param k: The cut-off point (if set to smaller or equal to 0, or to the
+              number of documents or more, it does not cut-off)
     :return: The loss
     """
-
-    # Get the ground truth by sorting activations by the relevance labels
     xp = cuda.get_array_module(t)
     t_hat = t[:, 0]
-    x_hat = x[xp.flip(xp.argsort(t_hat), axis=0)]
+    if t_hat.dtype.kind != 'f':
+        t_hat = t_hat.astype(xp.float64)
+    if 0 < k < t.shape[0]:
+        if order is None:
+            top = _top_k(xp, t_hat, k)
+            tail = xp.ones(t.shape[0], dtype=bool)
+            tail[top] = False
+            tail = xp.flatnonzero(tail)
+        else:
+            top = order[:k]
+            tail = order[k:]
+
+        # The top-k documents followed by the log-sum-exp of the rest
+        x_hat = x[top]
+        rest = F.reshape(F.logsumexp(x[tail], axis=0), (1, -1))
+        final = logcumsumexp(F.concat((x_hat, rest), axis=0))
+        return F.sum(final[:k] - x_hat)
+
+    # Get the ground truth by sorting activations by the relevance labels
+    if order is None:
+        order = xp.flip(xp.argsort(t_hat, kind='stable'), axis=0)
+    x_hat = x[order]
 
     # Compute MLE loss
     final = logcumsumexp(x_hat)
@@ -35,12 +65,12 @@ def listnet(x, t):
     """
 
     # ListNet top-1 reduces to a softmax and simple cross entropy
-    st = F.softmax(t, axis=0)
+    st = F.softmax(_labels(t, x), axis=0)
     sx = F.softmax(x, axis=0)
     return -F.mean(st * F.log(sx))
 
 
-def listpl(x, t, α=15.0):
+def listpl(x, t, α=15.0, n_samples=1):
     """
     The ListPL loss, a stochastic variant of ListMLE that in expectation
     approximates the true ListNet loss.
@@ -48,36 +78,160 @@ def listpl(x, t, α=15.0):
     :param x: The activation of the previous layer
     :param t: The target labels
     :param α: The smoothing factor
+    :param n_samples: The number of permutations to average the loss over
     :return: The loss
     """
 
-    # Sample permutation from PL(t)
-    index = _pl_sample(t, α)
-    x = x[index]
+    # Sample permutations from PL(t)
+    t = _labels(t, x)
+    index = _pl_sample(t[:, 0][None, :], α, n_samples)[:, 0, :]
+    x = x[:, 0][index]
 
     # Compute MLE loss
-    final = logcumsumexp(x)
-    return F.sum(final - x)
+    final = logcumsumexp(x, axis=1)
+    return F.sum(final - x) / n_samples
 
 
-def _pl_sample(t, α):
+def padded_listmle(x, t, mask=None, reduce='mean'):
     """
-    Sample from the plackett luce distribution directly
+    The ListMLE loss (see `listmle`) of a padded minibatch of queries
+
+    :param x: The activations of shape `[B, L]`
+    :param t: The target labels of shape `[B, L]`
+    :param mask: A boolean mask of shape `[B, L]` marking the valid documents
+                 (see `shoelace.iterator.pad_queries`), by default all
+    :param reduce: 'mean' to average the loss over the queries, 'no' to return
+                   the loss of every query
+    :return: The loss
+    """
+    xp = cuda.get_array_module(t)
+    mask = _valid(xp, t, mask)
+    t = _labels(t, x)
 
-    :param t: The target labels
-    :return: A random permutation from the plackett-luce distribution
-             parameterized by the target labels
+    # Sort by descending relevance label, with the padding in front
+    keys = xp.where(mask, t, xp.inf)
+    order = xp.flip(xp.argsort(keys, axis=1, kind='stable'), axis=1)
+    return _padded_mle(x, mask, order, reduce)
+
+
+def padded_listnet(x, t, mask=None, reduce='mean'):
+    """
+    The Top-1 approximated ListNet loss (see `listnet`) of a padded minibatch
+    of queries
+
+    :param x: The activations of shape `[B, L]`
+    :param t: The target labels of shape `[B, L]`
+    :param mask: A boolean mask of shape `[B, L]` marking the valid documents
+                 (see `shoelace.iterator.pad_queries`), by default all
+    :param reduce: 'mean' to average the loss over the queries, 'no' to return
+                   the loss of every query
+    :return: The loss
+    """
+    xp = cuda.get_array_module(t)
+    mask = _valid(xp, t, mask)
+    t = _labels(t, x)
+
+    # Padding is excluded from the softmaxes by a large negative activation
+    fill = _fill(xp, x)
+    st = F.softmax(F.where(mask, t, fill), axis=1)
+    log_sx = F.log_softmax(F.where(mask, x, fill), axis=1)
+    cross_entropy = F.where(mask, st * log_sx, xp.zeros_like(fill))
+    losses = -F.sum(cross_entropy, axis=1) / xp.sum(mask, axis=1).astype(
+        fill.dtype)
+    return _reduce(losses, reduce)
+
+
+def padded_listpl(x, t, mask=None, α=15.0, n_samples=1, reduce='mean'):
+    """
+    The ListPL loss (see `listpl`) of a padded minibatch of queries
+
+    :param x: The activations of shape `[B, L]`
+    :param t: The target labels of shape `[B, L]`
+    :param mask: A boolean mask of shape `[B, L]` marking the valid documents
+                 (see `shoelace.iterator.pad_queries`), by default all
+    :param α: The smoothing factor
+    :param n_samples: The number of permutations to average the loss over
+    :param reduce: 'mean' to average the loss over the queries, 'no' to return
+                   the loss of every query
+    :return: The loss
     """
     xp = cuda.get_array_module(t)
-    t = t[:, 0]
+    mask = _valid(xp, t, mask)
+    t = _labels(t, x)
+
+    # Sample permutations of the valid documents of every query, with the
+    # padding in front, and compute the loss of all samples at once
+    order = _pl_sample(xp.where(mask, t, xp.inf), α, n_samples)
+    order = order.reshape(-1, t.shape[1])
+    losses = _padded_mle(F.tile(x, (n_samples, 1)),
+                         xp.tile(mask, (n_samples, 1)), order, 'no')
+    losses = F.mean(F.reshape(losses, (n_samples, t.shape[0])), axis=0)
+    return _reduce(losses, reduce)
+
+
+def _padded_mle(x, mask, order, reduce):
+    """
+    Computes the MLE loss of padded queries whose documents are visited in
+    given order, leaving the padding out of the cumulative sums
+    """
+    xp = cuda.get_array_module(mask)
+    rows = xp.arange(order.shape[0])[:, None]
+    mask = mask[rows, order]
+    x_hat = x[rows, order]
+    final = logcumsumexp(x_hat, axis=1, mask=mask)
+    losses = F.sum(F.where(mask, final - x_hat, xp.zeros(mask.shape,
+                                                          x_hat.dtype)),
+                   axis=1)
+    return _reduce(losses, reduce)
+
+
+def _labels(t, x):
+    """
+    Casts target labels, which data sets may store in a compact integer
+    dtype, to the float dtype of the activations
+    """
+    return t if t.dtype == x.dtype else t.astype(x.dtype)
+
+
+def _valid(xp, t, mask):
+    if mask is None:
+        return xp.ones(t.shape, dtype=bool)
+    return xp.asarray(mask, dtype=bool)
+
+
+def _fill(xp, x):
+    """
+    A large negative (but finite) activation for padding, whose exponent
+    vanishes next to any valid activation
+    """
+    dtype = x.dtype
+    return xp.full(x.shape, np.finfo(dtype).min / 4, dtype=dtype)
 
-    probs = xp.exp(t * α)
-    probs /= xp.sum(probs)
 
-    # Use CPU-based numpy implementation, because cupy.random.choice with
-    # replace=False does not work
-    probs = cuda.to_cpu(probs)
-    result = np.random.choice(probs.shape[0], probs.shape[0], replace=False,
-                              p=probs)
-    return xp.array(result, copy=False)
+def _reduce(losses, reduce):
+    if reduce == 'mean':
+        return F.mean(losses)
+    if reduce == 'no':
+        return losses
+    raise ValueError("Unknown reduce option '{}'".format(reduce))
 
+
+def _pl_sample(t, α, n_samples=1):
+    """
+    Sample from the plackett luce distribution directly
+
+    Uses the Gumbel-max trick: sorting the log-probabilities perturbed with
+    independent Gumbel noise in descending order gives a sample of the
+    plackett-luce distribution, so all samples are drawn with a single sort on
+    the device of the labels.
+
+    :param t: The target labels of shape `[B, L]`, one query per row
+    :param α: The smoothing factor
+    :param n_samples: The number of permutations to draw per query
+    :return: Random permutations of shape `[n_samples, B, L]` from the
+             plackett-luce distribution parameterized by the target labels
+    """
+    xp = cuda.get_array_module(t)
+    noise = xp.random.gumbel(size=(n_samples,) + t.shape)
+    keys = noise + t * α
+    return xp.flip(xp.argsort(keys, axis=2), axis=2)
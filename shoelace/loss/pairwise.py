@@ -0,0 +1,183 @@
+import numpy as np
+import chainer.functions as F
+from chainer import cuda, function
+from chainer.utils import type_check
+
+from shoelace.loss.listwise import _reduce, _valid
+
+
+class PairwiseLogistic(function.Function):
+    """
+    The (weighted) logistic loss over all pairs of documents of padded queries
+    where the first document has a higher relevance label than the second
+
+    Pairs are formed for a tile of `tile_size` documents at a time, so memory
+    is bounded by `B * tile_size * L` instead of `B * L * L`. The gradient is
+    accumulated during the forward pass, so no pair tensor is kept for the
+    backward pass.
+    """
+
+    def __init__(self, t, mask, tile_size=256, gains=None, discounts=None,
+                 idcg=None):
+        self.t = t
+        self.mask = mask
+        self.tile_size = max(tile_size, 1)
+        self.gains = gains
+        self.discounts = discounts
+        self.idcg = idcg
+
+    def check_type_forward(self, in_types):
+        type_check.expect(
+            in_types.size() == 1,
+            in_types[0].dtype.kind == 'f',
+            in_types[0].ndim == 2,
+        )
+
+    def forward(self, inputs):
+        xp = cuda.get_array_module(*inputs)
+        x, = inputs
+        t = self.t
+        mask = self.mask
+        losses = xp.zeros(x.shape[0], dtype=x.dtype)
+        self.gx = xp.zeros_like(x)
+
+        for start in range(0, x.shape[1], self.tile_size):
+            end = min(start + self.tile_size, x.shape[1])
+
+            # Pairs (i, j) of a higher labeled document i in the tile and any
+            # lower labeled document j, with score difference s_j - s_i
+            diff = x[:, None, :] - x[:, start:end, None]
+            weights = (t[:, start:end, None] > t[:, None, :]) & \
+                mask[:, start:end, None] & mask[:, None, :]
+            weights = weights.astype(x.dtype)
+            if self.gains is not None:
+                weights *= self._delta_ndcg(xp, start, end)
+
+            # log(1 + exp(s_j - s_i)) and its derivative, the sigmoid
+            softplus = xp.logaddexp(0.0, diff)
+            losses += xp.sum(weights * softplus, axis=(1, 2))
+            diff -= softplus
+            xp.exp(diff, out=diff)
+            diff *= weights
+            self.gx += xp.sum(diff, axis=1)
+            self.gx[:, start:end] -= xp.sum(diff, axis=2)
+        return losses,
+
+    def _delta_ndcg(self, xp, start, end):
+        """
+        The absolute change in nDCG of swapping the documents of every pair
+        in the tile, the LambdaRank weights
+        """
+        gains = self.gains
+        discounts = self.discounts
+        delta = xp.abs(gains[:, start:end, None] - gains[:, None, :]) * \
+            xp.abs(discounts[:, start:end, None] - discounts[:, None, :])
+        idcg = xp.where(self.idcg > 0, self.idcg, 1.0).astype(delta.dtype)
+        return delta / idcg[:, None, None]
+
+    def backward(self, inputs, grads):
+        gy, = grads
+        return gy[:, None] * self.gx,
+
+
+def ranknet(x, t, tile_size=256):
+    """
+    The RankNet loss as in Burges et al (2005), Learning to Rank using
+    Gradient Descent: the logistic loss over all pairs of documents with
+    different relevance labels.
+
+    :param x: The activation of the previous layer
+    :param t: The target labels
+    :param tile_size: The number of documents to form pairs for at once
+    :return: The loss
+    """
+    return F.sum(padded_ranknet(F.reshape(x, (1, -1)), t.reshape(1, -1),
+                                tile_size=tile_size, reduce='no'))
+
+
+def lambdarank(x, t, k=0, idcg=None, tile_size=256):
+    """
+    The LambdaRank loss as in Burges et al (2006), Learning to Rank with
+    Nonsmooth Cost Functions: the RankNet loss with every pair weighted by the
+    change in nDCG@k of swapping its documents in the current ranking.
+
+    :param x: The activation of the previous layer
+    :param t: The target labels
+    :param k: The cut-off point of the nDCG (if set to smaller or equal to 0,
+              it does not cut-off)
+    :param idcg: The ideal DCG@k of the query, if it is known in advance (see
+                 `shoelace.dataset.LtrQuery.ideal_dcg`)
+    :param tile_size: The number of documents to form pairs for at once
+    :return: The loss
+    """
+    if idcg is not None:
+        idcg = np.asarray(idcg).reshape(1)
+    return F.sum(padded_lambdarank(F.reshape(x, (1, -1)), t.reshape(1, -1),
+                                   k=k, idcg=idcg, tile_size=tile_size,
+                                   reduce='no'))
+
+
+def padded_ranknet(x, t, mask=None, tile_size=256, reduce='mean'):
+    """
+    The RankNet loss (see `ranknet`) of a padded minibatch of queries
+
+    :param x: The activations of shape `[B, L]`
+    :param t: The target labels of shape `[B, L]`
+    :param mask: A boolean mask of shape `[B, L]` marking the valid documents
+                 (see `shoelace.iterator.pad_queries`), by default all
+    :param tile_size: The number of documents to form pairs for at once
+    :param reduce: 'mean' to average the loss over the queries, 'no' to return
+                   the loss of every query
+    :return: The loss
+    """
+    xp = cuda.get_array_module(t)
+    mask = _valid(xp, t, mask)
+    losses = PairwiseLogistic(t, mask, tile_size)(x)
+    return _reduce(losses, reduce)
+
+
+def padded_lambdarank(x, t, mask=None, k=0, idcg=None, tile_size=256,
+                      reduce='mean'):
+    """
+    The LambdaRank loss (see `lambdarank`) of a padded minibatch of queries
+
+    :param x: The activations of shape `[B, L]`
+    :param t: The target labels of shape `[B, L]`
+    :param mask: A boolean mask of shape `[B, L]` marking the valid documents
+                 (see `shoelace.iterator.pad_queries`), by default all
+    :param k: The cut-off point of the nDCG (if set to smaller or equal to 0,
+              it does not cut-off)
+    :param idcg: The ideal DCG@k of every query, if it is known in advance
+                 (see `shoelace.metadata.QueryMetadata.ideal_dcg`)
+    :param tile_size: The number of documents to form pairs for at once
+    :param reduce: 'mean' to average the loss over the queries, 'no' to return
+                   the loss of every query
+    :return: The loss
+    """
+    xp = cuda.get_array_module(t)
+    mask = _valid(xp, t, mask)
+    scores = x.data if hasattr(x, 'data') else x
+    t = t.astype(scores.dtype)
+    gains = xp.where(mask, 2 ** t - 1, 0.0)
+    discounts = _discounts(xp, xp.where(mask, scores, -xp.inf), k)
+    if idcg is None:
+        ideal = _discounts(xp, xp.where(mask, t, -xp.inf), k)
+        idcg = xp.sum(gains * ideal, axis=1)
+    losses = PairwiseLogistic(t, mask, tile_size, gains, discounts,
+                              xp.asarray(idcg))(x)
+    return _reduce(losses, reduce)
+
+
+def _discounts(xp, scores, k):
+    """
+    The DCG discount of every document in the ranking by descending score,
+    which is 0 below the cut-off point
+    """
+    rows = xp.arange(scores.shape[0])[:, None]
+    order = xp.flip(xp.argsort(scores, axis=1), axis=1)
+    ranks = xp.empty(scores.shape, dtype=np.int64)
+    ranks[rows, order] = xp.arange(scores.shape[1])[None, :]
+    discounts = 1.0 / xp.log2(ranks + 2.0)
+    if k > 0:
+        discounts[ranks >= k] = 0.0
+    return discounts
@@ -0,0 +1,117 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+LabelHistogram = namedtuple('LabelHistogram', ['pointer', 'levels', 'counts'])
+"""
+Sparse per-query label histogram, only the label levels that occur in a query
+are stored
+
+:ivar pointer: Pointer into `levels` and `counts` for every query (CSR layout)
+:ivar levels: The distinct labels of every query, descending
+:ivar counts: The number of documents of every query with each of its labels
+"""
+
+
+class QueryMetadata:
+    """
+    Per-query facts about the relevance labels of a data set
+
+    The table is computed with a few vectorized passes over all documents, so
+    that iterators, evaluation and loss functions do not have to recompute the
+    same facts for every batch. The label levels and histogram and the ideal
+    DCG values (per cutoff) are computed lazily and cached.
+
+    :ivar lengths: The number of documents of every query
+    :ivar max_label: The maximum relevance label of every query (0 for empty
+                     queries)
+    :ivar levels: The distinct relevance labels of the data set, ascending
+    :ivar label_histogram: The number of documents with every label level per
+                           query, as a sparse `LabelHistogram`
+    :ivar label_order: The documents sorted by query and descending relevance
+                       label, with ties in reverse document order
+
+    :param relevance_scores: The relevance labels of the data set
+    :param query_pointer: The query pointer of the data set
+    :param cutoffs: Cutoffs to compute the ideal DCG at right away
+    """
+
+    def __init__(self, relevance_scores, query_pointer, cutoffs=()):
+        labels = np.asarray(relevance_scores, dtype=np.float64).ravel()
+        self.query_pointer = np.asarray(query_pointer)
+        self.lengths = np.diff(self.query_pointer)
+        nr_of_queries = self.lengths.shape[0]
+        self.queries = np.repeat(np.arange(nr_of_queries), self.lengths)
+
+        self.max_label = np.zeros(nr_of_queries, dtype=np.float64)
+        non_empty = self.lengths > 0
+        if labels.shape[0] > 0:
+            self.max_label[non_empty] = np.maximum.reduceat(
+                labels, self.query_pointer[:-1][non_empty])
+
+
+        self.label_order = np.lexsort((-np.arange(labels.shape[0]), -labels,
+                                       self.queries))
+        self._sorted_labels = labels[self.label_order]
+        self._levels = None
+        self._label_histogram = None
+        self._ideal_dcg = {}
+        for k in cutoffs:
+            self.ideal_dcg(k)
+
+    def __len__(self):
+        return self.lengths.shape[0]
+
+    @property
+    def levels(self):
+        if self._levels is None:
+            self._levels = np.unique(self._sorted_labels)
+        return self._levels
+
+    @property
+    def label_histogram(self):
+        if self._label_histogram is None:
+            # Documents are sorted by query and label, so every run of equal
+            # labels within a query is one histogram entry
+            labels = self._sorted_labels
+            starts = np.ones(labels.shape[0], dtype=np.bool_)
+            starts[1:] = (labels[1:] != labels[:-1]) | \
+                (self.queries[1:] != self.queries[:-1])
+            starts = np.flatnonzero(starts)
+            pointer = np.zeros(len(self) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.queries[starts], minlength=len(self)),
+                      out=pointer[1:])
+            counts = np.diff(np.append(starts, labels.shape[0]))
+            self._label_histogram = LabelHistogram(pointer, labels[starts],
+                                                   counts)
+        return self._label_histogram
+
+    def ideal_dcg(self, k=0):
+        """
+        Returns the ideal DCG@k of every query
+
+        :param k: The cutoff (if smaller or equal to 0, it does not cut off)
+        :return: An array with the ideal DCG@k of every query
+        """
+        k = max(int(k), 0)
+        if k not in self._ideal_dcg:
+            ranks = np.arange(self._sorted_labels.shape[0]) - \
+                self.query_pointer[self.queries]
+            gains = (2 ** self._sorted_labels - 1) / np.log2(ranks + 2)
+            if k > 0:
+                gains[ranks >= k] = 0.0
+            self._ideal_dcg[k] = np.bincount(self.queries, weights=gains,
+                                             minlength=len(self))
+        return self._ideal_dcg[k]
+
+    def query_order(self, i):
+        """
+        Returns the label-sorted order of the documents of the i-th query,
+        relative to the first document of the query
+
+        :param i: The index of the query
+        :return: An integer array of document positions
+        """
+        start = self.query_pointer[i]
+        return self.label_order[start:self.query_pointer[i + 1]] - start
@@ -0,0 +1,130 @@
+import numpy as np
+
+from shoelace import sparse
+
+
+def query_blocks(query_pointer, block_size=1 << 16):
+    """
+    Partitions the queries of a data set into consecutive blocks of roughly
+    `block_size` documents, so that normalization only needs temporaries of
+    bounded size
+
+    :param query_pointer: The query pointer of the data set
+    :param block_size: The preferred number of documents per block
+    :return: A generator of (first query, last query + 1) tuples
+    """
+    nr_of_queries = query_pointer.shape[0] - 1
+    start = 0
+    while start < nr_of_queries:
+        target = query_pointer[start] + block_size
+        end = int(np.searchsorted(query_pointer, target, side='right')) - 1
+        end = min(max(end, start + 1), nr_of_queries)
+        yield start, end
+        start = end
+
+
+def _segments(query_pointer, start, end):
+    """
+    Returns the offsets (relative to the first document of the block) and
+    lengths of the non-empty queries in a block
+    """
+    lengths = np.diff(query_pointer[start:end + 1])
+    offsets = query_pointer[start:end] - query_pointer[start]
+    non_empty = lengths > 0
+    return offsets[non_empty], lengths[non_empty]
+
+
+def minmax(features, query_pointer):
+    """
+    Scales every feature to [0, 1] per query, in place
+
+    :param features: The feature vectors, a float `np.ndarray` or
+                     `shoelace.sparse.CsrFeatures` object
+    :param query_pointer: The query pointer of the data set
+    """
+    if isinstance(features, sparse.CsrFeatures):
+        sparse.normalize(features, query_pointer)
+        return
+
+    for start, end in query_blocks(query_pointer):
+        block = features[query_pointer[start]:query_pointer[end]]
+        offsets, lengths = _segments(query_pointer, start, end)
+        if offsets.shape[0] == 0:
+            continue
+        minimum = np.minimum.reduceat(block, offsets, axis=0)
+        scale = np.maximum.reduceat(block, offsets, axis=0)
+        scale -= minimum
+        scale[scale == 0.0] = 1.0
+        block -= np.repeat(minimum, lengths, axis=0)
+        block /= np.repeat(scale, lengths, axis=0)
+
+
+def zscore(features, query_pointer):
+    """
+    Standardizes every feature to zero mean and unit variance per query, in
+    place
+
+    :param features: The feature vectors as a float `np.ndarray`
+    :param query_pointer: The query pointer of the data set
+    """
+    _require_dense(features, 'zscore')
+    for start, end in query_blocks(query_pointer):
+        block = features[query_pointer[start]:query_pointer[end]]
+        offsets, lengths = _segments(query_pointer, start, end)
+        if offsets.shape[0] == 0:
+            continue
+        mean = np.add.reduceat(block, offsets, axis=0, dtype=np.float64)
+        mean /= lengths[:, None]
+        block -= np.repeat(mean.astype(block.dtype), lengths, axis=0)
+        std = np.add.reduceat(np.square(block), offsets, axis=0,
+                              dtype=np.float64)
+        std /= lengths[:, None]
+        np.sqrt(std, out=std)
+        std[std == 0.0] = 1.0
+        block /= np.repeat(std.astype(block.dtype), lengths, axis=0)
+
+
+def standardize(features, query_pointer):
+    """
+    Standardizes every feature to zero mean and unit variance over the whole
+    data set, in place
+
+    :param features: The feature vectors as a float `np.ndarray`
+    :param query_pointer: The query pointer of the data set
+    """
+    _require_dense(features, 'standardize')
+    if features.shape[0] == 0:
+        return
+    blocks = list(query_blocks(query_pointer))
+
+    mean = np.zeros(features.shape[1], dtype=np.float64)
+    for start, end in blocks:
+        block = features[query_pointer[start]:query_pointer[end]]
+        mean += np.sum(block, axis=0, dtype=np.float64)
+    mean /= features.shape[0]
+
+    std = np.zeros(features.shape[1], dtype=np.float64)
+    for start, end in blocks:
+        block = features[query_pointer[start]:query_pointer[end]]
+        block -= mean.astype(block.dtype)
+        std += np.sum(np.square(block), axis=0, dtype=np.float64)
+    std /= features.shape[0]
+    np.sqrt(std, out=std)
+    std[std == 0.0] = 1.0
+
+    for start, end in blocks:
+        features[query_pointer[start]:query_pointer[end]] /= \
+            std.astype(features.dtype)
+
+
+def _require_dense(features, method):
+    if isinstance(features, sparse.CsrFeatures):
+        raise ValueError("Normalization method '{}' would make sparse "
+                         "features dense".format(method))
+
+
+normalizers = {
+    'minmax': minmax,
+    'zscore': zscore,
+    'standardize': standardize
+}
@@ -0,0 +1,179 @@
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from chainer.serializer import Deserializer
+
+from shoelace.iterator import LtrIterator, assemble
+
+
+class PrefetchLtrIterator(LtrIterator):
+    """Dataset iterator that assembles upcoming minibatches in the background.
+
+    Minibatches are planned on the calling thread exactly like
+    :class:`shoelace.iterator.LtrIterator` plans them, but assembling them
+    (gathering, densifying and padding the documents) happens in a pool of
+    worker threads or processes up to `n_prefetch` minibatches ahead, so data
+    preparation overlaps with model computation. The `epoch`, `epoch_detail`
+    and `is_new_epoch` attributes describe the minibatch that was returned
+    last, as they do for :class:`shoelace.iterator.LtrIterator`.
+
+    Worker processes are forked, so they share the arrays of the data set
+    (including memory-mapped arrays) with the parent instead of receiving a
+    pickled copy. Only the assembled minibatches are sent back.
+
+    Args:
+        dataset: Dataset to iterate.
+        repeat: Whether to repeat iterations over the data set (default: False)
+        shuffle: Whether to shuffle the queries after every epoch
+            (default: True)
+        queries_per_batch: The number of queries per padded minibatch, see
+            :class:`shoelace.iterator.LtrIterator` (default: None)
+        sampler: A sampler that plans padded minibatches, see
+            :class:`shoelace.iterator.LtrIterator` (default: None)
+        seed: The seed of the shuffles, see
+            :class:`shoelace.iterator.LtrIterator` (default: None)
+        rank: The index of this process in data-parallel training
+            (default: 0)
+        world_size: The number of processes in data-parallel training
+            (default: 1)
+        max_documents, subsample, scores: Per-query document subsampling, see
+            :class:`shoelace.iterator.LtrIterator`
+        n_prefetch: The number of minibatches to assemble ahead (default: 4)
+        n_workers: The number of worker threads or processes (default: 1)
+        processes: Whether to use worker processes instead of threads
+            (default: False)
+
+    """
+
+    def __init__(self, dataset, repeat=False, shuffle=True,
+                 queries_per_batch=None, sampler=None, seed=None, rank=0,
+                 world_size=1, max_documents=None, subsample='random',
+                 scores=None, n_prefetch=4, n_workers=1, processes=False):
+        self._planner = LtrIterator(dataset, repeat, shuffle,
+                                    queries_per_batch, sampler, seed, rank,
+                                    world_size, max_documents, subsample,
+                                    scores)
+        self._n_prefetch = max(n_prefetch, 1)
+        self._n_workers = n_workers
+        self._processes = processes
+        self._executor = None
+        self._pending = deque()
+        super(PrefetchLtrIterator, self).__init__(dataset, repeat, shuffle,
+                                                  queries_per_batch, sampler,
+                                                  seed, rank, world_size,
+                                                  max_documents, subsample,
+                                                  scores)
+
+    def __next__(self):
+        if not self._repeat and self.epoch > 0:
+            raise StopIteration
+        self._fill()
+        if not self._pending:
+            raise StopIteration
+        future, state = self._pending.popleft()
+        self.epoch, self._current_index, self.is_new_epoch, \
+            self._previous_epoch_detail, self.batch_size, \
+            self._query_index, self._bounds, self._sampler_state = state
+        batch = future.result()
+        self._fill()
+        return batch
+
+    @property
+    def padded(self):
+        return self._planner.padded
+
+    @property
+    def padding_efficiency(self):
+        return self._planner.padding_efficiency
+
+    def _fill(self):
+        """
+        Plans minibatches and submits them to the workers until `n_prefetch`
+        minibatches are pending
+        """
+        while len(self._pending) < self._n_prefetch:
+            try:
+                starts, lengths, positions = self._planner._advance()
+            except StopIteration:
+                break
+            planner = self._planner
+            state = (planner.epoch, planner._current_index,
+                     planner.is_new_epoch, planner._previous_epoch_detail,
+                     planner.batch_size, planner._query_index,
+                     getattr(planner, '_bounds', None),
+                     getattr(planner, '_sampler_state', None))
+            self._pending.append((self._submit(starts, lengths, positions),
+                                  state))
+
+    def _submit(self, starts, lengths, positions):
+        if self._executor is None:
+            if self._processes:
+                self._executor = ProcessPoolExecutor(
+                    self._n_workers, multiprocessing.get_context('fork'),
+                    initializer=_initialize,
+                    initargs=(self.feature_vectors, self.relevance_scores))
+            else:
+                self._executor = ThreadPoolExecutor(self._n_workers)
+        if self._processes:
+            return self._executor.submit(_assemble, starts, lengths,
+                                         self.padded, positions)
+        return self._executor.submit(assemble, self.feature_vectors,
+                                     self.relevance_scores, starts, lengths,
+                                     self.padded, positions)
+
+    def _discard(self):
+        """
+        Drops all pending minibatches
+        """
+        for future, _ in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def _start_epoch(self):
+        # The order of the queries is planned (ahead) by the planner
+        self._query_index = self._planner._query_index
+        self._bounds = getattr(self._planner, '_bounds', None)
+        self._sampler_state = getattr(self._planner, '_sampler_state', None)
+
+    def serialize(self, serializer):
+        super(PrefetchLtrIterator, self).serialize(serializer)
+        if isinstance(serializer, Deserializer):
+            # Continue planning right after the restored position
+            self._discard()
+            planner = self._planner
+            planner.epoch = self.epoch
+            planner._current_index = self._current_index
+            planner._previous_epoch_detail = self._previous_epoch_detail
+            if self._seed is None:
+                planner._query_index = self._query_index.copy()
+                planner._bounds = self._bounds
+                planner._sampler_state = self._sampler_state
+            else:
+                planner._start_epoch()
+            self._start_epoch()
+
+    def reset(self):
+        self._discard()
+        self._planner.reset()
+        super(PrefetchLtrIterator, self).reset()
+
+    def finalize(self):
+        self._discard()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+# The arrays of the data set in a worker process, inherited from the parent
+_arrays = None
+
+
+def _initialize(feature_vectors, relevance_scores):
+    global _arrays
+    _arrays = (feature_vectors, relevance_scores)
+
+
+def _assemble(starts, lengths, padded, positions):
+    return assemble(_arrays[0], _arrays[1], starts, lengths, padded,
+                    positions)
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+class BucketSampler:
+    """
+    Groups queries of similar length into padded minibatches
+
+    Queries are sorted by their number of documents and split into buckets of
+    (nearly) equally many queries. Every bucket is cut into minibatches of as
+    many queries as fit in the document budget when padded to the longest
+    query of the bucket, so every minibatch costs roughly the same amount of
+    compute. Queries longer than the budget form a minibatch of their own.
+
+    When shuffling, queries are shuffled within their bucket and minibatches
+    are shuffled across buckets for every epoch.
+
+    :ivar efficiency: The padding efficiency of the last plan, the fraction of
+                      the padded minibatch entries that are real documents
+
+    :param documents_per_batch: The budget of (padded) documents per minibatch
+    :param nr_of_buckets: The number of length buckets
+    :param shuffle: Whether to shuffle queries and minibatches
+    :param seed: The seed of the shuffles
+    """
+
+    def __init__(self, documents_per_batch, nr_of_buckets=8, shuffle=True,
+                 seed=None):
+        self.documents_per_batch = documents_per_batch
+        self.nr_of_buckets = nr_of_buckets
+        self.shuffle = shuffle
+        self.random = np.random.RandomState(seed)
+        self.efficiency = None
+
+    def plan(self, lengths, random=None):
+        """
+        Plans the minibatches of one epoch
+
+        :param lengths: The number of documents of every query
+        :param random: A `np.random.RandomState` to shuffle with instead of the
+                       random state of the sampler
+        :return: A tuple of the order to visit the queries in and the
+                 boundaries of the minibatches in that order (starting at 0
+                 and ending at the number of queries)
+        """
+        random = self.random if random is None else random
+        lengths = np.asarray(lengths)
+        nr_of_queries = lengths.shape[0]
+        keys = random.random_sample(nr_of_queries) if self.shuffle else \
+            np.arange(nr_of_queries)
+        by_length = np.lexsort((keys, lengths))
+
+        # Cut every bucket into minibatches sized for its longest query
+        buckets = np.array_split(by_length, min(self.nr_of_buckets,
+                                                max(nr_of_queries, 1)))
+        batches = []
+        for bucket in buckets:
+            if bucket.shape[0] == 0:
+                continue
+            if self.shuffle:
+                bucket = bucket[random.permutation(bucket.shape[0])]
+            size = max(self.documents_per_batch //
+                       max(int(lengths[bucket].max()), 1), 1)
+            batches.extend(np.array_split(
+                bucket, np.arange(size, bucket.shape[0], size)))
+        if self.shuffle:
+            batches = [batches[i]
+                       for i in random.permutation(len(batches))]
+
+        order = np.concatenate(batches) if batches else \
+            np.zeros(0, dtype=np.int64)
+        bounds = np.cumsum([0] + [batch.shape[0] for batch in batches])
+        self.efficiency = padding_efficiency(lengths, order, bounds)
+        return order, bounds
+
+
+def padding_efficiency(lengths, order, bounds):
+    """
+    Computes the fraction of padded minibatch entries that are real documents
+
+    :param lengths: The number of documents of every query
+    :param order: The order the queries are visited in
+    :param bounds: The boundaries of the minibatches in that order
+    :return: The padding efficiency, between 0 and 1
+    """
+    lengths = np.asarray(lengths)[order]
+    bounds = np.asarray(bounds)
+    if lengths.shape[0] == 0:
+        return 1.0
+    sizes = np.diff(bounds)
+    longest = np.maximum.reduceat(lengths, bounds[:-1][sizes > 0])
+    padded = np.sum(longest * sizes[sizes > 0])
+    return float(np.sum(lengths) / padded) if padded > 0 else 1.0
@@ -0,0 +1,200 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from chainer.dataset.dataset_mixin import DatasetMixin
+
+from shoelace import columnar
+from shoelace.dataset import LtrDataset, QuerySubsetMixin
+
+
+class ShardedLtrDataset(DatasetMixin, QuerySubsetMixin):
+    """
+    Learning to rank data set stored as a directory of shards
+
+    Every shard is a `LtrDataset` in binary format with its own query pointer.
+    Shards are memory-mapped lazily when one of their queries is requested,
+    and only a bounded number of recently used shards stays mapped. A global
+    query pointer over all shards is kept in memory, so the data set can be
+    used by `shoelace.iterator.LtrIterator` like a regular `LtrDataset`.
+    Shards can be requested from several threads at once (e.g. by the workers
+    of `shoelace.prefetch.PrefetchLtrIterator`).
+
+    :param directory: The directory containing the shards
+    :param max_resident_shards: The maximum number of shards mapped at once
+    """
+
+    suffix = '.shard'
+
+    def __init__(self, directory, max_resident_shards=4):
+        self.directory = directory
+        self.max_resident_shards = max_resident_shards
+        self.paths = sorted(os.path.join(directory, name)
+                            for name in os.listdir(directory)
+                            if name.endswith(ShardedLtrDataset.suffix))
+
+        # Only the query pointers and identifiers of shards are read up front,
+        # mapping the other arrays does not read them
+        query_pointers = []
+        query_ids = []
+        for path in self.paths:
+            with open(path, 'rb') as file_handle:
+                arrays, _ = columnar.load_arrays(file_handle)
+            query_pointers.append(np.array(arrays['query_pointer']))
+            query_ids.append(np.char.decode(arrays['query_ids'], 'utf-8'))
+        self.query_ids = np.concatenate(query_ids) if query_ids else \
+            np.zeros(0, dtype=np.str_)
+
+        self.shard_queries = np.zeros(len(self.paths) + 1, dtype=np.int64)
+        self.shard_documents = np.zeros(len(self.paths) + 1, dtype=np.int64)
+        for i, query_pointer in enumerate(query_pointers):
+            self.shard_queries[i + 1] = self.shard_queries[i] + \
+                query_pointer.shape[0] - 1
+            self.shard_documents[i + 1] = self.shard_documents[i] + \
+                query_pointer[-1]
+        self.query_pointer = np.concatenate(
+            [np.zeros(1, dtype=np.int64)] +
+            [query_pointer[1:] + offset for query_pointer, offset in
+             zip(query_pointers, self.shard_documents)])
+        self.nr_queries = int(self.shard_queries[-1])
+
+        self.feature_vectors = _ShardedRows(self, 'feature_vectors')
+        self.relevance_scores = _ShardedRows(self, 'relevance_scores')
+        self._resident = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Mapped shards and the lock are not copied, shards are mapped again
+        # on demand
+        state = self.__dict__.copy()
+        state['_resident'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        Returns the number of queries.
+        """
+        return self.nr_queries
+
+    def get_example(self, i):
+        """
+        Returns the i-th example.
+
+        Args:
+            i (int): The index of the example.
+
+        Returns:
+            The i-th example.
+
+        """
+        if i < 0 or i >= self.nr_queries:
+            raise IndexError
+
+        index = self.shard_index(i)
+        return self.shard(index).get_example(i - self.shard_queries[index])
+
+    def shard_index(self, i):
+        """
+        Returns the index of the shard that contains the i-th query
+        """
+        return int(np.searchsorted(self.shard_queries, i, side='right')) - 1
+
+    def shard(self, index):
+        """
+        Returns a shard as a memory-mapped `LtrDataset`, mapping it in (and
+        evicting the least recently used shard) if necessary
+
+        :param index: The index of the shard
+        :return: A `class:dataset.dataset.LtrDataset` object
+        """
+        with self._lock:
+            if index in self._resident:
+                self._resident.move_to_end(index)
+                return self._resident[index]
+
+        # Map the shard without holding the lock, a shard that another thread
+        # mapped in the meantime is used instead
+        with open(self.paths[index], 'rb') as file_handle:
+            shard = LtrDataset.load(file_handle)
+        with self._lock:
+            shard = self._resident.setdefault(index, shard)
+            self._resident.move_to_end(index)
+            while len(self._resident) > self.max_resident_shards:
+                self._resident.popitem(last=False)
+        return shard
+
+    @classmethod
+    def write(cls, directory, datasets):
+        """
+        Writes data sets as consecutive shards of a sharded data set
+
+        :param directory: The directory to write the shards to
+        :param datasets: An iterable of `LtrDataset` objects, one per shard
+        :return: A `ShardedLtrDataset` object over the written shards
+        """
+        os.makedirs(directory, exist_ok=True)
+        for i, dataset in enumerate(datasets):
+            path = os.path.join(directory, 'shard-{:05d}{}'.format(
+                i, ShardedLtrDataset.suffix))
+            with open(path, 'wb') as file_handle:
+                dataset.save(file_handle)
+        return cls(directory)
+
+    @classmethod
+    def split(cls, dataset, directory, queries_per_shard):
+        """
+        Splits a data set into shards of consecutive queries
+
+        :param dataset: The `LtrDataset` to split
+        :param directory: The directory to write the shards to
+        :param queries_per_shard: The number of queries in every shard
+        :return: A `ShardedLtrDataset` object over the written shards
+        """
+        def shards():
+            for start in range(0, dataset.nr_queries, queries_per_shard):
+                end = min(start + queries_per_shard, dataset.nr_queries)
+                first = dataset.query_pointer[start]
+                last = dataset.query_pointer[end]
+                yield LtrDataset(dataset.feature_vectors[first:last],
+                                 dataset.relevance_scores[first:last],
+                                 dataset.query_pointer[start:end + 1] - first,
+                                 dataset.query_ids[start:end], end - start)
+        return cls.write(directory, shards())
+
+
+class _ShardedRows:
+    """
+    Row accessor for one of the per-document arrays of a sharded data set,
+    resolving global document indices to rows of the right shard
+    """
+
+    def __init__(self, dataset, name):
+        self._dataset = dataset
+        self._name = name
+
+    def __len__(self):
+        return int(self._dataset.shard_documents[-1])
+
+    def __getitem__(self, key):
+        """
+        Selects a contiguous slice of rows, which may not cross shards (the
+        documents of a query never do)
+        """
+        if isinstance(key, tuple):
+            key = key[0]
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise IndexError("Only contiguous row slices are supported")
+        start, stop, _ = key.indices(len(self))
+        documents = self._dataset.shard_documents
+        index = int(np.searchsorted(documents, start, side='right')) - 1
+        index = min(index, len(self._dataset.paths) - 1)
+        if stop > documents[index + 1]:
+            raise IndexError("Row slices cannot cross shard boundaries")
+        shard = getattr(self._dataset.shard(index), self._name)
+        return shard[start - documents[index]:stop - documents[index]]
@@ -0,0 +1,153 @@
+import numpy as np
+
+
+class CsrFeatures:
+    """
+    Feature vectors stored in compressed sparse row (CSR) layout
+
+    Rows are documents, in the same order as the rows of a dense feature
+    matrix, so the query pointer of a data set indexes `indptr` directly. Only
+    row selection is supported, which is all that is needed to densify the
+    documents of a query or a batch at the moment a model needs them.
+
+    :ivar data: The stored feature values
+    :ivar indices: The column of every stored value
+    :ivar indptr: Row pointer into `data` and `indices`
+    :ivar shape: The shape of the equivalent dense matrix
+    """
+
+    ndim = 2
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(int(dimension) for dimension in shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return int(self.indptr[-1] - self.indptr[0])
+
+    def __getitem__(self, key):
+        """
+        Selects rows, either a single row (returned densely), a contiguous
+        slice of rows or an array of row indices (both returned sparsely)
+        """
+        if isinstance(key, tuple):
+            if len(key) != 2 or key[1] != slice(None):
+                raise IndexError("Only row selection is supported")
+            key = key[0]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.shape[0])
+            if step == 1:
+                return self._row_slice(start, max(start, stop))
+            key = np.arange(start, stop, step)
+        if np.ndim(key) == 0:
+            row = int(key)
+            if row < 0:
+                row += self.shape[0]
+            return self._row_slice(row, row + 1).toarray()[0]
+        return self.take(np.asarray(key))
+
+    def _row_slice(self, start, stop):
+        begin = self.indptr[start]
+        end = self.indptr[stop]
+        return CsrFeatures(self.data[begin:end], self.indices[begin:end],
+                           self.indptr[start:stop + 1] - begin,
+                           (stop - start, self.shape[1]))
+
+    def take(self, rows):
+        """
+        Gathers an arbitrary selection of rows
+
+        :param rows: An integer array of row indices
+        :return: A `CsrFeatures` object with the selected rows
+        """
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        indptr = np.zeros(rows.shape[0] + 1, dtype=self.indptr.dtype)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(self.indptr[rows] - indptr[:-1], lengths)
+        positions += np.arange(indptr[-1], dtype=positions.dtype)
+        return CsrFeatures(self.data[positions], self.indices[positions],
+                           indptr, (rows.shape[0], self.shape[1]))
+
+    def rows(self):
+        """
+        Returns the row of every stored value
+
+        :return: An integer array of the same length as `data`
+        """
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def toarray(self):
+        """
+        Densifies the feature vectors
+
+        :return: A dense `np.ndarray` of shape `self.shape`
+        """
+        result = np.zeros(self.shape, dtype=self.dtype)
+        result[self.rows(), self.indices] = self.data
+        return result
+
+    def astype(self, dtype):
+        return CsrFeatures(self.data.astype(dtype), self.indices, self.indptr,
+                           self.shape)
+
+
+def toarray(features):
+    """
+    Densifies a block of feature vectors if it is stored sparsely
+
+    :param features: A `np.ndarray` or `CsrFeatures` object
+    :return: A dense `np.ndarray`
+    """
+    if isinstance(features, CsrFeatures):
+        return features.toarray()
+    return features
+
+
+def normalize(features, query_pointer):
+    """
+    Performs query-level min-max normalization of sparse feature vectors in
+    place. Implicit zeros take part in the minimum and maximum, so they stay
+    zero as long as the minimum of every query and feature pair with implicit
+    zeros is zero (which is the case for non-negative features).
+
+    :param features: A `CsrFeatures` object with floating point values
+    :param query_pointer: The query pointer of the data set
+    """
+    if features.data.shape[0] == 0:
+        return
+    nr_of_columns = features.shape[1]
+    query_lengths = np.diff(query_pointer)
+    queries = np.repeat(np.arange(query_lengths.shape[0]), query_lengths)
+
+    # Group stored values by (query, feature) pair
+    keys = queries[features.rows()] * nr_of_columns + features.indices
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    starts = np.flatnonzero(np.concatenate([[True], keys[1:] != keys[:-1]]))
+    counts = np.diff(np.append(starts, keys.shape[0]))
+    values = features.data[order]
+    minimum = np.minimum.reduceat(values, starts)
+    maximum = np.maximum.reduceat(values, starts)
+
+    # Account for implicit zeros
+    implicit = counts < query_lengths[keys[starts] // nr_of_columns]
+    minimum[implicit] = np.minimum(minimum[implicit], 0)
+    maximum[implicit] = np.maximum(maximum[implicit], 0)
+    if np.any(minimum[implicit] != 0):
+        raise ValueError("Cannot normalize sparse features with implicit "
+                         "zeros and negative values")
+
+    scale = maximum - minimum
+    scale[scale == 0.0] = 1.0
+    groups = np.repeat(np.arange(starts.shape[0]), counts)
+    features.data[order] = (values - minimum[groups]) / scale[groups]
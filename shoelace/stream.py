@@ -0,0 +1,215 @@
+import os
+
+import numpy as np
+from chainer.dataset import iterator
+
+from shoelace import svmrank
+
+
+def read_queries(file_handle, nr_of_features, zero_based=False,
+                 block_size=1 << 20):
+    """
+    Reads an SVMRank file one query at a time, without building a data set
+
+    The file is parsed a block of lines at a time, so memory use is bounded by
+    the block size and the size of the largest query. Lines of a query must be
+    consecutive (as they are in sorted files), a query whose lines are
+    scattered across the file is returned once for every run of lines.
+
+    :param file_handle: A text or binary file handle in SVMRank format
+    :param nr_of_features: The number of features of every feature vector
+    :param zero_based: Whether feature indices start at 0 instead of 1
+    :param block_size: The approximate number of bytes parsed at once
+    :return: A generator of (features, labels) tuples per query, with float32
+             features of shape (documents, features) and float32 labels of
+             shape (documents, 1)
+    """
+    pending_qid = None
+    pending = []
+    for block in svmrank.read_blocks(file_handle, block_size):
+        parser = svmrank.SvmRankParser()
+        parser.feed(block)
+        parsed = parser.result()
+        if parsed.labels.shape[0] == 0:
+            continue
+        features = _dense_block(parsed, nr_of_features, zero_based)
+        labels = parsed.labels.astype(np.float32)[:, None]
+
+        # Split the block in runs of lines with the same qid, the last run may
+        # continue in the next block
+        starts = np.flatnonzero(np.diff(parsed.qids)) + 1
+        starts = np.concatenate([[0], starts, [labels.shape[0]]])
+        for start, end in zip(starts[:-1], starts[1:]):
+            qid = parsed.query_ids[parsed.qids[start]]
+            if qid != pending_qid and pending:
+                yield _concatenate(pending)
+                pending = []
+            pending_qid = qid
+            pending.append((features[start:end], labels[start:end]))
+    if pending:
+        yield _concatenate(pending)
+
+
+def _dense_block(parsed, nr_of_features, zero_based):
+    """
+    Scatters the features of a parsed block into a dense float32 matrix
+    """
+    columns = parsed.indices if zero_based else parsed.indices - 1
+    if columns.shape[0] > 0 and (columns.min() < 0 or
+                                 columns.max() >= nr_of_features):
+        raise ValueError("Feature index out of range for {} features".format(
+            nr_of_features))
+    rows = np.repeat(np.arange(parsed.labels.shape[0]),
+                     np.diff(parsed.indptr))
+    features = np.zeros((parsed.labels.shape[0], nr_of_features),
+                        dtype=np.float32)
+    features[rows, columns] = parsed.values
+    return features
+
+
+def _concatenate(parts):
+    if len(parts) == 1:
+        return parts[0]
+    return (np.concatenate([features for features, _ in parts]),
+            np.concatenate([labels for _, labels in parts]))
+
+
+class _CountingReader:
+    """
+    Binary file wrapper that counts the bytes read from the underlying file,
+    i.e. before decompression
+    """
+
+    def __init__(self, file_handle):
+        self._file_handle = file_handle
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        block = self._file_handle.read(size)
+        self.bytes_read += len(block)
+        return block
+
+    def readinto(self, buffer):
+        size = self._file_handle.readinto(buffer)
+        self.bytes_read += size or 0
+        return size
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._file_handle.close()
+
+    @property
+    def closed(self):
+        return self._file_handle.closed
+
+
+class LtrStreamIterator(iterator.Iterator):
+    """Dataset iterator that streams learning-to-rank examples from a file.
+
+    Like :class:`shoelace.iterator.LtrIterator`, every minibatch contains all
+    the documents of a query, but queries are read from an SVMRank file (plain
+    or compressed with gzip, xz or bzip2) while iterating instead of from a
+    data set in memory. The progress within an epoch (`epoch_detail`) is the
+    fraction of the (compressed) file that has been read.
+
+    Queries can be shuffled approximately with a shuffle buffer: the buffer is
+    filled with the next queries of the file and every minibatch is drawn from
+    it at random.
+
+    Args:
+        path: The path of the SVMRank file. Lines of a query must be
+            consecutive.
+        nr_of_features: The number of features of every feature vector.
+        repeat: Whether to repeat iterations over the file (default: False)
+        shuffle_buffer: The number of queries to shuffle among, 0 to keep the
+            order of the file (default: 0)
+        seed: The seed of the shuffle buffer (default: None)
+        zero_based: Whether feature indices start at 0 instead of 1
+        block_size: The approximate number of bytes parsed at once
+
+    """
+
+    def __init__(self, path, nr_of_features, repeat=False, shuffle_buffer=0,
+                 seed=None, zero_based=False, block_size=1 << 20):
+        self.path = path
+        self.nr_of_features = nr_of_features
+        self._repeat = repeat
+        self._shuffle_buffer = shuffle_buffer
+        self._random = np.random.RandomState(seed)
+        self._zero_based = zero_based
+        self._block_size = block_size
+        self._size = max(os.path.getsize(path), 1)
+        self._file_handle = None
+        self._counter = None
+        self.reset()
+
+    def __next__(self):
+        if not self._repeat and self.epoch > 0:
+            raise StopIteration
+        self._previous_epoch_detail = self.epoch_detail
+
+        # Keep the buffer filled, holding at least the next query so the end
+        # of an epoch is known when its last query is returned
+        self._fill()
+        if not self._buffer:
+            raise StopIteration
+        index = self._random.randint(len(self._buffer)) \
+            if self._shuffle_buffer > 0 else 0
+        features, labels = self._buffer.pop(index)
+        self._fill()
+
+        self.batch_size = labels.shape[0]
+        self.is_new_epoch = not self._buffer
+        if self.is_new_epoch:
+            self.epoch += 1
+            self._open()
+        return [(features[i], labels[i]) for i in range(labels.shape[0])]
+
+    def _fill(self):
+        while len(self._buffer) < max(self._shuffle_buffer, 1) and \
+                self._queries is not None:
+            try:
+                self._buffer.append(next(self._queries))
+            except StopIteration:
+                self._queries = None
+
+    def _open(self):
+        """
+        (Re)opens the file at the start of an epoch
+        """
+        self.finalize()
+        self._counter = _CountingReader(open(self.path, 'rb'))
+        self._file_handle = svmrank.open_file(self.path, 'rb', self._counter)
+        self._queries = read_queries(self._file_handle, self.nr_of_features,
+                                     self._zero_based, self._block_size)
+        self._buffer = []
+
+    @property
+    def epoch_detail(self):
+        # Files are read ahead of the returned queries, so the fraction is kept
+        # below 1 until the epoch actually ends
+        return self.epoch + min(self._counter.bytes_read,
+                                self._size - 1) / self._size
+
+    @property
+    def previous_epoch_detail(self):
+        return self._previous_epoch_detail
+
+    def finalize(self):
+        if self._file_handle is not None:
+            self._file_handle.close()
+            self._counter.close()
+            self._file_handle = None
+
+    def serialize(self, serializer):
+        self.epoch = serializer('epoch', self.epoch)
+        self.is_new_epoch = serializer('is_new_epoch', self.is_new_epoch)
+
+    def reset(self):
+        self.batch_size = 0
+        self.epoch = 0
+        self.is_new_epoch = False
+        self._previous_epoch_detail = None
+        self._open()
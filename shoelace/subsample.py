@@ -0,0 +1,116 @@
+import numpy as np
+
+
+methods = ('random', 'stratified', 'score')
+
+
+def subsample(starts, lengths, labels, max_documents, method='random',
+              random=np.random, scores=None):
+    """
+    Caps the number of documents of every query in a minibatch
+
+    Documents are selected for all queries at once by giving every document a
+    key and keeping the documents with the smallest keys of every query:
+
+    * 'random' keeps all relevant documents (label above 0) and a uniform
+      random sample of the non-relevant ones.
+    * 'stratified' keeps all relevant documents and a sample of the
+      non-relevant ones that is spread evenly over their ranking by `scores`
+      (or over their order in the data set without scores), so easy and hard
+      negatives are both represented.
+    * 'score' keeps the documents with the highest `scores`, e.g. of a first
+      stage ranker.
+
+    Queries with more relevant documents than `max_documents` keep a random
+    sample of their relevant documents. Selected documents keep their order.
+
+    :param starts: The first document of every query
+    :param lengths: The number of documents of every query
+    :param labels: The relevance labels of the data set, either an array or a
+                   row accessor that only supports slices (e.g. of a sharded
+                   data set)
+    :param max_documents: The maximum number of documents per query
+    :param method: One of 'random', 'stratified' or 'score'
+    :param random: The `np.random.RandomState` to sample with
+    :param scores: A score for every document of the data set, required for
+                   'score' and optional for 'stratified'
+    :return: A tuple of the selected documents of all queries (concatenated)
+             and the number of selected documents of every query
+    """
+    if method not in methods:
+        raise ValueError("Unknown subsampling method '{}'".format(method))
+    if method == 'score' and scores is None:
+        raise ValueError("Subsampling by score requires scores")
+    starts = np.asarray(starts)
+    lengths = np.asarray(lengths)
+    queries = np.repeat(np.arange(lengths.shape[0]), lengths)
+    first = np.cumsum(lengths) - lengths
+    offsets = np.arange(queries.shape[0]) - first[queries]
+    positions = starts[queries] + offsets
+    sizes = np.minimum(lengths, max_documents)
+    if np.all(sizes == lengths):
+        return positions, sizes
+
+    if method == 'score':
+        keys = -np.asarray(scores, dtype=np.float64)[positions]
+    else:
+        relevant = _query_labels(labels, starts, lengths,
+                                 positions).ravel() > 0
+        if method == 'random':
+            keys = random.random_sample(positions.shape[0])
+        else:
+            ranking = offsets if scores is None else \
+                -np.asarray(scores, dtype=np.float64)[positions]
+            ranks = _group_ranks(queries * 2 + relevant, ranking)
+            keys = _radical_inverse(ranks) + \
+                random.random_sample(lengths.shape[0])[queries]
+            keys -= np.floor(keys)
+        keys[relevant] = random.random_sample(np.sum(relevant)) - 2.0
+
+    ranks = _group_ranks(queries, keys)
+    return positions[ranks < max_documents], sizes
+
+
+def _query_labels(labels, starts, lengths, positions):
+    """
+    Gathers the labels of all documents of the queries, row accessors that
+    only support slices are sliced per query
+    """
+    if isinstance(labels, np.ndarray):
+        return labels[positions]
+    return np.concatenate([np.asarray(labels[start:start + length])
+                           for start, length in zip(starts.tolist(),
+                                                    lengths.tolist())])
+
+
+def _group_ranks(groups, keys):
+    """
+    Ranks values by ascending key within their group
+
+    :param groups: The group of every value
+    :param keys: The key of every value
+    :return: The rank of every value within its group
+    """
+    order = np.lexsort((keys, groups))
+    sorted_groups = groups[order]
+    boundaries = np.concatenate([[True], sorted_groups[1:] !=
+                                 sorted_groups[:-1]])
+    first = np.maximum.accumulate(np.where(boundaries,
+                                           np.arange(order.shape[0]), 0))
+    ranks = np.empty(order.shape[0], dtype=np.int64)
+    ranks[order] = np.arange(order.shape[0]) - first
+    return ranks
+
+
+def _radical_inverse(values):
+    """
+    Computes the base 2 radical inverse (van der Corput sequence) of integers,
+    every prefix of which is spread evenly over [0, 1)
+    """
+    bits = values.astype(np.uint32)
+    bits = ((bits >> 1) & 0x55555555) | ((bits & 0x55555555) << 1)
+    bits = ((bits >> 2) & 0x33333333) | ((bits & 0x33333333) << 2)
+    bits = ((bits >> 4) & 0x0F0F0F0F) | ((bits & 0x0F0F0F0F) << 4)
+    bits = ((bits >> 8) & 0x00FF00FF) | ((bits & 0x00FF00FF) << 8)
+    bits = (bits >> 16) | (bits << 16)
+    return bits / 2.0 ** 32
@@ -0,0 +1,474 @@
+import bz2
+import gzip
+import io
+import lzma
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from shoelace.dtypes import index_dtype, upcast
+from shoelace.sparse import CsrFeatures
+
+
+ParsedSvmRank = namedtuple('ParsedSvmRank', ['labels', 'qids', 'query_ids',
+                                             'indptr', 'indices', 'values'])
+"""
+Raw, row-ordered contents of an SVMRank file
+
+:ivar labels: The relevance label of every line as a float64 vector
+:ivar qids: Integer query code of every line, codes are assigned in order of
+            first appearance
+:ivar query_ids: The original query identifiers, indexed by query code
+:ivar indptr: Row pointer into `indices` and `values` (CSR layout)
+:ivar indices: The feature indices exactly as written in the file
+:ivar values: The feature values
+"""
+
+
+_openers = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.lzma': lzma.open,
+    '.bz2': bz2.open
+}
+
+
+def open_file(path, mode='rb', fileobj=None):
+    """
+    Opens a file, transparently (de)compressing it when its extension is one
+    of .gz, .xz, .lzma or .bz2
+
+    :param path: The path of the file
+    :param mode: The mode to open the file in
+    :param fileobj: An already opened binary file handle of the file to wrap
+                    instead of opening the path (closing the result does not
+                    close it)
+    :return: A file handle
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if fileobj is not None:
+        return _openers[extension](fileobj, mode) if extension in _openers \
+            else fileobj
+    return _openers.get(extension, open)(path, mode)
+
+
+def is_compressed(path):
+    """
+    Checks whether `open_file` would decompress a file
+
+    :param path: The path of the file
+    :return: True if the file has a compressed file extension
+    """
+    return os.path.splitext(path)[1].lower() in _openers
+
+
+class _GrowableArray:
+    """
+    A one-dimensional array with amortized constant-time appends, used to fill
+    parse results directly without keeping per-line python objects around
+    """
+
+    def __init__(self, dtype, capacity=4096):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values):
+        end = self._size + values.shape[0]
+        if end > self._data.shape[0]:
+            capacity = max(end, 2 * self._data.shape[0])
+            data = np.empty(capacity, dtype=self._data.dtype)
+            data[:self._size] = self._data[:self._size]
+            self._data = data
+        self._data[self._size:end] = values
+        self._size = end
+
+    def to_array(self):
+        """
+        Returns the filled part of the array, releasing the spare capacity
+
+        :return: A `np.ndarray` of length `len(self)`
+        """
+        self._data.resize(self._size, refcheck=False)
+        return self._data
+
+
+class SvmRankParser:
+    """
+    Incremental parser for the SVMRank text format
+
+    Instead of handling the input line by line, all numbers in a block of
+    complete lines are converted at once by numpy and the line structure is
+    recovered from the colon count of every line. Results are appended to
+    growable label, qid and (CSR-style) feature arrays.
+    """
+
+    comment_regex = re.compile(b'#[^\n]*')
+    qid_regex = re.compile(b'qid:(\\S*)')
+
+    def __init__(self):
+        self._labels = _GrowableArray(np.float64)
+        self._qids = _GrowableArray(np.int64)
+        self._row_lengths = _GrowableArray(np.int64)
+        self._indices = _GrowableArray(np.int64)
+        self._values = _GrowableArray(np.float64)
+        self._query_codes = {}
+
+    def feed(self, block):
+        """
+        Parses a block of complete lines
+
+        :param block: A `bytes` object that does not end in the middle of a line
+        """
+        block = SvmRankParser.comment_regex.sub(b'', block)
+        if not block.endswith(b'\n'):
+            block += b'\n'
+
+        # Every line is `label qid:<qid> (<index>:<value>)*`, so the number of
+        # colons on a line tells us how many numbers it contributes. Lines
+        # without colons are empty (or only contained a comment).
+        raw = np.frombuffer(block, dtype=np.uint8)
+        line_ends = np.flatnonzero(raw == ord('\n'))
+        colons = np.bincount(np.searchsorted(line_ends,
+                                             np.flatnonzero(raw == ord(':'))),
+                             minlength=line_ends.shape[0])
+        colons = colons[colons > 0]
+
+        # Query identifiers are kept as written, all other numbers in the block
+        # are converted at once
+        qids = SvmRankParser.qid_regex.findall(block)
+        numbers = SvmRankParser.qid_regex.sub(b' ', block).replace(b':', b' ')
+        numbers = np.fromstring(numbers, dtype=np.float64, sep=' ')
+        if numbers.shape[0] != 2 * np.sum(colons) - colons.shape[0] or \
+                len(qids) != colons.shape[0] or not all(qids):
+            raise ValueError("Malformed SVMRank data")
+
+        line_starts = np.zeros(colons.shape[0], dtype=np.int64)
+        np.cumsum(2 * colons[:-1] - 1, out=line_starts[1:])
+        self._labels.extend(numbers[line_starts])
+        self._qids.extend(self._encode_qids(qids))
+
+        # All remaining numbers are alternating feature indices and values
+        is_feature = np.ones(numbers.shape[0], dtype=np.bool_)
+        is_feature[line_starts] = False
+        features = numbers[is_feature]
+        self._row_lengths.extend(colons - 1)
+        self._indices.extend(features[0::2].astype(np.int64))
+        self._values.extend(features[1::2])
+
+    def _encode_qids(self, qids):
+        """
+        Maps the qids of a block, given as the `bytes` they are written as, to
+        integer codes, assigning new codes in order of first appearance
+        """
+        unique, first, inverse = np.unique(np.array(qids, dtype=np.bytes_),
+                                           return_index=True,
+                                           return_inverse=True)
+        codes = np.empty(unique.shape[0], dtype=np.int64)
+        for i in np.argsort(first):
+            qid = unique[i].decode('utf-8')
+            codes[i] = self._query_codes.setdefault(qid,
+                                                    len(self._query_codes))
+        return codes[inverse]
+
+    def result(self):
+        """
+        Returns everything parsed so far
+
+        :return: A `ParsedSvmRank` tuple
+        """
+        indptr = np.zeros(len(self._row_lengths) + 1, dtype=np.int64)
+        np.cumsum(self._row_lengths.to_array(), out=indptr[1:])
+        return ParsedSvmRank(self._labels.to_array(), self._qids.to_array(),
+                             list(self._query_codes), indptr,
+                             self._indices.to_array(), self._values.to_array())
+
+
+def read_blocks(file_handle, block_size=1 << 22):
+    """
+    Reads a text or binary file handle in blocks that end on line boundaries
+
+    :param file_handle: The file to read from
+    :param block_size: The approximate size of every block
+    :return: A generator of `bytes` blocks
+    """
+    remainder = b''
+    while True:
+        block = file_handle.read(block_size)
+        if not block:
+            break
+        if isinstance(block, str):
+            block = block.encode('utf-8')
+        end = block.rfind(b'\n') + 1
+        if end == 0:
+            remainder += block
+            continue
+        yield remainder + block[:end]
+        remainder = block[end:]
+    if remainder:
+        yield remainder
+
+
+def parse(file_handle, block_size=1 << 22):
+    """
+    Parses an SVMRank file
+
+    :param file_handle: A text or binary file handle to read from
+    :param block_size: Number of bytes tokenized at once
+    :return: A `ParsedSvmRank` tuple
+    """
+    parser = SvmRankParser()
+    for block in read_blocks(file_handle, block_size):
+        parser.feed(block)
+    return parser.result()
+
+
+class _RangeReader:
+    """
+    File-like reader over the lines that start within a byte range of a file,
+    a line belongs to the range if its first byte does
+    """
+
+    def __init__(self, file_handle, start, end):
+        self._file_handle = file_handle
+        if start > 0:
+            file_handle.seek(start - 1)
+            file_handle.readline()
+        self._position = file_handle.tell()
+        self._end = end
+
+    def read(self, size):
+        if self._position >= self._end:
+            return b''
+        block = self._file_handle.read(min(size, self._end - self._position))
+        self._position += len(block)
+        if self._position >= self._end and not block.endswith(b'\n'):
+            block += self._file_handle.readline()
+        return block
+
+
+def _parse_range(path, start, end, block_size):
+    with open(path, 'rb') as file_handle:
+        return parse(_RangeReader(file_handle, start, end), block_size)
+
+
+def parse_parallel(path, n_jobs, block_size=1 << 22):
+    """
+    Parses an SVMRank file with a pool of processes, each one parsing a byte
+    range of the file that is aligned to line boundaries
+
+    :param path: The path of the file to parse
+    :param n_jobs: The number of processes to use
+    :param block_size: Number of bytes tokenized at once
+    :return: A `ParsedSvmRank` tuple, identical to the one `parse` returns
+    """
+    bounds = np.linspace(0, os.path.getsize(path), n_jobs + 1).astype(np.int64)
+    with ProcessPoolExecutor(n_jobs) as pool:
+        parts = list(pool.map(_parse_range, [path] * n_jobs, bounds[:-1],
+                              bounds[1:], [block_size] * n_jobs))
+    return concatenate(parts)
+
+
+def concatenate(parts):
+    """
+    Stitches parse results of consecutive parts of a file together. Query codes
+    are remapped so that a query spanning several parts gets a single code.
+
+    :param parts: A list of `ParsedSvmRank` tuples in file order
+    :return: A `ParsedSvmRank` tuple
+    """
+    query_codes = {}
+    qids = []
+    indptr = [np.zeros(1, dtype=np.int64)]
+    offset = 0
+    for part in parts:
+        mapping = np.array([query_codes.setdefault(qid, len(query_codes))
+                            for qid in part.query_ids], dtype=np.int64)
+        qids.append(mapping[part.qids])
+        indptr.append(part.indptr[1:] + offset)
+        offset += part.indptr[-1]
+    return ParsedSvmRank(np.concatenate([part.labels for part in parts]),
+                         np.concatenate(qids), list(query_codes),
+                         np.concatenate(indptr),
+                         np.concatenate([part.indices for part in parts]),
+                         np.concatenate([part.values for part in parts]))
+
+
+def query_order(qids, nr_of_queries):
+    """
+    Computes the row order that groups lines by query and the resulting query
+    pointer. Rows of one query keep their relative order, and queries are
+    ordered by first appearance.
+
+    :param qids: The query code of every row
+    :param nr_of_queries: The number of distinct query codes
+    :return: A tuple of the row order (or `None` when the rows are already
+             grouped) and the query pointer
+    """
+    query_pointer = np.zeros(nr_of_queries + 1, dtype=np.int64)
+    np.cumsum(np.bincount(qids, minlength=nr_of_queries),
+              out=query_pointer[1:])
+    if np.all(qids[1:] >= qids[:-1]):
+        return None, query_pointer
+    return np.argsort(qids, kind='mergesort'), query_pointer
+
+
+def feature_columns(indices):
+    """
+    Maps SVMRank feature indices to matrix columns. Feature indices start at 1,
+    unless a file contains a feature with index 0, in which case it is taken to
+    be 0-based. The offset is the same for every line, so lines that omit some
+    features keep the remaining ones in the right column.
+
+    :param indices: The feature indices as written in the file
+    :return: The column of every feature
+    """
+    if indices.shape[0] == 0:
+        return indices
+    return indices - min(int(indices.min()), 1)
+
+
+def dense_features(indptr, indices, values, dtype=np.float64):
+    """
+    Scatters CSR-style feature data into a dense matrix
+
+    :param indptr: The row pointer
+    :param indices: The feature indices
+    :param values: The feature values
+    :param dtype: The dtype of the resulting matrix
+    :return: A dense `np.ndarray` of shape (rows, features)
+    """
+    nr_of_rows = indptr.shape[0] - 1
+    rows = np.repeat(np.arange(nr_of_rows), np.diff(indptr))
+    columns = feature_columns(indices)
+    nr_of_columns = int(columns.max()) + 1 if columns.shape[0] > 0 else 0
+    result = np.zeros((nr_of_rows, nr_of_columns), dtype=dtype)
+    result[rows, columns] = values
+    return result
+
+
+def sparse_features(indptr, indices, values, dtype=np.float64):
+    """
+    Converts CSR-style feature data to a `CsrFeatures` object, dropping
+    explicitly stored zeros
+
+    :param indptr: The row pointer
+    :param indices: The feature indices
+    :param values: The feature values
+    :param dtype: The dtype of the stored values
+    :return: A `CsrFeatures` object
+    """
+    columns = feature_columns(indices)
+    nr_of_columns = int(columns.max()) + 1 if columns.shape[0] > 0 else 0
+    keep = values != 0
+    kept = np.zeros(keep.shape[0] + 1, dtype=np.int64)
+    np.cumsum(keep, out=kept[1:])
+    return CsrFeatures(values[keep].astype(dtype),
+                       columns[keep].astype(np.int32),
+                       kept[indptr].astype(index_dtype(kept[-1])),
+                       (indptr.shape[0] - 1, nr_of_columns))
+
+
+def _float_format(dtype):
+    """
+    Returns a printf-style format that represents every value of given float
+    dtype exactly, so written files load back to the same values
+    """
+    digits = {2: 5, 4: 9}.get(np.dtype(dtype).itemsize, 17)
+    return '%.{}g'.format(digits)
+
+
+def _last_column_empty(features):
+    """
+    Checks whether the last feature column of a dense `np.ndarray` or
+    `CsrFeatures` object only holds zeros
+    """
+    if features.shape[1] == 0:
+        return False
+    if isinstance(features, CsrFeatures):
+        last = features.indices == features.shape[1] - 1
+        return not np.any(upcast(features.data[last]) != 0)
+    return not np.any(upcast(features[:, -1]) != 0)
+
+
+def write(file_handle, features, labels, query_pointer, query_ids,
+          comments=None, skip_zeros=False, fmt=None, block_size=4096):
+    """
+    Writes documents in SVMRank format. Documents are formatted a block of rows
+    at a time with a single printf-style operation per block (dense output) or
+    per row (sparse output), and written with one call per block.
+
+    Sparse output writes an explicit zero for the highest feature index on the
+    first line when that feature is zero for every document, so that the file
+    loads back with the same number of features.
+
+    :param file_handle: A text or binary file handle to write to
+    :param features: A dense `np.ndarray` or `CsrFeatures` object
+    :param labels: The relevance label of every document
+    :param query_pointer: The query pointer
+    :param query_ids: The identifier of every query
+    :param comments: Optional sequence of per-document comments (e.g. docids)
+    :param skip_zeros: Whether to leave out zero-valued features
+    :param fmt: The printf-style format of feature values, by default the
+                shortest format that represents every value exactly
+    :param block_size: The number of documents formatted at once
+    """
+    if fmt is None:
+        fmt = _float_format(features.dtype)
+    binary = not isinstance(file_handle, io.TextIOBase)
+    labels = np.asarray(labels).reshape(-1)
+    nr_of_columns = features.shape[1]
+    dense_template = ' '.join('{}:{}'.format(i + 1, fmt)
+                              for i in range(nr_of_columns))
+    pair_template = ' %d:' + fmt + '\0'
+    label_template = ('%d' if labels.dtype.kind in 'biu' else
+                      _float_format(labels.dtype)) + ' qid:%s'
+    sparse_output = isinstance(features, CsrFeatures) or skip_zeros
+    pad_last = sparse_output and _last_column_empty(features)
+
+    for start in range(0, labels.shape[0], block_size):
+        end = min(start + block_size, labels.shape[0])
+        queries = np.searchsorted(query_pointer, np.arange(start, end),
+                                  side='right') - 1
+        prefixes = [label_template % (label, query_ids[query]) for label, query
+                    in zip(labels[start:end].tolist(), queries.tolist())]
+        if comments is None:
+            suffixes = [''] * (end - start)
+        else:
+            suffixes = [' #' + str(comment) for comment in comments[start:end]]
+        if pad_last and start == 0:
+            suffixes[0] = ' %d:0' % nr_of_columns + suffixes[0]
+
+        block = upcast(features[start:end])
+        if sparse_output:
+            if not isinstance(block, CsrFeatures):
+                rows, columns = np.nonzero(block)
+                values = block[rows, columns]
+                indptr = np.searchsorted(rows, np.arange(end - start + 1))
+            else:
+                columns, values, indptr = block.indices, block.data, \
+                    block.indptr - block.indptr[0]
+            pairs = np.empty(2 * columns.shape[0], dtype=object)
+            pairs[0::2] = columns + 1
+            pairs[1::2] = values
+            pairs = (pair_template * columns.shape[0] %
+                     tuple(pairs.tolist())).split('\0')
+            lines = [prefix + ''.join(pairs[first:last]) + suffix + '\n'
+                     for prefix, first, last, suffix in
+                     zip(prefixes, indptr[:-1].tolist(), indptr[1:].tolist(),
+                         suffixes)]
+        else:
+            template = '%s ' + dense_template + '%s\n'
+            rows = np.empty((end - start, nr_of_columns + 2), dtype=object)
+            rows[:, 0] = prefixes
+            rows[:, 1:-1] = block
+            rows[:, -1] = suffixes
+            lines = [(template * (end - start)) % tuple(rows.ravel().tolist())]
+
+        text = ''.join(lines)
+        file_handle.write(text.encode('utf-8') if binary else text)
@@ -1,7 +1,7 @@
 import numpy as np
 from nose.tools import assert_true
 from shoelace.functions.logcumsumexp import logcumsumexp, LogCumsumExp
-from chainer import Variable
+from chainer import Variable, gradient_check
 
 
 def test_forward():
@@ -35,5 +35,49 @@ def test_backward():
     lcse.forward((x.data,))
     result = lcse.backward((x.data, ), (g.data, ))
 
-    # Assert that the result equals the expected result
-    assert_true(np.array_equal(result[0], expected_result))
+    # Assert that the result equals the expected result (up to rounding, the
+    # gradient is accumulated in log space)
+    assert_true(np.allclose(result[0], expected_result))
+
+
+def test_axis():
+
+    # Every row is accumulated on its own
+    x = np.array([[5., 3., 3., 1., 0.], [0., 1., 2., 3., 4.]])
+    result = logcumsumexp(x, axis=1)
+    for row, expected in zip(x, result.data):
+        assert_true(np.allclose(logcumsumexp(row).data, expected))
+
+
+def test_large_values():
+
+    # Large differences neither overflow nor lose the small sums
+    for dtype in (np.float32, np.float64):
+        x = Variable(np.array([1000., 0., -1000., 500.], dtype=dtype))
+        result = logcumsumexp(x)
+        assert_true(np.allclose(result.data, [1000., 500., 500., 500.]))
+        result.grad = np.ones(4, dtype=dtype)
+        result.backward()
+        assert_true(np.allclose(x.grad, [1., 0., 0., 3.], atol=1e-4))
+
+
+def test_mask():
+
+    # Masked elements are left out of the sums and get no gradient
+    x = np.array([[5., 3., 3., 1., 0.], [0., 1., 2., 3., 4.]])
+    mask = np.array([[True] * 5, [True, True, True, False, False]])
+    gradient_check.check_backward(lambda v: logcumsumexp(v, 1, mask), x,
+                                  np.ones_like(x))
+    result = logcumsumexp(x, axis=1, mask=mask)
+    assert_true(np.allclose(result.data[1, :3],
+                            logcumsumexp(x[1, :3]).data))
+    assert_true(np.all(result.data[1, 3:] == 0.0))
+
+
+def test_underflowing_rows():
+
+    # Only the second row spans more than float32 can shift, both are exact
+    x = np.array([[3., 2., 1., 0.], [300., 0., -1., 200.]], dtype=np.float32)
+    result = logcumsumexp(x, axis=1)
+    expected = np.flip(np.logaddexp.accumulate(np.flip(x, 1), axis=1), 1)
+    assert_true(np.allclose(result.data, expected))
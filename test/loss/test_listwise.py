@@ -1,6 +1,10 @@
 import numpy as np
-from nose.tools import assert_equal, assert_almost_equal
-from shoelace.loss.listwise import listnet, listmle, listpl
+import chainer.functions as F
+from chainer import Variable
+from nose.tools import assert_equal, assert_almost_equal, assert_true
+from shoelace.functions.logcumsumexp import logcumsumexp
+from shoelace.loss.listwise import listnet, listmle, listpl, \
+    padded_listnet, padded_listmle, padded_listpl, _pl_sample
 
 
 def test_listnet():
@@ -51,3 +55,142 @@ def test_listpl_near_zero_loss():
 
     result = listpl(x, t)
     assert_almost_equal(result.data, 0.0)
+
+
+def _padded(columns):
+    lengths = [column.shape[0] for column in columns]
+    padded = np.zeros((len(columns), max(lengths)))
+    mask = np.zeros(padded.shape, dtype=bool)
+    for i, column in enumerate(columns):
+        padded[i, :lengths[i]] = column[:, 0]
+        mask[i, :lengths[i]] = True
+    return padded, mask
+
+
+def _queries():
+    xs = [np.array([[3., 3., 2., 0.]]).T, np.array([[1., -2.]]).T,
+          np.array([[0.5, 4., 1., 2., 1.5]]).T]
+    ts = [np.array([[0.5, 1.0, 0.3, 0.5]]).T, np.array([[1., 0.]]).T,
+          np.array([[0., 2., 1., 0., 1.]]).T]
+    return xs, ts
+
+
+def test_padded_listmle():
+    xs, ts = _queries()
+    x, mask = _padded(xs)
+    t, _ = _padded(ts)
+
+    # Losses and gradients match those of the individual queries
+    x = Variable(x)
+    result = padded_listmle(x, t, mask, reduce='no')
+    F.sum(result).backward()
+    for i, (xi, ti) in enumerate(zip(xs, ts)):
+        xi = Variable(xi)
+        expected = listmle(xi, ti)
+        expected.backward()
+        assert_almost_equal(result.data[i], expected.data)
+        assert_true(np.allclose(x.grad[i, mask[i]], xi.grad[:, 0]))
+    assert_true(np.all(x.grad[~mask] == 0.0))
+    assert_almost_equal(padded_listmle(x, t, mask).data,
+                        np.mean(result.data))
+
+
+def test_padded_listnet():
+    xs, ts = _queries()
+    x, mask = _padded(xs)
+    t, _ = _padded(ts)
+
+    result = padded_listnet(x, t, mask, reduce='no')
+    for i, (xi, ti) in enumerate(zip(xs, ts)):
+        assert_almost_equal(result.data[i], listnet(xi, ti).data)
+
+
+def test_padded_listpl():
+    xs, ts = _queries()
+    x, mask = _padded(xs)
+    t, _ = _padded(ts)
+
+    # A single query draws the same permutations as the unpadded loss
+    np.random.seed(4101)
+    result = padded_listpl(xs[2].T, ts[2].T, n_samples=3)
+    np.random.seed(4101)
+    assert_almost_equal(result.data, listpl(xs[2], ts[2], n_samples=3).data)
+
+    # Padding is never sampled
+    x = Variable(x)
+    F.sum(padded_listpl(x, t, mask, n_samples=4, reduce='no')).backward()
+    assert_true(np.all(x.grad[~mask] == 0.0))
+    assert_true(np.all(np.isfinite(x.grad)))
+
+
+def test_pl_sample():
+    np.random.seed(4101)
+    probabilities = np.array([0.5, 0.3, 0.2])
+    t = np.log(probabilities)[None, :]
+
+    # Every sample is a permutation, starting with a document in proportion
+    # to its probability
+    samples = _pl_sample(t, 1.0, n_samples=20000)
+    assert_equal(samples.shape, (20000, 1, 3))
+    assert_true(np.all(np.sort(samples, axis=2) == np.arange(3)))
+    first = np.bincount(samples[:, 0, 0], minlength=3) / 20000
+    assert_true(np.allclose(first, probabilities, atol=0.02))
+
+
+def test_listmle_top_k():
+    x = np.array([[0.5, 2., -1., 1., 0., 1.5, 3.]]).T
+    t = np.array([[1., 2., 0., 0., 2., 1., 0.]]).T
+    order = np.array([4, 1, 5, 0, 6, 3, 2])
+
+    # The top-k terms of the full loss, with or without a known order
+    x_hat = x[order]
+    terms = logcumsumexp(x_hat).data - x_hat
+    for k in (1, 3, 6):
+        assert_almost_equal(listmle(x, t, k=k).data, np.sum(terms[:k]))
+        assert_almost_equal(listmle(x, t, order=order, k=k).data,
+                            np.sum(terms[:k]))
+    assert_almost_equal(listmle(x, t, order=order, k=7).data, np.sum(terms))
+
+    # Gradients flow to the tail through its log-sum-exp
+    x = Variable(x)
+    listmle(x, t, k=2).backward()
+    assert_true(np.all(x.grad[[0, 2, 3, 5, 6]] > 0.0))
+
+
+def test_listmle_compact_labels():
+    x = np.array([[0.5, 2., -1., 1.]]).T
+    t = np.array([[2, 0, 3, 1]], dtype=np.uint8).T
+
+    # Integer labels select the same documents as float labels
+    for k in (0, 2):
+        assert_almost_equal(listmle(x, t, k=k).data,
+                            listmle(x, t.astype(np.float64), k=k).data)
+
+
+def test_listmle_ties():
+    x = np.array([[0.5, 2., -1., 1., 0.]]).T
+    t = np.array([[1., 1., 0., 1., 0.]]).T
+
+    # Without and with a cut-off at the full length, ties are ordered alike
+    assert_almost_equal(listmle(x, t, k=4).data,
+                        np.sum((logcumsumexp(x[[3, 1, 0, 4, 2]]).data -
+                                x[[3, 1, 0, 4, 2]])[:4]))
+    assert_almost_equal(listmle(x, t).data,
+                        np.sum(logcumsumexp(x[[3, 1, 0, 4, 2]]).data -
+                               x[[3, 1, 0, 4, 2]]))
+
+
+def test_compact_labels():
+    x = np.array([[0.1, 0.3, 0.2]]).T
+    t = np.array([[9, 0, 3]], dtype=np.uint8).T
+
+    # Integer labels give the same losses as float labels
+    assert_almost_equal(listnet(x, t).data,
+                        listnet(x, t.astype(np.float64)).data)
+    for loss in (padded_listnet, padded_listmle):
+        assert_almost_equal(loss(x.T, t.T).data,
+                            loss(x.T, t.T.astype(np.float64)).data)
+    np.random.seed(4101)
+    result = listpl(x, t)
+    np.random.seed(4101)
+    assert_almost_equal(result.data, listpl(x, t.astype(np.float64)).data)
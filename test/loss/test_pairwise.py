@@ -0,0 +1,89 @@
+import numpy as np
+from chainer import Variable, gradient_check
+from nose.tools import assert_almost_equal, assert_true
+from shoelace.evaluation import ndcg
+from shoelace.loss.pairwise import ranknet, lambdarank, padded_ranknet, \
+    padded_lambdarank
+
+
+def _query():
+    x = np.array([[0.5, 2., -1., 1., 0., 1.5, 3.]]).T
+    t = np.array([[1., 2., 0., 0., 2., 1., 0.]]).T
+    return x, t
+
+
+def _pairs(x, t, weight):
+    return sum(weight(i, j) * np.logaddexp(0.0, x[j, 0] - x[i, 0])
+               for i in range(x.shape[0]) for j in range(x.shape[0])
+               if t[i, 0] > t[j, 0])
+
+
+def test_ranknet():
+    x, t = _query()
+
+    # All pairs are counted once, regardless of the tiling
+    expected = _pairs(x, t, lambda i, j: 1.0)
+    assert_almost_equal(ranknet(x, t).data, expected)
+    assert_almost_equal(ranknet(x, t, tile_size=2).data, expected)
+    gradient_check.check_backward(lambda v: ranknet(v, t, tile_size=3), x,
+                                  np.array(1.0))
+
+
+def test_ranknet_equal_labels():
+    x = np.array([[1.], [2.], [3.]])
+    t = np.array([[1.], [1.], [1.]])
+    assert_almost_equal(ranknet(x, t).data, 0.0)
+
+
+def test_lambdarank():
+    x, t = _query()
+
+    # Pairs are weighted by the change in nDCG of swapping them
+    def weight(i, j):
+        swapped = x.copy()
+        swapped[[i, j]] = swapped[[j, i]]
+        return abs(ndcg(x[:, 0], t[:, 0]).data -
+                   ndcg(swapped[:, 0], t[:, 0]).data)
+    expected = _pairs(x, t, weight)
+    assert_almost_equal(lambdarank(x, t).data, expected)
+    assert_almost_equal(lambdarank(x, t, tile_size=3).data, expected)
+
+    # A known ideal DCG gives the same loss
+    idcg = np.sum((2 ** np.sort(t[:, 0])[::-1] - 1) /
+                  np.log2(np.arange(7) + 2))
+    assert_almost_equal(lambdarank(x, t, idcg=idcg).data, expected)
+
+
+def test_padded():
+    x, t = _query()
+    xs = [x[:3], x[3:]]
+    ts = [t[:3], t[3:]]
+    padded_x = np.zeros((2, 4))
+    padded_t = np.zeros((2, 4))
+    mask = np.zeros((2, 4), dtype=bool)
+    for i, (xi, ti) in enumerate(zip(xs, ts)):
+        padded_x[i, :len(xi)] = xi[:, 0]
+        padded_t[i, :len(ti)] = ti[:, 0]
+        mask[i, :len(xi)] = True
+
+    # Queries are independent and padding gets no gradient
+    padded_x = Variable(padded_x)
+    for loss, padded_loss in ((ranknet, padded_ranknet),
+                              (lambdarank, padded_lambdarank)):
+        result = padded_loss(padded_x, padded_t, mask, tile_size=2,
+                             reduce='no')
+        for i, (xi, ti) in enumerate(zip(xs, ts)):
+            assert_almost_equal(result.data[i], loss(xi, ti).data)
+        padded_x.cleargrad()
+        padded_loss(padded_x, padded_t, mask).backward()
+        assert_true(np.all(padded_x.grad[~mask] == 0.0))
+
+
+def test_compact_labels():
+    x = np.array([[0.1, 0.3, 0.2]]).T
+    t = np.array([[9, 0, 3]], dtype=np.uint8).T
+
+    # Integer labels give the same gains as float labels
+    for loss in (ranknet, lambdarank):
+        assert_almost_equal(loss(x, t).data,
+                            loss(x, t.astype(np.float64)).data)
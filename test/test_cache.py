@@ -0,0 +1,61 @@
+import os
+import tempfile
+
+import numpy as np
+from nose.tools import assert_equal, assert_not_equal, assert_true
+
+from shoelace.cache import ParseCache
+from shoelace.dataset import LtrDataset
+from test.utils import dataset_txt
+
+
+def _write_dataset(directory, name='dataset.txt'):
+    path = os.path.join(directory, name)
+    with open(path, 'w') as handle:
+        handle.write(dataset_txt)
+    return path
+
+
+def test_key():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(os.path.join(directory, 'cache'))
+        first = _write_dataset(directory, 'first.txt')
+        second = _write_dataset(directory, 'second.txt')
+
+        # Keys depend on file contents and options, not on the path
+        assert_equal(cache.key(first, normalize=False),
+                     cache.key(second, normalize=False))
+        assert_not_equal(cache.key(first, normalize=False),
+                         cache.key(first, normalize=True))
+
+
+def test_load_txt_cached():
+    with tempfile.TemporaryDirectory() as directory:
+        path = _write_dataset(directory)
+        cache = os.path.join(directory, 'cache')
+
+        # The first load parses the file and fills the cache
+        dataset = LtrDataset.load_txt(path, normalize=True, cache=cache)
+        assert_equal(len(ParseCache(cache).entries()), 1)
+
+        # The second load is served from the memory-mapped cache entry
+        dataset2 = LtrDataset.load_txt(path, normalize=True, cache=cache)
+        assert_true(isinstance(dataset2.feature_vectors, np.memmap))
+        assert_true(np.array_equal(dataset.feature_vectors,
+                                   dataset2.feature_vectors))
+        assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
+        del dataset2
+
+
+def test_evict():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ParseCache(os.path.join(directory, 'cache'), max_size=1)
+        for i in range(3):
+            cache.store(str(i), lambda handle: handle.write(b'0' * 10))
+            os.utime(cache.path(str(i)), (i, i))
+
+        # Only the most recently used entry should be kept
+        cache.evict()
+        assert_equal(cache.entries(), [cache.path('2')])
+        assert_equal(cache.lookup('0'), None)
+        assert_equal(cache.lookup('2'), cache.path('2'))
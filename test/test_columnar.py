@@ -0,0 +1,74 @@
+import os
+import tempfile
+from io import BytesIO
+
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace import columnar
+
+
+def _arrays():
+    return {
+        'matrix': np.arange(12, dtype=np.float32).reshape(4, 3),
+        'vector': np.array([1, 5, 9], dtype=np.int64),
+        'empty': np.zeros((0, 3), dtype=np.float64),
+        'strings': np.array([b'a', b'bcd'])
+    }
+
+
+def test_save_and_load_in_memory():
+
+    # Save and load arrays through an in-memory handle
+    with BytesIO() as handle:
+        columnar.save_arrays(handle, _arrays(), {'answer': 42})
+        handle.seek(0)
+        arrays, attributes = columnar.load_arrays(handle)
+
+    # Assert that everything loaded correctly
+    assert_equal(attributes, {'answer': 42})
+    for name, array in _arrays().items():
+        assert_equal(arrays[name].dtype, array.dtype)
+        assert_true(np.array_equal(arrays[name], array))
+
+
+def test_save_and_load_memory_mapped():
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'arrays.bin')
+        with open(path, 'wb') as handle:
+            columnar.save_arrays(handle, _arrays())
+
+        # Arrays should be memory-mapped at aligned offsets
+        with open(path, 'rb') as handle:
+            arrays, _ = columnar.load_arrays(handle)
+            assert_true(isinstance(arrays['matrix'], np.memmap))
+            assert_equal(arrays['matrix'].offset % columnar.ALIGNMENT, 0)
+            assert_true(np.array_equal(arrays['matrix'],
+                                       _arrays()['matrix']))
+            del arrays
+
+
+def test_consecutive_records():
+
+    # Several records can be written to the same file one after the other
+    with BytesIO() as handle:
+        columnar.save_arrays(handle, {'a': np.arange(3)})
+        columnar.save_arrays(handle, {'b': np.arange(5)})
+        handle.seek(0)
+        first, _ = columnar.load_arrays(handle)
+        second, _ = columnar.load_arrays(handle)
+
+    assert_true(np.array_equal(first['a'], np.arange(3)))
+    assert_true(np.array_equal(second['b'], np.arange(5)))
+
+
+@raises(ValueError)
+def test_unsupported_version():
+
+    # A file from a future version of the format should not be loaded
+    with BytesIO() as handle:
+        columnar.save_arrays(handle, {'a': np.arange(3)})
+        contents = bytearray(handle.getvalue())
+    contents[len(columnar.MAGIC)] = columnar.VERSION + 1
+    columnar.load_arrays(BytesIO(bytes(contents)))
@@ -1,3 +1,8 @@
+import gzip
+import lzma
+import os
+import pickle
+import tempfile
 from io import StringIO, BytesIO
 
 import numpy as np
@@ -5,7 +10,7 @@ from nose.tools import raises, assert_equal, assert_in, assert_not_equal, \
     assert_true
 
 from shoelace.dataset import LtrDataset
-from test.utils import get_dataset
+from test.utils import get_dataset, dataset_txt
 
 
 def test_save_txt_and_load_txt():
@@ -33,6 +38,129 @@ def test_save_txt_and_load_txt():
         assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
 
 
+def test_save_txt_options():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Write sparse output with docid comments
+    comments = ['docid = {}'.format(i) for i in range(25)]
+    with StringIO() as handle:
+        dataset.save_txt(handle, comments=comments, skip_zeros=True)
+        contents = handle.getvalue()
+        handle.seek(0)
+        dataset2 = LtrDataset.load_txt(handle)
+
+    lines = contents.splitlines()
+    assert_equal(len(lines), 25)
+    assert_true(lines[0].startswith('0 qid:1 1:1 2:1 3:0.833333015 '))
+    assert_true(lines[0].endswith(' #docid = 0'))
+    assert_true(' 5:' not in lines[0])
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors))
+
+
+def test_save_txt_float_labels():
+
+    # Labels that need more than 6 significant digits should round-trip
+    labels = np.array([[0.123456789], [2.0], [1e-7]])
+    dataset = LtrDataset(np.ones((3, 1), dtype=np.float32), labels,
+                         np.array([0, 2, 3]), ['1', '2'], 2)
+    with StringIO() as handle:
+        dataset.save_txt(handle)
+        contents = handle.getvalue()
+        handle.seek(0)
+        dataset2 = LtrDataset.load_txt(handle)
+
+    assert_true(contents.startswith('0.123456789 qid:1 '))
+    assert_true(np.array_equal(dataset2.relevance_scores, labels))
+
+
+def test_save_txt_trailing_zero_features():
+
+    # Data set whose last features are zero for every document
+    features = np.zeros((3, 4), dtype=np.float32)
+    features[:, 0] = [1.0, 0.5, 0.0]
+    dataset = LtrDataset(features, np.array([[2.0], [1.0], [0.0]]),
+                         np.array([0, 2, 3]), ['1', '2'], 2)
+
+    for sparse in [False, True]:
+        with StringIO() as handle:
+            dataset.save_txt(handle, skip_zeros=True)
+            contents = handle.getvalue()
+            handle.seek(0)
+            dataset2 = LtrDataset.load_txt(handle, sparse=sparse)
+
+        # The highest feature index is written once, as an explicit zero
+        assert_equal(contents.count(' 4:'), 1)
+        assert_equal(dataset2.feature_vectors.shape, (3, 4))
+        dataset3 = LtrDataset.load_txt(StringIO(contents), sparse=True)
+        with StringIO() as handle:
+            dataset3.save_txt(handle)
+            assert_equal(handle.getvalue(), contents)
+
+
+def test_save_txt_compressed():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt.gz')
+        dataset.save_txt(path)
+
+        # The file should be gzip compressed
+        with gzip.open(path, 'rb') as handle:
+            dataset2 = LtrDataset.load_txt(handle)
+
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors))
+    assert_true(np.array_equal(dataset.relevance_scores,
+                               dataset2.relevance_scores))
+
+
+def test_load_txt_compressed_path():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt.xz')
+        with lzma.open(path, 'wt') as handle:
+            handle.write(dataset_txt)
+
+        # Compressed files are decompressed as a stream, even in parallel mode
+        dataset2 = LtrDataset.load_txt(path, n_jobs=2)
+
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors))
+    assert_true(np.array_equal(dataset.query_pointer, dataset2.query_pointer))
+
+
+def test_load_txt_parallel():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Write the sample data to a file on disk
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt')
+        with open(path, 'w') as handle:
+            handle.write(dataset_txt)
+
+        # Load with several processes, so queries span chunk boundaries
+        with open(path, 'r') as handle:
+            dataset2 = LtrDataset.load_txt(handle, n_jobs=4)
+
+    # Assert that everything loaded correctly
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors))
+    assert_true(np.array_equal(dataset.relevance_scores,
+                               dataset2.relevance_scores))
+    assert_true(np.array_equal(dataset.query_pointer, dataset2.query_pointer))
+    assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
+
+
 def test_save_and_load():
 
     # Get sample data set
@@ -58,6 +186,107 @@ def test_save_and_load():
         assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
 
 
+def test_save_and_load_memory_mapped():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.bin')
+        with open(path, 'wb') as handle:
+            dataset.save(handle)
+
+        # Load from disk, which should memory-map the arrays
+        with open(path, 'rb') as handle:
+            dataset2 = LtrDataset.load(handle)
+
+        assert_true(isinstance(dataset2.feature_vectors, np.memmap))
+        assert_true(np.array_equal(dataset.feature_vectors,
+                                   dataset2.feature_vectors))
+        assert_true(np.array_equal(dataset.relevance_scores,
+                                   dataset2.relevance_scores))
+        assert_true(np.array_equal(dataset.query_pointer,
+                                   dataset2.query_pointer))
+        assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
+        del dataset2
+
+
+def test_load_pickle():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Data sets saved with pickle by older versions can still be loaded
+    with BytesIO() as handle:
+        pickle.dump(dataset, handle)
+        handle.seek(0)
+        dataset2 = LtrDataset.load(handle)
+
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors))
+    assert_true(np.array_equal(dataset.query_ids, dataset2.query_ids))
+
+
+def test_load_txt_sparse():
+
+    # Sparse and dense loading should give the same feature vectors
+    dataset = get_dataset()
+    dataset2 = get_dataset(sparse=True)
+    assert_equal(dataset2.feature_vectors.shape, (25, 45))
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               dataset2.feature_vectors.toarray()))
+    assert_true(np.array_equal(dataset[1].feature_vectors,
+                               dataset2[1].feature_vectors))
+
+
+def test_load_txt_missing_features():
+
+    # A line that omits its lowest features should not shift the others
+    with StringIO("1 qid:1 1:0.5 2:0.25 3:1\n0 qid:1 3:2\n") as handle:
+        dataset = LtrDataset.load_txt(handle)
+    assert_true(np.array_equal(dataset.feature_vectors,
+                               [[0.5, 0.25, 1.0], [0.0, 0.0, 2.0]]))
+
+
+def test_normalize_sparse():
+
+    # Sparse normalization should match dense normalization
+    dataset = get_dataset(normalize=True)
+    dataset2 = get_dataset(normalize=True, sparse=True)
+    assert_true(np.allclose(dataset.feature_vectors,
+                            dataset2.feature_vectors.toarray()))
+
+
+def test_save_txt_and_load_txt_sparse():
+
+    # Get sample data set
+    dataset = get_dataset(sparse=True)
+
+    # Zero-valued features are not written, but should load back as zeros
+    with StringIO() as handle:
+        dataset.save_txt(handle)
+        handle.seek(0)
+        dataset2 = LtrDataset.load_txt(handle)
+
+    assert_true(np.array_equal(dataset.feature_vectors.toarray(),
+                               dataset2.feature_vectors))
+
+
+def test_save_and_load_sparse():
+
+    # Get sample data set
+    dataset = get_dataset(sparse=True)
+
+    with BytesIO() as handle:
+        dataset.save(handle)
+        handle.seek(0)
+        dataset2 = LtrDataset.load(handle)
+
+    assert_true(np.array_equal(dataset.feature_vectors.toarray(),
+                               dataset2.feature_vectors.toarray()))
+    assert_true(np.array_equal(dataset.query_pointer, dataset2.query_pointer))
+
+
 def test_get_sample():
 
     # Get sample data set
@@ -144,6 +373,66 @@ def test_slicing():
     assert_equal(len(dataset_slice), 2)
 
 
+def test_get_sample_is_view():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Assert that the relevance scores of a query share the data set memory
+    query = dataset[1]
+    assert_true(np.shares_memory(query.relevance_scores,
+                                 dataset.relevance_scores))
+    assert_true(np.array_equal(query.query_pointer, [0, 9]))
+    assert_true(np.array_equal(query.feature_vectors,
+                               dataset.feature_vectors[6:15]))
+
+
+def test_subset():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Select queries and a subset of the subset
+    subset = dataset.subset([2, 0])
+    assert_equal(len(subset), 2)
+    assert_true(np.array_equal(subset.query_ids, ['63', '1']))
+    assert_equal(subset[0].feature_vectors.shape, (10, 45))
+    assert_equal(subset.subset([1]).query_ids, ['1'])
+    assert_true(subset.subset([1]).dataset is dataset)
+
+
+@raises(IndexError)
+def test_subset_out_of_range():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Raise an exception by selecting a query out of range
+    dataset.subset([3])
+
+
+def test_folds():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Assert that every query is in exactly one test fold
+    folds = dataset.folds(3, seed=42)
+    assert_equal(len(folds), 3)
+    test_ids = []
+    for train, test in folds:
+        assert_equal(len(train) + len(test), 3)
+        assert_equal(set(train.query_ids) & set(test.query_ids), set())
+        test_ids.extend(test.query_ids)
+    assert_equal(sorted(test_ids), ['1', '16', '63'])
+
+    # Assert that folds are reproducible and unshuffled folds are in order
+    assert_equal([test.query_ids for _, test in dataset.folds(3, seed=42)],
+                 [test.query_ids for _, test in folds])
+    assert_equal([test.query_ids for _, test in dataset.folds(3, False)],
+                 [['1'], ['16'], ['63']])
+
+
 def test_len():
 
     # Get sample data set
@@ -184,3 +473,30 @@ def test_normalize_false():
         per_feature_min = np.min(dataset[i].feature_vectors, axis=0)
         print(per_feature_min)
         assert_not_equal(np.max(per_feature_min), 0.0)
+
+
+def test_load_txt_compact_types():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Assert that labels, pointers and query identifiers are stored compactly
+    assert_equal(dataset.relevance_scores.dtype, np.uint8)
+    assert_equal(dataset.query_pointer.dtype, np.int32)
+    assert_true(isinstance(dataset.query_ids, np.ndarray))
+
+
+def test_load_txt_reduced_precision():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    for dtype in (np.float16, 'bfloat16'):
+        with StringIO(dataset_txt) as handle:
+            reduced = LtrDataset.load_txt(handle, dtype=dtype)
+
+        # Features are stored in 16 bits and upcast per query
+        assert_equal(reduced.feature_vectors.dtype.itemsize, 2)
+        assert_equal(reduced[0].feature_vectors.dtype, np.float32)
+        assert_true(np.allclose(reduced[0].feature_vectors,
+                                dataset[0].feature_vectors, rtol=1e-2))
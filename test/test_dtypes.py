@@ -0,0 +1,65 @@
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace import dtypes
+from shoelace.sparse import CsrFeatures
+
+
+def test_bfloat16_round_trip():
+
+    # Values that are exactly representable in bfloat16
+    values = np.array([0.0, 1.0, -2.5, 0.15625, np.inf],
+                      dtype=np.float32)
+    assert_true(np.array_equal(
+        dtypes.from_bfloat16(dtypes.to_bfloat16(values[:5])), values[:5]))
+    assert_true(np.isnan(dtypes.from_bfloat16(
+        dtypes.to_bfloat16(np.array([np.nan], dtype=np.float32))))[0])
+
+
+def test_bfloat16_rounding():
+
+    # Rounds to nearest, with ties to even
+    values = np.array([1.0 + 2 ** -8, 1.0 + 3 * 2 ** -8, 1.0 + 2 ** -7 + 1e-6],
+                      dtype=np.float32)
+    assert_true(np.array_equal(
+        dtypes.from_bfloat16(dtypes.to_bfloat16(values)),
+        [1.0, 1.0 + 2 ** -6, 1.0 + 2 ** -7]))
+
+
+def test_upcast():
+
+    # Reduced precision features are upcast, others are left untouched
+    features = np.array([[0.5, 0.25]], dtype=np.float32)
+    assert_true(dtypes.upcast(features) is features)
+    for dtype in (np.float16, 'bfloat16'):
+        reduced = dtypes.astype(features, dtype)
+        assert_equal(reduced.dtype.itemsize, 2)
+        assert_equal(dtypes.upcast(reduced).dtype, np.float32)
+        assert_true(np.array_equal(dtypes.upcast(reduced), features))
+
+    # Sparse features are converted per stored value
+    csr = CsrFeatures(np.array([0.5, 0.25], dtype=np.float32),
+                      np.array([0, 1], dtype=np.int32), np.array([0, 2]),
+                      (1, 2))
+    reduced = dtypes.astype(csr, 'bfloat16')
+    assert_equal(reduced.dtype, dtypes.BFLOAT16)
+    assert_true(np.array_equal(dtypes.upcast(reduced).toarray(), features))
+
+
+@raises(ValueError)
+def test_unknown_feature_dtype():
+    dtypes.feature_dtype('float8')
+
+
+def test_label_dtype():
+    assert_equal(dtypes.label_dtype(np.array([0.0, 4.0])), np.uint8)
+    assert_equal(dtypes.label_dtype(np.array([-1.0, 1.0])), np.int8)
+    assert_equal(dtypes.label_dtype(np.array([0.0, 1000.0])), np.int16)
+    assert_equal(dtypes.label_dtype(np.array([0.0, 100000.0])), np.float32)
+    assert_equal(dtypes.label_dtype(np.array([0.5, 1.0])), np.float32)
+    assert_equal(dtypes.label_dtype(np.array([0.1, 1.0])), np.float64)
+
+
+def test_index_dtype():
+    assert_equal(dtypes.index_dtype(2 ** 31 - 1), np.int32)
+    assert_equal(dtypes.index_dtype(2 ** 31), np.int64)
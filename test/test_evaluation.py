@@ -1,7 +1,9 @@
 import numpy as np
-from nose.tools import raises, assert_equal
+from nose.tools import raises, assert_equal, assert_true, assert_almost_equal
 
-from shoelace.evaluation import ndcg
+from shoelace.dataset import LtrDataset
+from shoelace.evaluation import ndcg, evaluate_ndcg, evaluate
+from test.utils import get_dataset
 
 
 def test_ndcg():
@@ -103,3 +105,129 @@ def test_unequal_ndcg():
 
     # This should raise a ValueError because the lists aren't of equal length
     ndcg(prediction, ground_truth)
+
+
+def test_evaluate_ndcg():
+
+    # Set up data
+    dataset = get_dataset()
+    scores = np.random.RandomState(0).randn(dataset.relevance_scores.shape[0])
+    scores[3] = scores[4]
+
+    # Every query agrees with the per-query nDCG at every cutoff
+    per_query, means = evaluate_ndcg(dataset, scores)
+    assert_equal(sorted(per_query), [0, 1, 3, 5, 10])
+    pointer = dataset.query_pointer
+    for k, values in per_query.items():
+        expected = [ndcg(scores[start:end],
+                         dataset.relevance_scores[start:end, 0].astype(
+                             np.float64), k=k).data
+                    for start, end in zip(pointer[:-1], pointer[1:])]
+        assert_true(np.allclose(values, expected))
+        assert_almost_equal(means[k], np.mean(expected))
+
+    # Subsets only report their own queries
+    per_query_subset, _ = evaluate_ndcg(dataset.subset([2, 0]), scores)
+    assert_true(np.array_equal(per_query_subset[3], per_query[3][[2, 0]]))
+
+    # Subsets also accept the scores of their own documents only
+    subset_scores = np.concatenate([scores[pointer[2]:pointer[3]],
+                                    scores[pointer[0]:pointer[1]]])
+    per_query_local, _ = evaluate_ndcg(dataset.subset([2, 0]), subset_scores)
+    for k, values in per_query_local.items():
+        assert_true(np.array_equal(values, per_query_subset[k]))
+
+
+@raises(ValueError)
+def test_evaluate_ndcg_unaligned():
+    evaluate_ndcg(get_dataset(), np.zeros(3))
+
+
+@raises(ValueError)
+def test_evaluate_ndcg_subset_unaligned():
+    evaluate_ndcg(get_dataset().subset([1]), np.zeros(3))
+
+
+def test_evaluate_folds():
+
+    # Set up data
+    dataset = get_dataset()
+    scores = np.random.RandomState(2).randn(dataset.relevance_scores.shape[0])
+    per_query, _ = evaluate(dataset, scores)
+
+    # Test folds agree with the full data set, using scores of the fold only
+    for _, test in dataset.folds(3, seed=1):
+        test_scores = np.concatenate([
+            scores[dataset.query_pointer[i]:dataset.query_pointer[i + 1]]
+            for i in test.query_index])
+        per_query_fold, _ = evaluate(test, test_scores)
+        for name, values in per_query_fold.items():
+            assert_true(np.allclose(values,
+                                    per_query[name][test.query_index]))
+
+
+def test_evaluate():
+
+    # Two queries ranked as [2, 0, 1] and [0, 0]
+    labels = np.array([[0.0], [2.0], [1.0], [0.0], [0.0]])
+    dataset = LtrDataset(np.zeros((5, 1)), labels, np.array([0, 3, 5]),
+                         np.array(['1', '2']), 2)
+    scores = np.array([2.0, 1.0, 3.0, 0.5, 0.2])
+
+    # Compute and assert the metrics of both queries
+    per_query, means = evaluate(dataset, scores, cutoffs=(1, 0))
+    assert_true(np.allclose(per_query['map'], [(1.0 + 2.0 / 3.0) / 2, 0.0]))
+    assert_true(np.allclose(per_query['mrr'], [1.0, 0.0]))
+    assert_true(np.allclose(per_query['p@1'], [1.0, 0.0]))
+    assert_true(np.allclose(per_query['p'], [2.0 / 3.0, 0.0]))
+    assert_true(np.allclose(per_query['err@1'], [0.25, 0.0]))
+    assert_true(np.allclose(per_query['err'],
+                            [0.25 + 0.75 * 0.75 / 3.0, 0.0]))
+    assert_true(np.allclose(per_query['ndcg'], [
+        ndcg(scores[:3], labels[:3, 0]).data, 1.0]))
+    assert_almost_equal(means['mrr'], 0.5)
+
+
+@raises(ValueError)
+def test_evaluate_unknown_metric():
+    evaluate(get_dataset(), np.zeros(25), metrics=('auc',))
+
+
+def test_ndcg_at_k_ties():
+
+    # Set up data with many tied predictions and labels
+    random = np.random.RandomState(11)
+    prediction = random.randint(0, 4, 200).astype(np.float64)
+    ground_truth = random.randint(0, 5, 200).astype(np.float64)
+
+    # The partial sort agrees with a full sort that ranks ties in reverse
+    # document order
+    order = np.flip(np.argsort(prediction, kind='stable'), axis=0)
+    ideal = np.sort(ground_truth)[::-1]
+    for k in (1, 3, 10, 199):
+        discounts = np.log2(np.arange(k) + 2)
+        expected = np.sum((2 ** ground_truth[order][:k] - 1) / discounts) / \
+            np.sum((2 ** ideal[:k] - 1) / discounts)
+        assert_almost_equal(ndcg(prediction, ground_truth, k=k).data,
+                            expected)
+
+
+def test_ndcg_compact_labels():
+
+    # Labels of a loaded data set are stored as uint8
+    query = get_dataset()[0]
+    labels = query.relevance_scores[:, 0]
+    assert_equal(labels.dtype, np.uint8)
+    prediction = np.random.RandomState(3).randn(labels.shape[0])
+
+    # Compute and assert nDCG values agree with float labels
+    for k in (0, 1, 3, 5):
+        assert_almost_equal(ndcg(prediction, labels, k=k).data,
+                            ndcg(prediction, labels.astype(np.float64),
+                                 k=k).data)
+
+    # Large integer labels do not overflow
+    assert_almost_equal(ndcg(np.array([0.1, 0.3, 0.2]),
+                             np.array([9, 0, 3], dtype=np.uint8)).data,
+                        ndcg(np.array([0.1, 0.3, 0.2]),
+                             np.array([9.0, 0.0, 3.0])).data)
@@ -1,9 +1,10 @@
 import numpy as np
 from chainer.dataset.iterator import Iterator
-from chainer.serializers import DictionarySerializer
+from chainer.serializers import DictionarySerializer, NpzDeserializer
 from nose.tools import raises, assert_equal, assert_true, assert_not_equal
 
 from shoelace.iterator import LtrIterator
+from shoelace.sampler import BucketSampler
 from test.utils import get_dataset
 
 
@@ -134,3 +135,194 @@ def test_serialize():
     # After serializing it should be equal again
     it.serialize(serializer)
     assert_equal(serializer.target['epoch'], it.epoch)
+
+
+def test_iterations_sparse():
+
+    # Sample datasets
+    dataset = get_dataset()
+    sparse_dataset = get_dataset(sparse=True)
+
+    # Sparse feature vectors should be densified per batch
+    it = LtrIterator(dataset, repeat=False, shuffle=False)
+    sparse_it = LtrIterator(sparse_dataset, repeat=False, shuffle=False)
+    for batch, sparse_batch in zip(it, sparse_it):
+        assert_equal(len(batch), len(sparse_batch))
+        for (x, t), (sparse_x, sparse_t) in zip(batch, sparse_batch):
+            assert_true(np.array_equal(x, sparse_x))
+            assert_equal(t, sparse_t)
+
+
+def test_iterations_subset():
+
+    # Sample dataset
+    dataset = get_dataset().subset([2, 0])
+
+    # Assert that only the selected queries are visited, in order
+    it = LtrIterator(dataset, repeat=False, shuffle=False)
+    items = list(it)
+    assert_equal(len(items), 2)
+    assert_equal(len(items[0]), 10)
+    assert_equal(len(items[1]), 6)
+
+
+def test_padded_batches():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Pack two queries per minibatch, the last one of an epoch is smaller
+    it = LtrIterator(dataset, repeat=True, shuffle=False, queries_per_batch=2)
+    features, labels, mask = it.next()
+    assert_equal(features.shape, (2, 9, 45))
+    assert_equal(labels.shape, (2, 9))
+    assert_true(np.array_equal(mask.sum(axis=1), [6, 9]))
+    assert_equal(it.batch_size, 15)
+    assert_true(not it.is_new_epoch)
+
+    # Valid documents match the data set, padding is zero
+    assert_true(np.array_equal(features[0, :6], dataset[0].feature_vectors))
+    assert_true(np.array_equal(labels[1], dataset[1].relevance_scores[:, 0]))
+    assert_true(np.all(features[0, 6:] == 0.0))
+    assert_true(np.all(labels[0, 6:] == 0.0))
+
+    features, labels, mask = it.next()
+    assert_equal(features.shape, (1, 10, 45))
+    assert_true(it.is_new_epoch)
+    assert_equal(it.epoch, 1)
+
+
+def test_padded_batches_sparse():
+
+    # Sample dataset
+    dataset = get_dataset()
+    sparse_dataset = get_dataset(sparse=True)
+
+    # Padded minibatches of sparse data sets are dense
+    it = LtrIterator(dataset, shuffle=False, queries_per_batch=3)
+    sparse_it = LtrIterator(sparse_dataset, shuffle=False, queries_per_batch=3)
+    for array, sparse_array in zip(it.next(), sparse_it.next()):
+        assert_true(np.array_equal(array, sparse_array))
+
+
+def _lengths(it, steps):
+    return [len(it.next()) for _ in range(steps)]
+
+
+def test_serialize_resume():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Without a seed, later epochs depend on the global random state, so only
+    # the rest of the current epoch is compared
+    for seed, steps in ((None, 2), (3, 8)):
+
+        # Save the state in the middle of the second epoch
+        np.random.seed(11)
+        it = LtrIterator(dataset, repeat=True, shuffle=True, seed=seed)
+        _lengths(it, 4)
+        serializer = DictionarySerializer()
+        it.serialize(serializer)
+        target = {key: np.asarray(value)
+                  for key, value in serializer.target.items()}
+        expected = _lengths(it, steps)
+        expected_detail = it.epoch_detail
+
+        # A fresh iterator resumes with exactly the same order
+        np.random.seed(11)
+        resumed = LtrIterator(dataset, repeat=True, shuffle=True, seed=seed)
+        resumed.serialize(NpzDeserializer(target))
+        assert_equal(resumed.epoch, 1)
+        assert_equal(resumed.previous_epoch_detail, 1.0)
+        assert_equal(_lengths(resumed, steps), expected)
+        assert_equal(resumed.epoch_detail, expected_detail)
+
+
+def test_seeded_orders():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Seeded orders only depend on the seed and the epoch
+    it = LtrIterator(dataset, repeat=True, shuffle=True, seed=5)
+    orders = [sorted(_lengths(it, 3)) for _ in range(4)]
+    assert_equal(orders, [[6, 9, 10]] * 4)
+    first = LtrIterator(dataset, repeat=True, shuffle=True, seed=5)
+    second = LtrIterator(dataset, repeat=True, shuffle=True, seed=5)
+    assert_equal(_lengths(first, 30), _lengths(second, 30))
+
+
+def test_sharded_ranks():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Ranks see disjoint shards of every epoch and take equally many steps
+    iterators = [LtrIterator(dataset, repeat=True, shuffle=True, seed=7,
+                             rank=rank, world_size=2) for rank in range(2)]
+    for epoch in range(3):
+        lengths = [_lengths(it, 2) for it in iterators]
+        assert_true(all(it.epoch == epoch + 1 for it in iterators))
+        assert_equal(sorted(set(lengths[0]) | set(lengths[1])), [6, 9, 10])
+
+    # The longest query is balanced against the two shorter ones
+    it = LtrIterator(dataset, repeat=False, shuffle=False, rank=1,
+                     world_size=2)
+    assert_equal(sorted(len(batch) for batch in it), [6, 9])
+
+
+@raises(ValueError)
+def test_sharded_shuffle_requires_seed():
+    LtrIterator(get_dataset(), shuffle=True, rank=0, world_size=2)
+
+
+def test_max_documents():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Longer queries are capped, relevant documents first
+    it = LtrIterator(dataset, repeat=False, shuffle=False, max_documents=7,
+                     seed=2)
+    batches = list(it)
+    assert_equal([len(batch) for batch in batches], [6, 7, 7])
+    relevant = [np.sum(dataset.relevance_scores[s:e] > 0)
+                for s, e in zip(dataset.query_pointer[:-1],
+                                dataset.query_pointer[1:])]
+    for batch, count in zip(batches, relevant):
+        labels = np.array([label for _, label in batch])
+        assert_equal(np.sum(labels > 0), min(count, 7))
+
+    # Padded minibatches are capped as well and reproducible with a seed
+    it = LtrIterator(dataset, repeat=False, shuffle=False, max_documents=7,
+                     queries_per_batch=3, seed=2)
+    features, labels, mask = next(it)
+    assert_equal(features.shape[1], 7)
+    assert_equal(it.batch_size, 20)
+    again = next(LtrIterator(dataset, repeat=False, shuffle=False,
+                             max_documents=7, queries_per_batch=3, seed=2))
+    assert_true(np.array_equal(features, again[0]))
+
+
+def test_serialize_resume_sampler():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Without a seed, the plan and the random state of the sampler are saved
+    it = LtrIterator(dataset, repeat=True, sampler=BucketSampler(12, 2))
+    for _ in range(5):
+        it.next()
+    serializer = DictionarySerializer()
+    it.serialize(serializer)
+    target = {key: np.asarray(value)
+              for key, value in serializer.target.items()}
+    expected = [it.next()[1] for _ in range(12)]
+
+    # A fresh iterator with an unrelated sampler continues identically
+    resumed = LtrIterator(dataset, repeat=True, sampler=BucketSampler(12, 2))
+    resumed.serialize(NpzDeserializer(target))
+    for labels, expected_labels in zip([resumed.next()[1] for _ in range(12)],
+                                       expected):
+        assert_true(np.array_equal(labels, expected_labels))
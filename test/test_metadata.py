@@ -0,0 +1,86 @@
+import numpy as np
+from nose.tools import assert_equal, assert_true, assert_almost_equal
+
+from shoelace.evaluation import ndcg
+from shoelace.loss.listwise import listmle
+from shoelace.metadata import QueryMetadata
+from test.utils import get_dataset
+
+
+def test_metadata():
+
+    # Labels of three queries, the second one empty
+    labels = np.array([[0.0], [2.0], [1.0], [2.0], [1.0], [0.0]])
+    query_pointer = np.array([0, 3, 3, 6])
+    metadata = QueryMetadata(labels, query_pointer)
+
+    assert_true(np.array_equal(metadata.lengths, [3, 0, 3]))
+    assert_true(np.array_equal(metadata.max_label, [2.0, 0.0, 2.0]))
+    assert_true(np.array_equal(metadata.levels, [0.0, 1.0, 2.0]))
+    histogram = metadata.label_histogram
+    assert_true(np.array_equal(histogram.pointer, [0, 3, 3, 6]))
+    assert_true(np.array_equal(histogram.levels, [2, 1, 0, 2, 1, 0]))
+    assert_true(np.array_equal(histogram.counts, [1, 1, 1, 1, 1, 1]))
+    assert_true(np.array_equal(metadata.label_order, [1, 2, 0, 3, 4, 5]))
+    assert_true(np.array_equal(metadata.query_order(2), [0, 1, 2]))
+
+
+def test_label_histogram_real_valued():
+
+    # Real-valued labels only store the levels that occur in every query
+    rng = np.random.RandomState(42)
+    labels = rng.rand(2000, 1).astype(np.float32)
+    query_pointer = np.arange(0, 2001, 20)
+    metadata = QueryMetadata(labels, query_pointer)
+    histogram = metadata.label_histogram
+
+    assert_equal(histogram.counts.sum(), 2000)
+    assert_equal(histogram.levels.shape[0], 2000)
+    for i in (0, 17, 99):
+        start, end = histogram.pointer[i], histogram.pointer[i + 1]
+        levels, counts = np.unique(labels[query_pointer[i]:
+                                          query_pointer[i + 1]],
+                                   return_counts=True)
+        assert_true(np.array_equal(histogram.levels[start:end], levels[::-1]))
+        assert_true(np.array_equal(histogram.counts[start:end], counts[::-1]))
+
+
+def test_ideal_dcg():
+
+    # Labels of two queries
+    labels = np.array([[0.0], [2.0], [1.0], [1.0]])
+    query_pointer = np.array([0, 3, 4])
+    metadata = QueryMetadata(labels, query_pointer, cutoffs=(1,))
+
+    assert_true(np.allclose(metadata.ideal_dcg(1), [3.0, 1.0]))
+    assert_true(np.allclose(metadata.ideal_dcg(), [3.0 + 1.0 / np.log2(3),
+                                                   1.0]))
+    assert_true(np.array_equal(metadata.ideal_dcg(0), metadata.ideal_dcg(-1)))
+
+
+def test_dataset_metadata():
+
+    # Get sample data set
+    dataset = get_dataset()
+    metadata = dataset.metadata
+
+    # Assert that the table is built once and matches per-query computations
+    assert_true(dataset.metadata is metadata)
+    assert_true(dataset.subset([1]).metadata is metadata)
+    rng = np.random.RandomState(42)
+    for i in range(len(dataset)):
+        query = dataset[i]
+        t = query.relevance_scores[:, 0]
+        y = rng.randn(t.shape[0])
+        for k in (0, 1, 3, 5, 10):
+            assert_almost_equal(ndcg(y, t, k, idcg=query.ideal_dcg(k)).data,
+                                ndcg(y, t, k).data)
+        order = query.label_order
+        assert_true(np.all(t[order][1:] <= t[order][:-1]))
+
+    # Assert that listmle accepts the precomputed order
+    x = np.array([[3., 3., 2., 0.]]).T
+    t = np.array([[0.5, 1.0, 0.3, 0.6]]).T
+    metadata = QueryMetadata(t, np.array([0, 4]))
+    assert_equal(listmle(x, t, order=metadata.query_order(0)).data,
+                 listmle(x, t).data)
@@ -0,0 +1,91 @@
+import numpy as np
+from nose.tools import raises, assert_true
+
+from shoelace import normalization
+from test.utils import get_dataset
+
+
+def _data():
+    rng = np.random.RandomState(4200)
+    features = rng.rand(40, 5).astype(np.float32) * 10.0
+    features[:, 3] = 2.0
+    query_pointer = np.array([0, 7, 7, 8, 20, 33, 40])
+    return features, query_pointer
+
+
+def _per_query(features, query_pointer, function):
+    expected = features.astype(np.float64)
+    for start, end in zip(query_pointer[:-1], query_pointer[1:]):
+        if end > start:
+            expected[start:end] = function(expected[start:end])
+    return expected
+
+
+def test_query_blocks():
+
+    # Blocks should cover every query exactly once
+    _, query_pointer = _data()
+    blocks = list(normalization.query_blocks(query_pointer, block_size=10))
+    assert_true(blocks[0][0] == 0 and blocks[-1][1] == 6)
+    for (_, end), (start, _) in zip(blocks[:-1], blocks[1:]):
+        assert_true(end == start)
+
+
+def test_minmax():
+    features, query_pointer = _data()
+
+    def minmax(block):
+        block = block - np.min(block, axis=0)
+        maximum = np.max(block, axis=0)
+        maximum[maximum == 0.0] = 1.0
+        return block / maximum
+
+    expected = _per_query(features, query_pointer, minmax)
+    normalization.minmax(features, query_pointer)
+    assert_true(np.allclose(features, expected, atol=1e-6))
+
+
+def test_zscore():
+    features, query_pointer = _data()
+
+    def zscore(block):
+        std = np.std(block, axis=0)
+        std[std == 0.0] = 1.0
+        return (block - np.mean(block, axis=0)) / std
+
+    expected = _per_query(features, query_pointer, zscore)
+    normalization.zscore(features, query_pointer)
+    assert_true(np.allclose(features, expected, atol=1e-5))
+
+
+def test_standardize():
+    features, query_pointer = _data()
+
+    std = np.std(features.astype(np.float64), axis=0)
+    std[std == 0.0] = 1.0
+    expected = (features - np.mean(features.astype(np.float64), axis=0)) / std
+    normalization.standardize(features, query_pointer)
+    assert_true(np.allclose(features, expected, atol=1e-5))
+
+
+def test_dataset_normalize():
+
+    # Normalizing through the data set should keep float32 features
+    dataset = get_dataset(normalize='zscore')
+    assert_true(dataset.feature_vectors.dtype == np.float32)
+    mean = np.mean(dataset[0].feature_vectors, axis=0)
+    assert_true(np.allclose(mean, 0.0, atol=1e-5))
+
+
+@raises(ValueError)
+def test_sparse_zscore():
+
+    # Per-query standardization would make sparse features dense
+    dataset = get_dataset(sparse=True)
+    dataset.normalize('zscore')
+
+
+@raises(ValueError)
+def test_unknown_method():
+    dataset = get_dataset()
+    dataset.normalize('unknown')
@@ -0,0 +1,126 @@
+import numpy as np
+from chainer.dataset.iterator import Iterator
+from chainer.serializers import DictionarySerializer, NpzDeserializer
+from nose.tools import assert_equal, assert_true
+
+from shoelace.iterator import LtrIterator
+from shoelace.prefetch import PrefetchLtrIterator
+from shoelace.sampler import BucketSampler
+from test.utils import get_dataset
+
+
+def _states(it, steps):
+    """
+    Collects the minibatches and epoch state of a number of iterations
+    """
+    states = []
+    for _ in range(steps):
+        batch = it.next()
+        states.append((batch, it.epoch, it.epoch_detail, it.is_new_epoch,
+                       it.batch_size))
+    return states
+
+
+def _assert_same(states, expected_states):
+    for state, expected in zip(states, expected_states):
+        assert_equal(state[1:], expected[1:])
+        if isinstance(state[0], tuple):
+            for array, expected_array in zip(state[0], expected[0]):
+                assert_true(np.array_equal(array, expected_array))
+        else:
+            assert_equal(len(state[0]), len(expected[0]))
+            for (x, t), (expected_x, expected_t) in zip(state[0], expected[0]):
+                assert_true(np.array_equal(x, expected_x))
+                assert_equal(t, expected_t)
+
+
+def test_same_as_iterator():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Prefetching should not change the minibatches or the epoch state
+    np.random.seed(4)
+    expected = _states(LtrIterator(dataset, repeat=True, shuffle=True), 9)
+    np.random.seed(4)
+    it = PrefetchLtrIterator(dataset, repeat=True, shuffle=True, n_prefetch=2)
+    assert isinstance(it, Iterator)
+    _assert_same(_states(it, 9), expected)
+    it.finalize()
+
+
+def test_padded_processes():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Padded minibatches assembled by worker processes
+    expected = _states(LtrIterator(dataset, repeat=True, shuffle=False,
+                                   queries_per_batch=2), 4)
+    it = PrefetchLtrIterator(dataset, repeat=True, shuffle=False,
+                             queries_per_batch=2, n_workers=2, processes=True)
+    _assert_same(_states(it, 4), expected)
+    it.finalize()
+
+
+def test_repeat_false():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Iteration stops after one epoch
+    it = PrefetchLtrIterator(dataset, repeat=False, shuffle=False)
+    items = list(it)
+    assert_equal([len(item) for item in items], [6, 9, 10])
+    assert_equal(it.epoch, 1)
+    it.finalize()
+
+
+def test_serialize_resume():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # The saved state is that of the last returned minibatch, not the planner
+    it = PrefetchLtrIterator(dataset, repeat=True, shuffle=True, seed=2,
+                             n_prefetch=3)
+    for _ in range(4):
+        it.next()
+    serializer = DictionarySerializer()
+    it.serialize(serializer)
+    expected = [len(it.next()) for _ in range(6)]
+    it.finalize()
+
+    target = {key: np.asarray(value)
+              for key, value in serializer.target.items()}
+    resumed = PrefetchLtrIterator(dataset, repeat=True, shuffle=True, seed=2,
+                                  n_prefetch=3)
+    resumed.serialize(NpzDeserializer(target))
+    assert_equal([len(resumed.next()) for _ in range(6)], expected)
+    resumed.finalize()
+
+
+def test_serialize_resume_sampler():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Unseeded sampler plans are restored, although the planner runs ahead
+    it = PrefetchLtrIterator(dataset, repeat=True,
+                             sampler=BucketSampler(12, 2), n_prefetch=4)
+    for _ in range(5):
+        it.next()
+    serializer = DictionarySerializer()
+    it.serialize(serializer)
+    expected = [it.next()[1] for _ in range(12)]
+    it.finalize()
+
+    target = {key: np.asarray(value)
+              for key, value in serializer.target.items()}
+    resumed = PrefetchLtrIterator(dataset, repeat=True,
+                                  sampler=BucketSampler(12, 2), n_prefetch=4)
+    resumed.serialize(NpzDeserializer(target))
+    for labels, expected_labels in zip([resumed.next()[1] for _ in range(12)],
+                                       expected):
+        assert_true(np.array_equal(labels, expected_labels))
+    resumed.finalize()
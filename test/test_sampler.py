@@ -0,0 +1,71 @@
+import numpy as np
+from nose.tools import assert_equal, assert_true, assert_almost_equal
+
+from shoelace.iterator import LtrIterator
+from shoelace.sampler import BucketSampler, padding_efficiency
+from test.utils import get_dataset
+
+
+def test_plan():
+
+    # Queries of very different lengths
+    lengths = np.array([1, 100, 2, 98, 3, 1, 99, 97])
+    sampler = BucketSampler(200, nr_of_buckets=2, seed=42)
+    order, bounds = sampler.plan(lengths)
+
+    # Every query is visited exactly once, in batches within the budget
+    assert_true(np.array_equal(np.sort(order), np.arange(8)))
+    assert_equal(bounds[0], 0)
+    assert_equal(bounds[-1], 8)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        batch = lengths[order[start:end]]
+        assert_true(batch.max() * batch.shape[0] <= 200)
+
+    # Short and long queries are not mixed
+    assert_true(sampler.efficiency > 0.9)
+
+
+def test_plan_shuffles():
+
+    # Plans change from epoch to epoch, but not for the same seed
+    lengths = np.arange(1, 101)
+    sampler = BucketSampler(50, nr_of_buckets=4, seed=1)
+    first, _ = sampler.plan(lengths)
+    second, _ = sampler.plan(lengths)
+    assert_true(not np.array_equal(first, second))
+    assert_true(np.array_equal(BucketSampler(50, 4, seed=1).plan(lengths)[0],
+                               first))
+
+
+def test_plan_long_query():
+
+    # Queries longer than the budget are batched on their own
+    sampler = BucketSampler(10, nr_of_buckets=1, shuffle=False)
+    order, bounds = sampler.plan(np.array([20, 5]))
+    assert_true(np.array_equal(np.diff(bounds), [1, 1]))
+
+
+def test_padding_efficiency():
+    lengths = np.array([2, 4, 4])
+    assert_almost_equal(padding_efficiency(lengths, np.arange(3), [0, 3]),
+                        10 / 12)
+    assert_almost_equal(padding_efficiency(lengths, np.arange(3), [0, 1, 3]),
+                        1.0)
+
+
+def test_iterator_with_sampler():
+
+    # Sample dataset
+    dataset = get_dataset()
+
+    # Iterate an epoch of bucketed minibatches
+    sampler = BucketSampler(20, nr_of_buckets=3, seed=0)
+    it = LtrIterator(dataset, repeat=True, sampler=sampler)
+    documents = 0
+    while not it.is_new_epoch:
+        features, labels, mask = it.next()
+        assert_true(features.shape[0] * features.shape[1] <= 20)
+        documents += mask.sum()
+    assert_equal(documents, 25)
+    assert_equal(it.epoch, 1)
+    assert_true(0.0 < it.padding_efficiency <= 1.0)
@@ -0,0 +1,166 @@
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace.iterator import LtrIterator
+from shoelace.prefetch import PrefetchLtrIterator
+from shoelace.sharded import ShardedLtrDataset
+from test.utils import get_dataset
+
+
+def test_split():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+
+        # Assert that the global query index spans all shards
+        assert_equal(len(sharded.paths), 2)
+        assert_equal(len(sharded), 3)
+        assert_true(np.array_equal(sharded.query_pointer,
+                                   dataset.query_pointer))
+        assert_true(np.array_equal(sharded.query_ids, dataset.query_ids))
+
+        # Every query should match the original data set
+        for i in range(len(dataset)):
+            assert_true(np.array_equal(sharded[i].feature_vectors,
+                                       dataset[i].feature_vectors))
+            assert_true(np.array_equal(sharded[i].relevance_scores,
+                                       dataset[i].relevance_scores))
+            assert_equal(sharded[i].query_ids, dataset[i].query_ids)
+
+
+def test_resident_shards():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ShardedLtrDataset.split(dataset, directory, 1)
+        sharded = ShardedLtrDataset(directory, max_resident_shards=2)
+
+        # Only the most recently used shards should stay mapped
+        for i in range(len(sharded)):
+            sharded.get_example(i)
+        assert_equal(list(sharded._resident), [1, 2])
+        sharded.get_example(1)
+        assert_equal(list(sharded._resident), [2, 1])
+
+
+def test_iterator():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+
+        # Iterating the sharded data set should give the same batches
+        it = LtrIterator(dataset, repeat=False, shuffle=False)
+        sharded_it = LtrIterator(sharded, repeat=False, shuffle=False)
+        for batch, sharded_batch in zip(it, sharded_it):
+            assert_equal(len(batch), len(sharded_batch))
+            for (x, t), (sharded_x, sharded_t) in zip(batch, sharded_batch):
+                assert_true(np.array_equal(x, sharded_x))
+                assert_equal(t, sharded_t)
+
+
+@raises(IndexError)
+def test_get_example_out_of_range():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+        sharded.get_example(3)
+
+
+def test_subset():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+
+        # Subsets can select queries across shards
+        subset = sharded.subset([2, 0])
+        assert_true(np.array_equal(subset.query_ids, ['63', '1']))
+        items = list(LtrIterator(subset, repeat=False, shuffle=False))
+        assert_equal([len(item) for item in items], [10, 6])
+
+
+def test_padded_batches():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+
+        # Padded minibatches are gathered per shard
+        it = LtrIterator(dataset, shuffle=False, queries_per_batch=3)
+        sharded_it = LtrIterator(sharded, shuffle=False, queries_per_batch=3)
+        for array, sharded_array in zip(it.next(), sharded_it.next()):
+            assert_true(np.array_equal(array, sharded_array))
+
+
+def test_concurrent_shards():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        ShardedLtrDataset.split(dataset, directory, 1)
+        sharded = ShardedLtrDataset(directory, max_resident_shards=1)
+
+        # Threads that keep evicting each other's shards see the right rows
+        def check(i):
+            for _ in range(200):
+                query = sharded.get_example(i % len(sharded))
+                expected = dataset[i % len(sharded)]
+                if not np.array_equal(query.relevance_scores,
+                                      expected.relevance_scores):
+                    return False
+            return True
+        with ThreadPoolExecutor(6) as executor:
+            assert_true(all(executor.map(check, range(12))))
+        assert_true(len(sharded._resident) <= 1)
+
+        # Prefetching worker threads assemble the same minibatches
+        it = LtrIterator(dataset, repeat=False, shuffle=False,
+                         queries_per_batch=1)
+        prefetch = PrefetchLtrIterator(sharded, repeat=False, shuffle=False,
+                                       queries_per_batch=1, n_workers=4)
+        for batch, sharded_batch in zip(it, prefetch):
+            assert_true(np.array_equal(batch[0], sharded_batch[0]))
+        prefetch.finalize()
+
+
+def test_subsampling():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    with tempfile.TemporaryDirectory() as directory:
+        sharded = ShardedLtrDataset.split(dataset, directory, 2)
+
+        # Subsampled minibatches should match those of the in-memory data set
+        for method in ('random', 'stratified'):
+            for queries_per_batch in (None, 2):
+                it = LtrIterator(dataset, repeat=False, seed=42,
+                                 max_documents=3, subsample=method,
+                                 queries_per_batch=queries_per_batch)
+                sharded_it = LtrIterator(sharded, repeat=False, seed=42,
+                                         max_documents=3, subsample=method,
+                                         queries_per_batch=queries_per_batch)
+                for batch, sharded_batch in zip(it, sharded_it):
+                    if queries_per_batch is None:
+                        batch, sharded_batch = batch[0], sharded_batch[0]
+                    for array, sharded_array in zip(batch, sharded_batch):
+                        assert_true(np.array_equal(array, sharded_array))
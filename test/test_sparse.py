@@ -0,0 +1,68 @@
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace.sparse import CsrFeatures, normalize, toarray
+
+
+def _dense():
+    return np.array([[0.0, 1.0, 0.0],
+                     [2.0, 0.0, 3.0],
+                     [0.0, 0.0, 0.0],
+                     [4.0, 5.0, 6.0]])
+
+
+def _sparse(dense):
+    rows, columns = np.nonzero(dense)
+    indptr = np.zeros(dense.shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=dense.shape[0]), out=indptr[1:])
+    return CsrFeatures(dense[rows, columns], columns.astype(np.int32), indptr,
+                       dense.shape)
+
+
+def test_toarray():
+    dense = _dense()
+    features = _sparse(dense)
+    assert_equal(features.shape, (4, 3))
+    assert_equal(features.nnz, 6)
+    assert_true(np.array_equal(features.toarray(), dense))
+    assert_true(np.array_equal(toarray(features), dense))
+    assert_true(toarray(dense) is dense)
+
+
+def test_row_selection():
+    dense = _dense()
+    features = _sparse(dense)
+
+    # Contiguous slices
+    assert_true(np.array_equal(features[1:3].toarray(), dense[1:3]))
+    assert_true(np.array_equal(features[2:, :].toarray(), dense[2:]))
+
+    # Single rows are returned densely
+    assert_true(np.array_equal(features[1], dense[1]))
+    assert_true(np.array_equal(features[-1], dense[-1]))
+
+    # Arbitrary row selections
+    rows = np.array([3, 0, 3])
+    assert_true(np.array_equal(features[rows].toarray(), dense[rows]))
+    assert_true(np.array_equal(features[::2].toarray(), dense[::2]))
+
+
+def test_normalize():
+    dense = _dense()
+    features = _sparse(dense)
+    query_pointer = np.array([0, 2, 4])
+
+    # Sparse normalization should match dense min-max normalization
+    normalize(features, query_pointer)
+    for start, end in zip(query_pointer[:-1], query_pointer[1:]):
+        block = dense[start:end] - np.min(dense[start:end], axis=0)
+        maximum = np.max(block, axis=0)
+        maximum[maximum == 0.0] = 1.0
+        dense[start:end] = block / maximum
+    assert_true(np.allclose(features.toarray(), dense))
+
+
+@raises(ValueError)
+def test_normalize_negative_with_implicit_zeros():
+    features = _sparse(np.array([[-1.0, 2.0], [0.0, 1.0]]))
+    normalize(features, np.array([0, 2]))
@@ -0,0 +1,98 @@
+import gzip
+import os
+import tempfile
+from io import BytesIO
+
+import numpy as np
+from chainer.dataset.iterator import Iterator
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace.stream import read_queries, LtrStreamIterator
+from test.utils import get_dataset, dataset_txt
+
+
+def test_read_queries():
+
+    # Get sample data set
+    dataset = get_dataset()
+
+    # Read queries with blocks much smaller than a query
+    handle = BytesIO(dataset_txt.encode('utf-8'))
+    queries = list(read_queries(handle, 45, block_size=100))
+    assert_equal(len(queries), 3)
+    for i, (features, labels) in enumerate(queries):
+        assert_true(np.array_equal(features, dataset[i].feature_vectors))
+        assert_true(np.array_equal(labels, dataset[i].relevance_scores))
+        assert_equal(features.dtype, np.float32)
+        assert_equal(labels.dtype, np.float32)
+
+
+def test_read_queries_large_qids():
+
+    # Adjacent queries whose qids are equal as floats should not be merged
+    handle = BytesIO(b"1 qid:9007199254740993 1:1\n"
+                     b"0 qid:9007199254740992 1:2\n")
+    queries = list(read_queries(handle, 1))
+    assert_equal(len(queries), 2)
+
+
+@raises(ValueError)
+def test_read_queries_too_many_features():
+    handle = BytesIO(dataset_txt.encode('utf-8'))
+    list(read_queries(handle, 44))
+
+
+def test_stream_iterator():
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt.gz')
+        with gzip.open(path, 'wt') as handle:
+            handle.write(dataset_txt)
+
+        # Iterate the queries of the file in order
+        it = LtrStreamIterator(path, 45, repeat=False, block_size=1000)
+        assert isinstance(it, Iterator)
+        items = list(it)
+        assert_equal([len(item) for item in items], [6, 9, 10])
+        assert_equal(it.epoch, 1)
+        assert_true(it.is_new_epoch)
+        it.finalize()
+
+
+def test_stream_iterator_epoch_detail():
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt')
+        with open(path, 'w') as handle:
+            handle.write(dataset_txt)
+
+        # Epoch detail grows with the bytes read and wraps around per epoch
+        it = LtrStreamIterator(path, 45, repeat=True, block_size=1000)
+        details = []
+        for _ in range(6):
+            next(it)
+            details.append(it.epoch_detail)
+        assert_true(0.0 < details[0] <= details[1] < 1.0)
+        assert_equal(details[2], 1.0)
+        assert_equal(details[5], 2.0)
+        assert_equal(it.epoch, 2)
+        it.finalize()
+
+
+def test_stream_iterator_shuffle_buffer():
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'dataset.txt')
+        with open(path, 'w') as handle:
+            handle.write(dataset_txt)
+
+        # Every query is visited once per epoch, in varying order
+        orders = set()
+        it = LtrStreamIterator(path, 45, repeat=True, shuffle_buffer=3,
+                               seed=1)
+        for _ in range(10):
+            order = tuple(len(next(it)) for _ in range(3))
+            assert_equal(sorted(order), [6, 9, 10])
+            orders.add(order)
+        assert_true(len(orders) > 1)
+        it.finalize()
@@ -0,0 +1,55 @@
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace.subsample import subsample, _radical_inverse
+
+
+def test_subsample_keeps_short_queries():
+
+    # Queries within the cap are returned whole
+    labels = np.zeros(10)
+    positions, sizes = subsample([0, 4], [4, 6], labels, 6)
+    assert_true(np.array_equal(positions, np.arange(10)))
+    assert_true(np.array_equal(sizes, [4, 6]))
+
+
+def test_subsample_random():
+
+    # Relevant documents are always kept, others are sampled in order
+    labels = np.array([0, 0, 2, 0, 0, 0, 1, 0, 0, 0, 0, 0])
+    random = np.random.RandomState(3)
+    positions, sizes = subsample([0, 10], [10, 2], labels, 4, 'random',
+                                 random)
+    assert_true(np.array_equal(sizes, [4, 2]))
+    first = positions[:4]
+    assert_true(2 in first and 6 in first)
+    assert_true(np.all(np.diff(first) > 0))
+    assert_true(np.array_equal(positions[4:], [10, 11]))
+
+
+def test_subsample_score():
+
+    # The documents with the highest scores are kept
+    labels = np.zeros(6)
+    scores = np.array([0.1, 0.9, 0.5, 0.3, 0.8, 0.2])
+    positions, sizes = subsample([0], [6], labels, 3, 'score', scores=scores)
+    assert_true(np.array_equal(positions, [1, 2, 4]))
+    assert_true(np.array_equal(sizes, [3]))
+
+
+def test_subsample_stratified():
+
+    # Negatives are spread over the ranking by score
+    labels = np.zeros(16)
+    scores = -np.arange(16.0)
+    random = np.random.RandomState(0)
+    positions, _ = subsample([0], [16], labels, 4, 'stratified', random,
+                             scores)
+    assert_equal(len(np.unique(positions // 4)), 4)
+    assert_true(np.array_equal(_radical_inverse(np.arange(4)),
+                               [0.0, 0.5, 0.25, 0.75]))
+
+
+@raises(ValueError)
+def test_subsample_score_requires_scores():
+    subsample([0], [6], np.zeros(6), 3, 'score')
@@ -0,0 +1,93 @@
+from io import BytesIO, StringIO
+
+import numpy as np
+from nose.tools import raises, assert_equal, assert_true
+
+from shoelace import svmrank
+from test.utils import dataset_txt
+
+
+def test_parse():
+
+    # Parse a small file with comments and an empty line
+    contents = StringIO("2 qid:10 1:0.5 3:1.5 # docid = 1\n"
+                        "\n"
+                        "0 qid:10 2:-2 # docid = 2\n"
+                        "1 qid:4 1:1e-3 2:3\n")
+    parsed = svmrank.parse(contents)
+
+    # Assert that every field was parsed correctly
+    assert_true(np.array_equal(parsed.labels, [2.0, 0.0, 1.0]))
+    assert_true(np.array_equal(parsed.qids, [0, 0, 1]))
+    assert_equal(parsed.query_ids, ['10', '4'])
+    assert_true(np.array_equal(parsed.indptr, [0, 2, 3, 5]))
+    assert_true(np.array_equal(parsed.indices, [1, 3, 2, 1, 2]))
+    assert_true(np.array_equal(parsed.values, [0.5, 1.5, -2.0, 1e-3, 3.0]))
+
+
+def test_parse_qids_as_written():
+
+    # Large and zero-padded qids should be kept exactly as written
+    contents = StringIO("1 qid:9007199254740993 1:1\n"
+                        "0 qid:9007199254740992 1:2\n"
+                        "2 qid:007 1:3\n"
+                        "1 qid:7 1:4\n"
+                        "0 qid:12345678901234567890 1:5\n"
+                        "1 qid:007 1:6\n")
+    parsed = svmrank.parse(contents)
+
+    assert_equal(parsed.query_ids, ['9007199254740993', '9007199254740992',
+                                    '007', '7', '12345678901234567890'])
+    assert_true(np.array_equal(parsed.qids, [0, 1, 2, 3, 4, 2]))
+    assert_true(np.array_equal(parsed.labels, [1, 0, 2, 1, 0, 1]))
+    assert_true(np.array_equal(parsed.values, [1, 2, 3, 4, 5, 6]))
+
+
+def test_parse_block_boundaries():
+
+    # Parsing with tiny blocks should give exactly the same result
+    expected = svmrank.parse(StringIO(dataset_txt))
+    parsed = svmrank.parse(BytesIO(dataset_txt.encode('utf-8')),
+                           block_size=100)
+
+    for field in svmrank.ParsedSvmRank._fields:
+        assert_true(np.array_equal(getattr(expected, field),
+                                   getattr(parsed, field)))
+
+
+def test_query_order_grouped():
+
+    # Rows that are already grouped by query should not be reordered
+    order, query_pointer = svmrank.query_order(np.array([0, 0, 1, 2, 2]), 3)
+    assert_equal(order, None)
+    assert_true(np.array_equal(query_pointer, [0, 2, 3, 5]))
+
+
+def test_query_order_scattered():
+
+    # Scattered rows are grouped while keeping their relative order
+    order, query_pointer = svmrank.query_order(np.array([0, 1, 0, 2, 1]), 3)
+    assert_true(np.array_equal(order, [0, 2, 1, 4, 3]))
+    assert_true(np.array_equal(query_pointer, [0, 2, 4, 5]))
+
+
+@raises(ValueError)
+def test_parse_malformed():
+
+    # A line without a qid should raise an error
+    svmrank.parse(StringIO("1 1:0.5 2:0.3\n"))
+
+
+def test_concatenate():
+
+    # Split a file in two parts in the middle of a query
+    lines = dataset_txt.splitlines(keepends=True)
+    first = svmrank.parse(StringIO(''.join(lines[:8])))
+    second = svmrank.parse(StringIO(''.join(lines[8:])))
+    expected = svmrank.parse(StringIO(dataset_txt))
+
+    # Stitching the parts together should give the same result
+    parsed = svmrank.concatenate([first, second])
+    for field in svmrank.ParsedSvmRank._fields:
+        assert_true(np.array_equal(getattr(expected, field),
+                                   getattr(parsed, field)))
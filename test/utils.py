@@ -30,11 +30,13 @@ dataset_txt = """0 qid:1 1:1.000000 2:1.000000 3:0.833333 4:0.871264 5:0 6:0 7:0
 """
 
 
-def get_dataset(normalize=False):
+def get_dataset(normalize=False, sparse=False):
     """
     Loads the sample data set from the text contents into a
     `class:shoelace.dataset.dataset.LtrDataset` object
 
+    :param normalize: Whether to perform query-level normalization
+    :param sparse: Whether to store the feature vectors in CSR layout
     :return: The sample data set 
     """
     # Get in-memory handle
@@ -44,7 +46,7 @@ def get_dataset(normalize=False):
         handle.seek(0)
 
         # Read data set from handle
-        dataset = LtrDataset.load_txt(handle, normalize)
+        dataset = LtrDataset.load_txt(handle, normalize, sparse=sparse)
 
         # Check if it loaded correctly
         assert dataset.nr_queries == 3